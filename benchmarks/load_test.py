@@ -0,0 +1,286 @@
+# load_test.py: Drives Workbench against local stand-ins for the Anthropic, Docs, Sheets and Drive APIs.
+#
+# Usage, from the repository root:
+#   python benchmarks/load_test.py --rows 200 --workers 16 --llm-latency 2.0 --llm-sigma 0.4
+#   python benchmarks/load_test.py --rows 500 --async --max-concurrency 100 --llm-429-rate 0.05
+#   python benchmarks/load_test.py --rows 100 --record trace.jsonl      # also record every LLM request
+#   python benchmarks/load_test.py --chain podcast_script_generation --drive-ids   # 44-character doc IDs
+#   python benchmarks/load_test.py --replay trace.jsonl --concurrency 32
+# Replay traces are JSONL, one messages.create request per line, either bare or as
+# {"offset": seconds since the start of the trace, "request": {...}} as written by --record.
+# No credentials or network access are needed: every API call goes to a server on 127.0.0.1.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Callable
+
+import httplib2
+from googleapiclient import discovery, discovery_cache
+from googleapiclient.http import HttpRequest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import notebook
+from mock_servers import LatencyModel, FaultModel, MockAnthropicServer, MockGoogleServer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(BENCHMARK_DIR, 'results', 'load_test.json')
+SPREADSHEET_ID = 'loadtest'
+
+def start_servers(args: argparse.Namespace) -> tuple:
+    anthropic_server = MockAnthropicServer(
+        latency=LatencyModel(args.llm_latency, args.llm_sigma, seed=args.seed),
+        faults=FaultModel(args.llm_error_rate, args.llm_429_rate, args.retry_after, error_status=529,
+                          seed=args.seed),
+        output_tokens=args.output_tokens,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        record_path=args.record
+    ).start()
+    google_server = MockGoogleServer(
+        latency=LatencyModel(args.google_latency, args.google_sigma, seed=args.seed),
+        faults=FaultModel(args.google_error_rate, args.google_429_rate, args.retry_after, error_status=503,
+                          seed=args.seed)
+    ).start()
+    return anthropic_server, google_server
+
+def http_build(google_url: str) -> Callable:
+    """
+    A build() that points the real API client at the local Google server, without credentials.
+    The bundled discovery document's rootUrl is replaced, so batch requests go there too.
+    """
+    def build(service_name: str, version: str, requestBuilder: Callable = HttpRequest, **kwargs):
+        document = json.loads(discovery_cache.get_static_doc(service_name, version))
+        document['rootUrl'] = google_url + '/'
+        return discovery.build_from_document(document, http=httplib2.Http(timeout=120),
+                                             requestBuilder=requestBuilder)
+    return build
+
+def load_namespace(anthropic_server: MockAnthropicServer, google_server: MockGoogleServer) -> Dict[str, Any]:
+    # The Anthropic clients read their endpoint and key from the environment
+    os.environ['ANTHROPIC_BASE_URL'] = anthropic_server.url
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'load-test')
+    return notebook.load_cells(build=http_build(google_server.url), offline_llm=False)
+
+def seed_workbench(google_server: MockGoogleServer, chains: List[str], rows: int, input_words: int,
+                   drive_ids: bool = False):
+    """
+    Publish the prompts and chains as documents and fill the input tab with rows cycling through chains.
+    With drive_ids, documents get 44-character IDs like real Drive files instead of their names.
+    """
+    document_id = notebook.drive_id if drive_ids else (lambda name: name)
+    for name, text in notebook.prompt_documents().items():
+        google_server.add_document(document_id(name), text)
+    for name, text in notebook.chain_documents(document_id).items():
+        google_server.add_document(document_id(name), text)
+    words = ' '.join(['sample'] * input_words)
+    google_server.set_tab(SPREADSHEET_ID, 'input', [['chain_url', 'chain_input']] + [
+        [notebook.doc_url(document_id(chains[i % len(chains)])), f"Row {i}: {words}"] for i in range(rows)
+    ])
+    google_server.set_tab(SPREADSHEET_ID, 'output', [])
+
+def timed(method: Callable, samples: List[float], lock: threading.Lock, is_async: bool = False) -> Callable:
+    """Wrap a per-row method so each call's duration is appended to samples."""
+    if is_async:
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                with lock:
+                    samples.append(time.perf_counter() - start)
+        return wrapper
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            with lock:
+                samples.append(time.perf_counter() - start)
+    return wrapper
+
+def api_call_report(servers: List, rows: int) -> Dict[str, Any]:
+    calls, injected = {}, {}
+    for server in servers:
+        calls.update(server.calls)
+        injected.update(server.injected)
+    return {
+        'api_calls': dict(sorted(calls.items())),
+        'api_calls_per_row': {name: count / rows for name, count in sorted(calls.items())} if rows else {},
+        'injected_errors': dict(sorted(injected.items()))
+    }
+
+def run_workbench(args: argparse.Namespace) -> Dict[str, Any]:
+    anthropic_server, google_server = start_servers(args)
+    try:
+        ns = load_namespace(anthropic_server, google_server)
+        chains = list(notebook.chain_documents()) if args.chain == 'all' else args.chain.split(',')
+        seed_workbench(google_server, chains, args.rows, args.input_words, args.drive_ids)
+
+        workbench = ns['Workbench'](
+            f"https://docs.google.com/spreadsheets/d/{SPREADSHEET_ID}/edit#gid=0",
+            max_workers=args.workers, journal_dir=tempfile.mkdtemp(prefix='load_test_'),
+            trace_dir=args.trace_dir
+        )
+        row_latencies, lock = [], threading.Lock()
+        workbench.execute_chain = timed(workbench.execute_chain, row_latencies, lock)
+        workbench.execute_chain_async = timed(workbench.execute_chain_async, row_latencies, lock, is_async=True)
+
+        start = time.perf_counter()
+        if args.use_async:
+            import asyncio
+            asyncio.run(workbench.execute_all_chains_async(max_concurrency=args.max_concurrency))
+        else:
+            workbench.execute_all_chains()
+        elapsed = time.perf_counter() - start
+
+        metrics = ns['METRICS'].summary()
+        report = {
+            'mode': 'async' if args.use_async else 'threads',
+            'rows': args.rows,
+            'failed_rows': len(workbench.errors),
+            'errors': sorted({str(error) for error in workbench.errors.values()})[:10],
+            'elapsed': elapsed,
+            'rows_per_minute': args.rows / elapsed * 60 if elapsed else 0.0,
+            'row_latency': ns['MetricsRecorder'].distribution(row_latencies),
+            'llm_calls': metrics['run']['llm'],
+            'output_rows_written': max(len(google_server.get_tab(SPREADSHEET_ID, 'output')) - 1, 0),
+            'scheduler': ns['LLM_SCHEDULER'].metrics()
+        }
+        report.update(api_call_report([anthropic_server, google_server], args.rows))
+        return report
+    finally:
+        anthropic_server.stop()
+        google_server.stop()
+
+def read_trace(path: str) -> List[tuple]:
+    """(offset, request) pairs from a JSONL trace; bare requests get offset 0."""
+    entries = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'request' in entry:
+                entries.append((float(entry.get('offset', 0.0)), entry['request']))
+            else:
+                entries.append((0.0, entry))
+    return entries
+
+def run_replay(args: argparse.Namespace) -> Dict[str, Any]:
+    anthropic_server, google_server = start_servers(args)
+    try:
+        ns = load_namespace(anthropic_server, google_server)
+        provider = ns['AnthropicProvider']()
+        scheduler = provider.scheduler
+        entries = read_trace(args.replay)
+        latencies, errors, lock = [], [], threading.Lock()
+        start = time.perf_counter()
+
+        def send(entry: tuple):
+            offset, request = entry
+            # Replay the non-streaming form; the mock answers both the same way
+            request = {key: value for key, value in request.items() if key != 'stream'}
+            if args.preserve_timing:
+                time.sleep(max(0.0, start + offset / args.speed - time.perf_counter()))
+            sent = time.perf_counter()
+            try:
+                scheduler.call(lambda: provider._create_with_headers(request), scheduler.estimate_tokens(request))
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                return
+            with lock:
+                latencies.append(time.perf_counter() - sent)
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(send, entries))
+        elapsed = time.perf_counter() - start
+
+        report = {
+            'mode': 'replay',
+            'trace': args.replay,
+            'requests': len(entries),
+            'failed_requests': len(errors),
+            'errors': sorted(set(errors))[:10],
+            'elapsed': elapsed,
+            'requests_per_minute': len(entries) / elapsed * 60 if elapsed else 0.0,
+            'request_latency': ns['MetricsRecorder'].distribution(latencies),
+            'scheduler': scheduler.metrics()
+        }
+        report.update(api_call_report([anthropic_server], len(entries)))
+        return report
+    finally:
+        anthropic_server.stop()
+        google_server.stop()
+
+def print_report(report: Dict[str, Any]):
+    latency = report.get('row_latency') or report.get('request_latency')
+    if report['mode'] == 'replay':
+        print(f"Replayed {report['requests']} requests in {report['elapsed']:.1f}s "
+              f"({report['requests_per_minute']:.0f}/min), {report['failed_requests']} failed")
+    else:
+        print(f"{report['rows']} rows ({report['mode']}) in {report['elapsed']:.1f}s: "
+              f"{report['rows_per_minute']:.0f} rows/min, {report['failed_rows']} failed")
+    print(f"latency p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  p99 {latency['p99']:.3f}s  "
+          f"max {latency['max']:.3f}s")
+    scheduler = report['scheduler']
+    print(f"scheduler: {scheduler['retries']} retries, {scheduler['throttled']} throttled, "
+          f"avg wait {scheduler['avg_wait']:.3f}s, concurrency limit {scheduler['concurrency_limit']}")
+    print("API calls per row:" if report['mode'] != 'replay' else "API calls per request:")
+    for name, per_row in report['api_calls_per_row'].items():
+        print(f"  {name:<32} {per_row:>8.2f}  ({report['api_calls'][name]} total)")
+    if report['injected_errors']:
+        print(f"injected errors: {report['injected_errors']}")
+    for error in report['errors']:
+        print(f"error: {error}")
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Load test Workbench against local mock API servers.')
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--chain', default='example_chain',
+                        help="chain file name(s) in src/chains, comma separated, or 'all'")
+    parser.add_argument('--input-words', type=int, default=200, help='words of synthetic input per row')
+    parser.add_argument('--drive-ids', action='store_true', help='publish documents under 44-character Drive IDs')
+    parser.add_argument('--workers', type=int, default=8, help='rows in flight with the thread pool')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='use execute_all_chains_async')
+    parser.add_argument('--max-concurrency', type=int, default=100, help='rows in flight with --async')
+    parser.add_argument('--llm-latency', type=float, default=1.0, help='median Messages API latency (s)')
+    parser.add_argument('--llm-sigma', type=float, default=0.3, help='log-normal shape of LLM latency')
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help='fraction of 529 overloaded errors')
+    parser.add_argument('--llm-429-rate', type=float, default=0.0, help='fraction of 429 rate limit errors')
+    parser.add_argument('--output-tokens', type=int, default=200)
+    parser.add_argument('--requests-per-minute', type=int, default=4000, help='advertised request limit')
+    parser.add_argument('--tokens-per-minute', type=int, default=400000, help='advertised input token limit')
+    parser.add_argument('--google-latency', type=float, default=0.05, help='median Docs/Sheets latency (s)')
+    parser.add_argument('--google-sigma', type=float, default=0.3)
+    parser.add_argument('--google-error-rate', type=float, default=0.0)
+    parser.add_argument('--google-429-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1.0, help='retry-after sent with injected 429s')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--record', default=None, help='append every LLM request to this JSONL trace')
+    parser.add_argument('--replay', default=None, help='replay a JSONL trace instead of running Workbench')
+    parser.add_argument('--concurrency', type=int, default=16, help='requests in flight during --replay')
+    parser.add_argument('--preserve-timing', action='store_true', help='send replayed requests at their offsets')
+    parser.add_argument('--speed', type=float, default=1.0, help='time compression for --preserve-timing')
+    parser.add_argument('--trace-dir', default=None, help='also write span traces of the run here')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    args = parser.parse_args(argv)
+
+    report = run_replay(args) if args.replay else run_workbench(args)
+    report['config'] = vars(args)
+    print_report(report)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,526 @@
+# mock_servers.py: Local HTTP stand-ins for the Anthropic Messages API and the Docs, Sheets and Drive APIs.
+
+import email.parser
+import json
+import math
+import random
+import re
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+
+class LatencyModel:
+    """
+    The LatencyModel class samples response latencies from a log-normal distribution given its
+    median and shape (sigma); sigma 0 gives a fixed latency.
+    """
+
+    def __init__(self, median: float = 0.0, sigma: float = 0.0, seed: int = None):
+        self.median = median
+        self.sigma = sigma
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        with self.lock:
+            return self.median * math.exp(self.random.gauss(0.0, self.sigma)) if self.sigma else self.median
+
+class FaultModel:
+    """
+    The FaultModel class decides, per request, whether to answer with an injected error:
+    a 429 with a retry-after header at rate_limit_rate, or a server error at error_rate.
+    """
+
+    def __init__(self, error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = 1.0,
+                 error_status: int = 500, seed: int = None):
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample(self) -> Optional[int]:
+        """Return the status code to inject, or None to answer normally."""
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.rate_limit_rate:
+            return 429
+        if draw < self.rate_limit_rate + self.error_rate:
+            return self.error_status
+        return None
+
+class MockServer:
+    """
+    The MockServer class runs a ThreadingHTTPServer on a free localhost port in a background thread
+    and counts requests per endpoint. Subclasses implement endpoint() and handle().
+    """
+
+    def __init__(self, latency: LatencyModel = None, faults: FaultModel = None):
+        self.latency = latency or LatencyModel()
+        self.faults = faults or FaultModel()
+        self.calls = Counter()
+        self.injected = Counter()
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, endpoint: str, injected: int = None):
+        with self.lock:
+            self.calls[endpoint] += 1
+            if injected is not None:
+                self.injected[f"{endpoint} {injected}"] += 1
+
+    def reset_counts(self):
+        with self.lock:
+            self.calls.clear()
+            self.injected.clear()
+
+    def start(self, port: int = 0) -> 'MockServer':
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _dispatch(self, method: str):
+                parsed = urllib.parse.urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                query = dict(urllib.parse.parse_qsl(parsed.query))
+                mock.respond(self, method, urllib.parse.unquote(parsed.path), query, body)
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_PUT(self):
+                self._dispatch('PUT')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    @staticmethod
+    def send_json(handler: BaseHTTPRequestHandler, status: int, payload: Any, headers: Dict[str, str] = None):
+        encoded = json.dumps(payload).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(encoded)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(encoded)
+
+    def respond(self, handler: BaseHTTPRequestHandler, method: str, path: str, query: Dict[str, str], body: bytes):
+        # Faults are decided first so a failed request has no side effects, as with the real APIs
+        injected = self.faults.sample()
+        self.count(self.endpoint(method, path), injected)
+        time.sleep(self.latency.sample())
+        if injected is not None:
+            status, payload, headers = self.error_response(injected)
+        else:
+            status, payload, headers = self.handle(method, path, query, body)
+        if callable(payload):
+            # Streaming responses write their own body
+            payload(handler)
+            return
+        self.send_json(handler, status, payload, headers)
+
+    def error_response(self, status: int) -> tuple:
+        headers = {'retry-after': str(self.faults.retry_after)} if status == 429 else {}
+        return status, {'error': {'code': status, 'message': 'Injected error', 'status': 'UNAVAILABLE'}}, headers
+
+    def endpoint(self, method: str, path: str) -> str:
+        """The name requests to method and path are counted under."""
+        raise NotImplementedError
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: bytes) -> tuple:
+        """Return (status, JSON payload or streaming writer, headers)."""
+        raise NotImplementedError
+
+class MockAnthropicServer(MockServer):
+    """
+    The MockAnthropicServer class answers POST /v1/messages like the Anthropic Messages API,
+    including anthropic-ratelimit-* headers and server-sent event streams. Every request body
+    can be appended to a JSONL file for later replay. Message Batches are created, polled and
+    read back under /v1/messages/batches; a batch ends after batch_polls retrievals.
+    """
+
+    def __init__(self, latency: LatencyModel = None, faults: FaultModel = None,
+                 output_tokens: int = 200, requests_per_minute: int = 4000, tokens_per_minute: int = 400000,
+                 record_path: str = None, batch_polls: int = 1):
+        super().__init__(latency, faults)
+        self.output_tokens = output_tokens
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.record_path = record_path
+        self.batch_polls = batch_polls
+        # {batch_id: {'requests': [...], 'polls': retrievals so far, 'created_at': timestamp}}
+        self.batches = {}
+        self.started = time.monotonic()
+
+    def rate_limit_headers(self) -> Dict[str, str]:
+        return {
+            'anthropic-ratelimit-requests-limit': str(self.requests_per_minute),
+            'anthropic-ratelimit-input-tokens-limit': str(self.tokens_per_minute),
+            'request-id': f"req_{random.getrandbits(48):012x}"
+        }
+
+    def error_response(self, status: int) -> tuple:
+        error_type = {429: 'rate_limit_error', 529: 'overloaded_error'}.get(status, 'api_error')
+        headers = self.rate_limit_headers()
+        if status == 429:
+            headers['retry-after'] = str(self.faults.retry_after)
+        return status, {'type': 'error', 'error': {'type': error_type, 'message': 'Injected error'}}, headers
+
+    def record(self, request: Dict[str, Any]):
+        if not self.record_path:
+            return
+        with self.lock:
+            with open(self.record_path, 'a') as f:
+                f.write(json.dumps({'offset': time.monotonic() - self.started, 'request': request}) + '\n')
+
+    def message(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = json.dumps(request.get('messages', [])) + json.dumps(request.get('system', ''))
+        text = ' '.join(['lorem'] * self.output_tokens)
+        return {
+            'id': f"msg_{random.getrandbits(48):012x}",
+            'type': 'message',
+            'role': 'assistant',
+            'model': request.get('model', 'mock'),
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn',
+            'stop_sequence': None,
+            'usage': {'input_tokens': len(prompt) // 4 + 1, 'output_tokens': self.output_tokens,
+                      'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0}
+        }
+
+    def stream_writer(self, message: Dict[str, Any], headers: Dict[str, str]):
+        def write(handler: BaseHTTPRequestHandler):
+            handler.send_response(200)
+            handler.send_header('Content-Type', 'text/event-stream')
+            handler.send_header('Connection', 'close')
+            for key, value in headers.items():
+                handler.send_header(key, value)
+            handler.end_headers()
+            start = dict(message, content=[], stop_reason=None, usage=dict(message['usage'], output_tokens=0))
+            events = [('message_start', {'type': 'message_start', 'message': start}),
+                      ('content_block_start', {'type': 'content_block_start', 'index': 0,
+                                               'content_block': {'type': 'text', 'text': ''}})]
+            for word in message['content'][0]['text'].split(' '):
+                events.append(('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                                       'delta': {'type': 'text_delta', 'text': word + ' '}}))
+            events += [('content_block_stop', {'type': 'content_block_stop', 'index': 0}),
+                       ('message_delta', {'type': 'message_delta',
+                                          'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                          'usage': {'output_tokens': message['usage']['output_tokens']}}),
+                       ('message_stop', {'type': 'message_stop'})]
+            try:
+                for event, data in events:
+                    handler.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8'))
+                handler.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # The client stopped the stream early
+                pass
+            handler.close_connection = True
+        return write
+
+    def batch(self, batch_id: str) -> Dict[str, Any]:
+        """The MessageBatch object for batch_id as the API returns it."""
+        with self.lock:
+            batch = self.batches[batch_id]
+            ended = batch['polls'] >= self.batch_polls
+            count = len(batch['requests'])
+        timestamp = lambda offset: time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(batch['created_at'] + offset))
+        return {
+            'id': batch_id,
+            'type': 'message_batch',
+            'processing_status': 'ended' if ended else 'in_progress',
+            'request_counts': {'processing': 0 if ended else count, 'succeeded': count if ended else 0,
+                               'errored': 0, 'canceled': 0, 'expired': 0},
+            'created_at': timestamp(0),
+            'expires_at': timestamp(24 * 3600),
+            'ended_at': timestamp(1) if ended else None,
+            'archived_at': None,
+            'cancel_initiated_at': None,
+            'results_url': f"{self.url}/v1/messages/batches/{batch_id}/results" if ended else None
+        }
+
+    def batch_results_writer(self, batch_id: str):
+        with self.lock:
+            requests = list(self.batches[batch_id]['requests'])
+        lines = ''.join(json.dumps({'custom_id': request['custom_id'],
+                                    'result': {'type': 'succeeded', 'message': self.message(request['params'])}}) + '\n'
+                        for request in requests).encode('utf-8')
+
+        def write(handler: BaseHTTPRequestHandler):
+            handler.send_response(200)
+            handler.send_header('Content-Type', 'application/binary')
+            handler.send_header('Content-Length', str(len(lines)))
+            handler.end_headers()
+            handler.wfile.write(lines)
+        return write
+
+    def handle_batches(self, method: str, path: str, body: bytes) -> tuple:
+        match = re.fullmatch(r'/v1/messages/batches(?:/([^/]+))?(/results)?', path)
+        batch_id, results = match.groups()
+        if batch_id is None:
+            requests = json.loads(body or b'{}').get('requests', [])
+            for request in requests:
+                self.record(request['params'])
+            batch_id = f"msgbatch_{random.getrandbits(48):012x}"
+            with self.lock:
+                self.batches[batch_id] = {'requests': requests, 'polls': 0, 'created_at': time.time()}
+            return 200, self.batch(batch_id), {}
+        if batch_id not in self.batches:
+            return 404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': path}}, {}
+        if results:
+            if self.batch(batch_id)['processing_status'] != 'ended':
+                return 400, {'type': 'error', 'error': {'type': 'invalid_request_error',
+                                                        'message': 'Batch has not ended'}}, {}
+            return 200, self.batch_results_writer(batch_id), {}
+        with self.lock:
+            self.batches[batch_id]['polls'] += 1
+        return 200, self.batch(batch_id), {}
+
+    def endpoint(self, method: str, path: str) -> str:
+        if method == 'POST' and path.endswith('/v1/messages'):
+            return 'anthropic.messages'
+        if method == 'POST' and path.endswith('/v1/messages/batches'):
+            return 'anthropic.batches.create'
+        if method == 'GET' and re.search(r'/v1/messages/batches/[^/]+/results$', path):
+            return 'anthropic.batches.results'
+        if method == 'GET' and re.search(r'/v1/messages/batches/[^/]+$', path):
+            return 'anthropic.batches.retrieve'
+        return 'anthropic.unknown'
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: bytes) -> tuple:
+        endpoint = self.endpoint(method, path)
+        if endpoint == 'anthropic.unknown':
+            return 404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': path}}, {}
+        if endpoint.startswith('anthropic.batches'):
+            return self.handle_batches(method, path, body)
+        request = json.loads(body or b'{}')
+        self.record(request)
+        message = self.message(request)
+        headers = self.rate_limit_headers()
+        if request.get('stream'):
+            return 200, self.stream_writer(message, headers), headers
+        return 200, message, headers
+
+class MockGoogleServer(MockServer):
+    """
+    The MockGoogleServer class serves the subset of the Docs v1, Sheets v4 and Drive v3 REST APIs
+    the notebook uses, from in-memory documents, sheet tabs and files.
+    """
+
+    def __init__(self, latency: LatencyModel = None, faults: FaultModel = None):
+        super().__init__(latency, faults)
+        self.documents = {}
+        self.revisions = {}
+        self.sheets = {}
+        # {(spreadsheet_id, tab): rows in the tab's grid}
+        self.grid_rows = {}
+        self.files = {}
+
+    def add_document(self, document_id: str, text: str):
+        with self.lock:
+            self.documents[document_id] = text
+            self.revisions[document_id] = self.revisions.get(document_id, 0) + 1
+            revision = self.revisions[document_id]
+        # Every document is also a Drive file whose version follows the document revision
+        self.add_file(document_id, document_id, 'application/vnd.google-apps.document', version=str(revision),
+                      modifiedTime=time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()))
+
+    def set_tab(self, spreadsheet_id: str, tab: str, rows: List[List[Any]], grid_rows: int = None):
+        """Replace a tab's rows; its grid has grid_rows rows, by default 1000 or enough for rows."""
+        with self.lock:
+            self.sheets.setdefault(spreadsheet_id, {})[tab] = [list(row) for row in rows]
+            self.grid_rows[(spreadsheet_id, tab)] = grid_rows or max(1000, len(rows))
+
+    def get_tab(self, spreadsheet_id: str, tab: str) -> List[List[Any]]:
+        with self.lock:
+            return [list(row) for row in self.sheets.get(spreadsheet_id, {}).get(tab, [])]
+
+    def add_file(self, file_id: str, name: str, mime_type: str, parents: List[str] = None, **fields: Any):
+        with self.lock:
+            self.files[file_id] = dict(fields, id=file_id, name=name, mimeType=mime_type, parents=parents or [],
+                                       modifiedTime=fields.get('modifiedTime', '2024-01-01T00:00:00.000Z'))
+
+    @staticmethod
+    def _a1_bounds(range_name: str) -> tuple:
+        """Parse 'tab!A2:C10' or 'tab!2:10' into (tab, first row, last row); missing bounds are None."""
+        tab, _, cells = range_name.partition('!')
+        rows = [int(number) for number in re.findall(r'[A-Z]*(\d+)', cells)]
+        first = rows[0] if rows else 1
+        last = rows[1] if len(rows) > 1 else (None if ':' in cells or not rows else rows[0])
+        return tab.strip("'"), first, last
+
+    def _write(self, spreadsheet_id: str, range_name: str, values: List[List[Any]]):
+        tab, first, _ = self._a1_bounds(range_name)
+        with self.lock:
+            rows = self.sheets.setdefault(spreadsheet_id, {}).setdefault(tab, [])
+            while len(rows) < first - 1 + len(values):
+                rows.append([])
+            for i, row in enumerate(values):
+                rows[first - 1 + i] = [str(value) for value in row]
+
+    def _document(self, document_id: str) -> Dict[str, Any]:
+        text = self.documents[document_id]
+        content = [{'paragraph': {'elements': [{'textRun': {'content': line}}]}}
+                   for line in text.splitlines(keepends=True)]
+        return {'documentId': document_id, 'revisionId': f"rev{self.revisions[document_id]}",
+                'body': {'content': content}}
+
+    ENDPOINTS = [
+        ('GET', r'/v1/documents/[^/]+', 'docs.get'),
+        ('GET', r'/v4/spreadsheets/[^/:]+', 'sheets.get'),
+        ('POST', r'/v4/spreadsheets/[^/:]+/values:batchUpdate', 'sheets.values.batchUpdate'),
+        ('POST', r'/v4/spreadsheets/[^/:]+/values/.+:clear', 'sheets.values.clear'),
+        ('PUT', r'/v4/spreadsheets/[^/:]+/values/.+', 'sheets.values.update'),
+        ('GET', r'/v4/spreadsheets/[^/:]+/values/.+', 'sheets.values.get'),
+        ('GET', r'(?:/drive/v3)?/files', 'drive.files.list'),
+        ('POST', r'(?:/drive/v3)?/files', 'drive.files.create'),
+        ('POST', r'(?:/drive/v3)?/files/[^/]+/copy', 'drive.files.copy'),
+        ('GET', r'(?:/drive/v3)?/files/[^/]+', 'drive.files.get'),
+        ('POST', r'/batch(?:/.*)?', 'google.batch'),
+    ]
+
+    def endpoint(self, method: str, path: str) -> str:
+        for endpoint_method, pattern, name in self.ENDPOINTS:
+            if method == endpoint_method and re.fullmatch(pattern, path):
+                return name
+        return 'google.unknown'
+
+    def handle_batch(self, body: bytes) -> tuple:
+        """Answer a multipart/mixed batch request by handling each embedded HTTP request in turn."""
+        # The client omits the multipart headers from the body; its first line carries the boundary
+        boundary = body.split(b'\n', 1)[0].strip()[2:].decode('utf-8')
+        message = email.parser.BytesParser().parsebytes(
+            f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n'.encode('utf-8') + body)
+        parts = []
+        for part in message.get_payload():
+            head, _, request_body = part.get_payload().replace('\r\n', '\n').partition('\n\n')
+            method, target = head.splitlines()[0].split(' ')[:2]
+            target = urllib.parse.urlsplit(target)
+            status, payload, _ = self.handle(method, urllib.parse.unquote(target.path),
+                                             dict(urllib.parse.parse_qsl(target.query)),
+                                             request_body.encode('utf-8'))
+            encoded = json.dumps(payload)
+            # Long Content-IDs arrive folded over several lines; unfold them so the client can parse the reply
+            content_id = ' '.join((part['Content-ID'] or '').split()).replace('<', '<response-', 1)
+            parts.append(f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: {content_id}\r\n\r\n"
+                         f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\n"
+                         f"Content-Type: application/json\r\n\r\n{encoded}\r\n")
+        encoded = (''.join(parts) + f"--{boundary}--\r\n").encode('utf-8')
+
+        def write(handler: BaseHTTPRequestHandler):
+            handler.send_response(200)
+            handler.send_header('Content-Type', f'multipart/mixed; boundary="{boundary}"')
+            handler.send_header('Content-Length', str(len(encoded)))
+            handler.end_headers()
+            handler.wfile.write(encoded)
+        return 200, write, {}
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: bytes) -> tuple:
+        not_found = {'error': {'code': 404, 'message': f"Not found: {path}", 'status': 'NOT_FOUND'}}
+        if re.fullmatch(r'/batch(?:/.*)?', path):
+            return self.handle_batch(body)
+        payload = json.loads(body) if body else {}
+
+        match = re.fullmatch(r'/v1/documents/([^/]+)', path)
+        if match:
+            if match.group(1) not in self.documents:
+                return 404, not_found, {}
+            document = self._document(match.group(1))
+            if query.get('fields') == 'revisionId':
+                document = {'revisionId': document['revisionId']}
+            return 200, document, {}
+
+        match = re.fullmatch(r'/v4/spreadsheets/([^/:]+)(.*)', path)
+        if match:
+            spreadsheet_id, rest = match.groups()
+            if rest == '' and method == 'GET':
+                tabs = list(self.sheets.get(spreadsheet_id, {})) or ['Sheet1']
+                return 200, {'spreadsheetId': spreadsheet_id, 'sheets': [
+                    {'properties': {'sheetId': index, 'title': title, 'gridProperties': {
+                        'rowCount': self.grid_rows.get((spreadsheet_id, title), 1000), 'columnCount': 26}}}
+                    for index, title in enumerate(tabs)
+                ]}, {}
+            if rest == '/values:batchUpdate':
+                for entry in payload.get('data', []):
+                    self._write(spreadsheet_id, entry['range'], entry['values'])
+                return 200, {'spreadsheetId': spreadsheet_id}, {}
+            match = re.fullmatch(r'/values/(.+?)(:clear)?', rest)
+            if match:
+                range_name, clear = match.groups()
+                tab, first, last = self._a1_bounds(range_name)
+                if clear:
+                    with self.lock:
+                        self.sheets.setdefault(spreadsheet_id, {})[tab] = []
+                    return 200, {'clearedRange': range_name}, {}
+                if method == 'PUT':
+                    self._write(spreadsheet_id, range_name, payload.get('values', []))
+                    return 200, {'updatedRange': range_name}, {}
+                rows = self.get_tab(spreadsheet_id, tab)
+                rows = rows[first - 1:last] if last else rows[first - 1:]
+                # Like the API, trailing empty rows are dropped and an empty range has no values
+                while rows and not any(rows[-1]):
+                    rows.pop()
+                return 200, {'range': range_name, 'values': rows} if rows else {'range': range_name}, {}
+            return 404, not_found, {}
+
+        match = re.fullmatch(r'(?:/drive/v3)?/files(?:/([^/]+))?(/copy)?', path)
+        if match:
+            file_id, copy = match.groups()
+            if file_id is None:
+                parent = re.search(r"'([^']+)' in parents", query.get('q', ''))
+                with self.lock:
+                    files = [dict(f) for f in self.files.values()
+                             if not f.get('trashed') and (parent is None or parent.group(1) in f['parents'])]
+                if method == 'POST':
+                    new_id = f"file{random.getrandbits(32):08x}"
+                    self.add_file(new_id, payload.get('name', 'Untitled'), payload.get('mimeType', ''),
+                                  payload.get('parents'))
+                    return 200, {'id': new_id}, {}
+                # Pages of pageSize files, with the offset of the next page as its token
+                start = int(query.get('pageToken') or 0)
+                end = start + int(query.get('pageSize') or 100)
+                page = {'files': files[start:end]}
+                if end < len(files):
+                    page['nextPageToken'] = str(end)
+                return 200, page, {}
+            if file_id not in self.files:
+                return 404, not_found, {}
+            if copy:
+                new_id = f"file{random.getrandbits(32):08x}"
+                source = self.files[file_id]
+                self.add_file(new_id, payload.get('name', source['name']), source['mimeType'],
+                              payload.get('parents', source['parents']))
+                if file_id in self.documents:
+                    self.add_document(new_id, self.documents[file_id])
+                return 200, {'id': new_id, 'name': self.files[new_id]['name']}, {}
+            return 200, dict(self.files[file_id]), {}
+
+        return 404, not_found, {}
@@ -0,0 +1,228 @@
+# notebook.py: Loads the notebook cells in src/ into one namespace, with Google and Anthropic clients stubbed offline.
+
+import base64
+import hashlib
+import os
+import re
+import sys
+import types
+from typing import Dict, Any, List, Callable
+
+import anthropic
+import jinja2
+import yaml
+from google.auth.credentials import AnonymousCredentials
+from jinja2 import meta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT, 'src')
+PROMPTS_DIR = os.path.join(SRC_DIR, 'prompts')
+CHAINS_DIR = os.path.join(SRC_DIR, 'chains')
+
+# Cells in notebook order; each cell relies on globals defined by the cells before it
+CELL_ORDER = [
+    'tracing', 'metrics', 'google_services', 'google_drive', 'google_doc', 'google_sheet', 'llm_api', 'sources',
+    'prompt_manager', 'run_journal', 'output_sinks', 'chain_manager', 'steps', 'workbench'
+]
+
+def doc_url(document_id: str) -> str:
+    return f"https://docs.google.com/document/d/{document_id}/edit"
+
+def drive_id(name: str) -> str:
+    """A 44-character ID shaped like a real Drive file ID, derived from name."""
+    return '1' + base64.urlsafe_b64encode(hashlib.sha256(name.encode('utf-8')).digest()).decode('ascii').rstrip('=')
+
+class OfflineRequest:
+    """An HttpRequest stand-in whose execute() returns a precomputed result."""
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def execute(self, http=None, num_retries=0):
+        return self.fn()
+
+class OfflineDocs:
+    """
+    The OfflineDocs class serves documents().get from an in-memory {document_id: text} store,
+    returning the same paragraph structure as the Docs API.
+    """
+
+    def __init__(self, documents: Dict[str, str]):
+        self.store = documents
+
+    @staticmethod
+    def to_document(text: str, revision_id: str) -> Dict[str, Any]:
+        content = [{'paragraph': {'elements': [{'textRun': {'content': line}}]}}
+                   for line in text.splitlines(keepends=True)]
+        return {'revisionId': revision_id, 'body': {'content': content}}
+
+    def documents(self):
+        return self
+
+    @staticmethod
+    def revision_id(text: str) -> str:
+        return f"rev-{hash(text) & 0xffffffff:x}"
+
+    def get(self, documentId: str, fields: str = None, **kwargs):
+        def fetch():
+            if documentId not in self.store:
+                raise ValueError(f"Unknown offline document: {documentId}")
+            text = self.store[documentId]
+            revision_id = self.revision_id(text)
+            if fields == 'revisionId':
+                return {'revisionId': revision_id}
+            return self.to_document(text, revision_id)
+        return OfflineRequest(fetch)
+
+    def new_batch_http_request(self, callback: Callable = None):
+        return OfflineBatch(callback)
+
+class OfflineBatch:
+    """A BatchHttpRequest stand-in that runs its requests in order and reports each to the callback."""
+
+    def __init__(self, callback: Callable):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request: OfflineRequest, request_id: str = None):
+        self.requests.append((request_id or str(len(self.requests)), request))
+
+    def execute(self, http=None):
+        for request_id, request in self.requests:
+            try:
+                response = request.execute()
+            except Exception as e:
+                self.callback(request_id, None, e)
+            else:
+                self.callback(request_id, response, None)
+
+class OfflineDrive:
+    """
+    The OfflineDrive class serves files().get metadata for the documents of an OfflineDocs store,
+    with the document's revision as its Drive version, and batches of such requests.
+    """
+
+    def __init__(self, docs: OfflineDocs):
+        self.docs = docs
+
+    def files(self):
+        return self
+
+    def get(self, fileId: str, fields: str = None, **kwargs):
+        def fetch():
+            if fileId not in self.docs.store:
+                raise ValueError(f"Unknown offline file: {fileId}")
+            return {'id': fileId, 'version': self.docs.revision_id(self.docs.store[fileId]),
+                    'modifiedTime': '2024-01-01T00:00:00.000Z'}
+        return OfflineRequest(fetch)
+
+    def new_batch_http_request(self, callback: Callable = None):
+        return OfflineBatch(callback)
+
+class OfflineMessages:
+    """A messages resource that answers every request with a short canned reply."""
+
+    def create(self, **kwargs):
+        return anthropic.types.Message(
+            id='msg_offline', type='message', role='assistant', model=kwargs.get('model', 'offline'),
+            content=[{'type': 'text', 'text': 'offline response'}], stop_reason='end_turn',
+            stop_sequence=None, usage={'input_tokens': 1, 'output_tokens': 1}
+        )
+
+class OfflineAnthropic:
+    def __init__(self, **kwargs):
+        self.messages = OfflineMessages()
+
+def load_cells(documents: Dict[str, str] = None, cells: List[str] = None, build: Callable = None,
+               offline_llm: bool = True) -> Dict[str, Any]:
+    """
+    Execute the notebook cells into a fresh namespace and return it.
+    By default Docs requests and Drive metadata are answered from documents, Sheets is unavailable and
+    the Anthropic client returns canned replies. A custom build function replaces the Google stub,
+    and offline_llm=False keeps the real Anthropic client.
+    """
+    colab = types.ModuleType('google.colab')
+    colab.auth = types.SimpleNamespace(authenticate_user=lambda: None)
+    colab.drive = types.SimpleNamespace(mount=lambda path: None)
+    sys.modules['google.colab'] = colab
+    import google
+    google.colab = colab
+
+    docs = OfflineDocs(documents if documents is not None else {})
+    drive = OfflineDrive(docs)
+
+    def offline_build(service_name: str, version: str, **kwargs):
+        if service_name == 'docs':
+            return docs
+        if service_name == 'drive':
+            return drive
+        raise RuntimeError(f"The {service_name} API is not available offline")
+
+    namespace = {'__name__': 'notebook', 'display': print}
+    for cell in cells or CELL_ORDER:
+        path = os.path.join(SRC_DIR, f"{cell}.py")
+        # Cell magics such as %%capture are not Python
+        source = '\n'.join(line for line in open(path).read().splitlines() if not line.startswith('%%'))
+        exec(compile(source, path, 'exec'), namespace)
+        # Cells import build themselves, so the stub is reinstated after each one
+        namespace['build'] = build or offline_build
+    if offline_llm:
+        namespace['anthropic'] = types.SimpleNamespace(**{**vars(anthropic), 'Anthropic': OfflineAnthropic})
+    namespace['DEBUG'] = False
+    if 'GoogleServices' in namespace:
+        # Already "authenticated": requests carry no credentials and no default credentials are looked up
+        namespace['GOOGLE_SERVICES'] = namespace['GoogleServices'](credentials=AnonymousCredentials())
+    # Local template names, e.g. in {% include %}, resolve against the repository's templates
+    namespace['LOCAL_TEMPLATE_DIRS'] = [PROMPTS_DIR, CHAINS_DIR]
+    namespace['OFFLINE_DOCS'] = docs
+    return namespace
+
+def prompt_documents() -> Dict[str, str]:
+    """The templates in src/prompts keyed by file name without extension."""
+    documents = {}
+    for file_name in sorted(os.listdir(PROMPTS_DIR)):
+        if file_name.endswith('.txt'):
+            with open(os.path.join(PROMPTS_DIR, file_name)) as f:
+                documents[os.path.splitext(file_name)[0]] = f.read()
+    return documents
+
+def chain_documents(document_id: Callable[[str], str] = None) -> Dict[str, str]:
+    """
+    The chains in src/chains keyed by file name without extension. Template references are
+    rewritten to offline document URLs named after the template, e.g. summarize -> summarize.txt,
+    or to document_id(name) if given.
+    """
+    document_id = document_id or (lambda name: name)
+    documents = {}
+    for file_name in sorted(os.listdir(CHAINS_DIR)):
+        if not file_name.endswith('.yaml'):
+            continue
+        with open(os.path.join(CHAINS_DIR, file_name)) as f:
+            config = yaml.safe_load(f)
+        for step in config.get('steps', []):
+            templates = []
+            for template in step.get('prompt_templates') or []:
+                name = template['name'] if isinstance(template, dict) else os.path.splitext(template)[0]
+                templates.append({'name': name, 'url': doc_url(document_id(name))})
+            step['prompt_templates'] = templates
+        documents[os.path.splitext(file_name)[0]] = yaml.safe_dump(config, sort_keys=False)
+    return documents
+
+def template_variables(template: str) -> Dict[str, str]:
+    """Synthetic values for every variable a template references."""
+    variables = meta.find_undeclared_variables(jinja2.Environment().parse(template))
+    return {name: f"sample {name} " * 20 for name in variables}
+
+def synthetic_document(paragraphs: int, words_per_paragraph: int = 60) -> Dict[str, Any]:
+    """A Docs API document body with the given number of paragraphs, each split into styled runs."""
+    words = re.findall(r'\w+', open(os.path.join(PROMPTS_DIR, 'podcast_agenda_generation.txt')).read())
+    content = []
+    for i in range(paragraphs):
+        text = ' '.join(words[(i + j) % len(words)] for j in range(words_per_paragraph)) + '\n'
+        # Split each paragraph into a few text runs, as formatting changes do in real documents
+        third = len(text) // 3
+        runs = [text[:third], text[third:2 * third], text[2 * third:]]
+        content.append({'paragraph': {'elements': [{'textRun': {'content': run}} for run in runs]}})
+        if i % 50 == 49:
+            content.append({'table': {'rows': 1, 'columns': 1}})
+    return {'body': {'content': content}}
@@ -0,0 +1,262 @@
+# run.py: Offline benchmarks for the CPU-side hot paths, with regression comparison against a saved baseline.
+#
+# Usage, from the repository root:
+#   python benchmarks/run.py                    # run everything, write benchmarks/results/latest.json
+#   python benchmarks/run.py --save-baseline    # also store the results as benchmarks/baseline.json
+#   python benchmarks/run.py -k compose         # only benchmarks whose name contains "compose"
+# When a baseline exists, each benchmark's fastest round (the least noisy statistic) is compared
+# to it and the exit status is 1 if any benchmark got slower by more than --threshold.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, Any, List, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import notebook
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(BENCHMARK_DIR, 'results', 'latest.json')
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+BENCHMARKS: Dict[str, Callable[[], Callable[[], Any]]] = {}
+
+def benchmark(name: str):
+    """Register a setup function; it returns the zero-argument callable that is timed."""
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+def renderable_prompts(ns: Dict[str, Any]) -> List[tuple]:
+    """(url, variables) for every template in src/prompts that renders on its own."""
+    prompts = []
+    prompt_manager = ns['PromptManager']()
+    for name, text in notebook.prompt_documents().items():
+        url = notebook.doc_url(name)
+        variables = notebook.template_variables(text)
+        try:
+            prompt_manager.compose_prompt([url], variables)
+        except Exception:
+            # e.g. templates that only render as part of another template
+            continue
+        prompts.append((url, variables))
+    return prompts
+
+def offline_namespace() -> Dict[str, Any]:
+    documents = dict(notebook.prompt_documents())
+    documents.update(notebook.chain_documents())
+    ns = notebook.load_cells(documents)
+    # Chains may name step functions that live outside this repo; loading only needs them registered
+    for text in notebook.chain_documents().values():
+        for step in notebook.yaml.safe_load(text)['steps']:
+            ns['ChainManager'].STEP_FUNCTIONS.setdefault(step['step_function'], lambda **kwargs: None)
+    return ns
+
+@benchmark('compose_prompt.cold')
+def compose_prompt_cold():
+    """Jinja compile, render and YAML parse of every template, with empty caches."""
+    ns = offline_namespace()
+    prompts = renderable_prompts(ns)
+
+    def run():
+        ns['DOC_CACHE'].clear()
+        prompt_manager = ns['PromptManager']()
+        for url, variables in prompts:
+            prompt_manager.compose_prompt([url], variables)
+    return run
+
+@benchmark('compose_prompt.warm')
+def compose_prompt_warm():
+    """compose_prompt on templates and variables that were rendered before."""
+    ns = offline_namespace()
+    prompts = renderable_prompts(ns)
+    prompt_manager = ns['PromptManager']()
+
+    def run():
+        for url, variables in prompts:
+            prompt_manager.compose_prompt([url], variables)
+    return run
+
+@benchmark('load_chain.cold')
+def load_chain_cold():
+    """Parse, validate and resolve dependencies of every chain, with empty caches."""
+    ns = offline_namespace()
+    urls = [notebook.doc_url(name) for name in notebook.chain_documents()]
+
+    def run():
+        ns['DOC_CACHE'].clear()
+        chain_cache = ns['ChainCache']()
+        prompt_manager = ns['PromptManager']()
+        for url in urls:
+            ns['ChainManager'](chain_cache=chain_cache, prompt_manager=prompt_manager).load_chain(url)
+    return run
+
+@benchmark('load_chain.warm')
+def load_chain_warm():
+    """load_chain per row once the chain and its templates are cached."""
+    ns = offline_namespace()
+    urls = [notebook.doc_url(name) for name in notebook.chain_documents()]
+    chain_cache = ns['ChainCache']()
+    prompt_manager = ns['PromptManager']()
+
+    def run():
+        for url in urls:
+            ns['ChainManager'](chain_cache=chain_cache, prompt_manager=prompt_manager).load_chain(url)
+    return run
+
+def extract_text_benchmark(paragraphs: int):
+    def setup():
+        ns = offline_namespace()
+        google_doc = object.__new__(ns['GoogleDoc'])
+        document = notebook.synthetic_document(paragraphs)
+        return lambda: google_doc._extract_text(document)
+    setup.__doc__ = f"GoogleDoc._extract_text on a synthetic {paragraphs}-paragraph document."
+    return setup
+
+benchmark('extract_text.1k_paragraphs')(extract_text_benchmark(1000))
+benchmark('extract_text.10k_paragraphs')(extract_text_benchmark(10000))
+
+def convert_to_messages_benchmark(auto_cache: bool):
+    def setup():
+        ns = offline_namespace()
+        prompt_manager = ns['PromptManager']()
+        prompt_dicts = [prompt_manager.compose_prompt([url], variables)
+                        for url, variables in renderable_prompts(ns)]
+        provider = ns['AnthropicProvider'](scheduler=None, auto_cache=auto_cache)
+
+        def run():
+            for prompts in prompt_dicts:
+                provider.convert_to_messages(prompts)
+        return run
+    setup.__doc__ = f"AnthropicProvider.convert_to_messages on every rendered template (auto_cache={auto_cache})."
+    return setup
+
+benchmark('convert_to_messages.auto_cache')(convert_to_messages_benchmark(True))
+benchmark('convert_to_messages.no_auto_cache')(convert_to_messages_benchmark(False))
+
+def time_callable(fn: Callable[[], Any], rounds: int, min_round_time: float) -> Dict[str, Any]:
+    """Time fn over several rounds, each repeating it enough times to last at least min_round_time."""
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_round_time:
+            break
+        number = max(number * 2, int(number * min_round_time / max(elapsed, 1e-9)))
+
+    samples = [elapsed / number]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'mean': statistics.mean(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'rounds': rounds,
+        'iterations_per_round': number
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=notebook.ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def run_benchmarks(names: List[str], rounds: int, min_round_time: float) -> Dict[str, Any]:
+    results = {}
+    for name in names:
+        fn = BENCHMARKS[name]()
+        results[name] = time_callable(fn, rounds, min_round_time)
+        results[name]['description'] = BENCHMARKS[name].__doc__
+        print(f"{name:<36} {results[name]['median'] * 1000:>10.3f} ms  "
+              f"(min {results[name]['min'] * 1000:.3f} ms, {rounds}x{results[name]['iterations_per_round']})")
+    return {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform()
+        },
+        'benchmarks': results
+    }
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Print each benchmark's change against the baseline and return the names that regressed."""
+    regressions = []
+    print(f"\nCompared with baseline from {baseline['meta'].get('commit') or 'unknown commit'} "
+          f"({baseline['meta'].get('timestamp', '')}):")
+    for name, result in results['benchmarks'].items():
+        previous = baseline['benchmarks'].get(name)
+        if previous is None:
+            print(f"{name:<36} new")
+            continue
+        ratio = result['min'] / previous['min'] if previous['min'] else float('inf')
+        if ratio > 1 + threshold:
+            status = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            status = 'improved'
+        else:
+            status = 'unchanged'
+        print(f"{name:<36} {previous['min'] * 1000:>10.3f} ms -> {result['min'] * 1000:>10.3f} ms  "
+              f"{ratio:>6.2f}x  {status}")
+    return regressions
+
+def write_json(path: str, data: Dict[str, Any]):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Run the offline benchmarks and compare them with a baseline.')
+    parser.add_argument('-k', '--filter', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--min-round-time', type=float, default=0.1, help='seconds per timing round')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative slowdown of the fastest round that counts as a regression')
+    parser.add_argument('--list', action='store_true', help='list benchmarks and exit')
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    if args.list:
+        for name in names:
+            print(f"{name:<36} {BENCHMARKS[name].__doc__}")
+        return 0
+    if not names:
+        raise ValueError(f"No benchmark matches {args.filter!r}")
+
+    results = run_benchmarks(names, args.rounds, args.min_round_time)
+    write_json(args.output, results)
+    print(f"\nResults written to {args.output}")
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    if args.save_baseline:
+        write_json(args.baseline, results)
+        print(f"Baseline saved to {args.baseline}")
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
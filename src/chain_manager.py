@@ -3,10 +3,54 @@
 
 # chain_manager.py: Module to manage the execution of chains defined in Google Docs.
 
-from typing import Dict, Any, List, Callable
+from typing import Dict, Any, List, Callable, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import asyncio
+import contextvars
+import hashlib
+import copy
+import time
 import yaml
 import json
 
+# Context keys written by the step running in the current context, as {key: value}; None outside a step
+STEP_WRITES = contextvars.ContextVar('step_writes', default=None)
+
+class ChainCache:
+    """
+    The ChainCache class holds parsed chain configurations shared across ChainManager instances.
+    Entries are keyed by chain reference and source revision (doc revision or file modification time),
+    so an edited chain doc or file is re-parsed.
+    """
+
+    def __init__(self, sources: TemplateSources = None):
+        self.sources = sources if sources is not None else TemplateSources.default()
+        self.chains = {}
+        self.lock = threading.Lock()
+
+    def get(self, doc_url: str) -> Dict[str, Any]:
+        """Return the parsed chain for a doc URL or local file, fetching it only if its revision changed."""
+        source = self.sources.resolve(doc_url)
+        key = (doc_url, source.revision(doc_url))
+        with self.lock:
+            if key in self.chains:
+                return self.chains[key]
+
+        chain = ChainManager.parse_chain(source.fetch(doc_url))
+        with self.lock:
+            # Drop stale revisions of the same chain doc
+            for cached_key in [k for k in self.chains if k[0] == doc_url]:
+                del self.chains[cached_key]
+            self.chains[key] = chain
+        return chain
+
+    def clear(self):
+        with self.lock:
+            self.chains.clear()
+
+CHAIN_CACHE = ChainCache()
+
 class ChainManager:
     """
     The ChainManager class manages the execution of chains defined in Google Docs.
@@ -14,79 +58,472 @@ class ChainManager:
     """
 
     STEP_FUNCTIONS: Dict[str, Callable] = {}
+    ASYNC_STEP_FUNCTIONS: Dict[str, Callable] = {}
+    # {step_function: injects(params) -> template variables the function supplies to its own templates}
+    STEP_INJECTED_VARIABLES: Dict[str, Callable[[Dict[str, Any]], set]] = {}
+    # {step_function: writes(params) -> context keys the function writes besides the step's output key}
+    STEP_WRITTEN_KEYS: Dict[str, Callable[[Dict[str, Any]], set]] = {}
+    # {step_function: params a step using it must set}
+    STEP_REQUIRED_PARAMS: Dict[str, tuple] = {}
+    # Steps that render their templates and make exactly one LLM call
+    BATCHABLE_STEP_FUNCTIONS = {'process_with_llm'}
 
     @classmethod
-    def register_step_function(cls, name: str):
+    def register_step_function(cls, name: str, injects: Callable[[Dict[str, Any]], set] = None,
+                               writes: Callable[[Dict[str, Any]], set] = None, required_params: tuple = ()):
+        """
+        Register a step function. injects(params) names the template variables the function sets itself
+        when rendering, e.g. the current item of a map, so they are not reported as unresolved.
+        writes(params) names context keys it writes besides the output key, so steps reading them wait
+        for it. required_params are checked when a chain is parsed.
+        """
         def decorator(func):
             cls.STEP_FUNCTIONS[name] = func
+            if injects is not None:
+                cls.STEP_INJECTED_VARIABLES[name] = injects
+            if writes is not None:
+                cls.STEP_WRITTEN_KEYS[name] = writes
+            cls.STEP_REQUIRED_PARAMS[name] = tuple(required_params)
             return func
         return decorator
 
-    def __init__(self, debug: bool = False):
+    @classmethod
+    def register_async_step_function(cls, name: str):
+        """Register a coroutine implementation of a step, used by execute_async."""
+        def decorator(func):
+            cls.ASYNC_STEP_FUNCTIONS[name] = func
+            return func
+        return decorator
+
+    def __init__(self, debug: bool = False, chain_cache: ChainCache = None,
+                 prompt_manager: PromptManager = None, llm_provider: LLMProvider = None,
+                 async_llm_provider: AsyncAnthropicProvider = None, max_parallel_steps: int = 4):
         self.gdoc = None
         self.debug = debug
-        self.prompt_manager = PromptManager()
-        self.llm_provider = AnthropicProvider()
+        self.chain_cache = chain_cache if chain_cache is not None else CHAIN_CACHE
+        self.prompt_manager = prompt_manager if prompt_manager is not None else PromptManager()
+        self.llm_provider = llm_provider if llm_provider is not None else AnthropicProvider()
+        # Created on first use by execute_async so synchronous runs never open an async client
+        self.async_llm_provider = async_llm_provider
+        # Optional streaming hooks: on_text(step_name, delta) and stop_when(step_name, text) -> bool
+        self.on_text: Optional[Callable[[str, str], None]] = None
+        self.stop_when: Optional[Callable[[str, str], bool]] = None
+        # Optional hook called as on_step_complete(step, result) after each step finishes
+        self.on_step_complete: Optional[Callable[[Dict[str, Any], Any], None]] = None
+        # Names of steps whose outputs were restored from an earlier run and are skipped
+        self.completed_steps = set()
+        # {step_name: {key: value}} context keys each finished step wrote besides its output key
+        self.step_writes = {}
+        # Fingerprint of each step's inputs in this run, and {step_name: {'fingerprint', 'value'}}
+        # from an earlier run whose outputs may be reused when the fingerprint is unchanged
+        self.fingerprints = {}
+        self.previous_steps = {}
+        self.max_parallel_steps = max_parallel_steps
         self.steps = []
+        self.dependencies = {}
+        self.step_inputs = {}
+        self.inputs = set()
+        self.input_as = []
         self.context = {}
+        self.context_lock = threading.Lock()
 
-    def load_chain(self, doc_url: str):
-        """Load chain configuration from Google Doc URL."""
-        self.gdoc = GoogleDoc(doc_url)
-        content = self.gdoc.read_content()
-
+    @classmethod
+    def parse_chain(cls, content: str) -> Dict[str, Any]:
+        """Parse and validate a chain configuration from YAML text."""
         try:
             config = yaml.safe_load(content)
             if DEBUG:
                 print(json.dumps(config, indent=2))
-            self.name = config.get('name', 'unnamed_chain')
-            self.description = config.get('description', '')
+
+            steps = []
+            step_names = [step_config['name'] for step_config in config['steps']]
+            if len(set(step_names)) != len(step_names):
+                raise ValueError("Step names must be unique")
 
             for step_config in config['steps']:
-                if step_config['step_function'] not in self.STEP_FUNCTIONS:
+                if step_config['step_function'] not in cls.STEP_FUNCTIONS:
                     raise ValueError(f"Unknown step function: {step_config['step_function']}")
 
-                # Extract URLs from prompt templates if they exist
+                # Extract template references (doc URLs or local files) if they exist
                 prompt_templates = step_config.get('prompt_templates', [])
                 urls = []
                 if isinstance(prompt_templates, list):
                     for template in prompt_templates:
-                        if isinstance(template, dict):
-                            if 'url' not in template:
-                                raise ValueError(f"Missing 'url' key in prompt template for step {step_config['name']}")
-                            urls.append(template['url'])
+                        if isinstance(template, str):
+                            urls.append(template)
+                        elif isinstance(template, dict):
+                            if 'url' not in template and 'path' not in template:
+                                raise ValueError(f"Missing 'url' or 'path' key in prompt template for step {step_config['name']}")
+                            urls.append(template.get('url') or template['path'])
+
+                depends_on = step_config.get('depends_on')
+                if isinstance(depends_on, str):
+                    depends_on = [depends_on]
+                for name in depends_on or []:
+                    if name not in step_names:
+                        raise ValueError(f"Step {step_config['name']} depends on unknown step: {name}")
+
+                params = step_config.get('params') or {}
+                for param in cls.STEP_REQUIRED_PARAMS.get(step_config['step_function'], ()):
+                    if not params.get(param):
+                        raise ValueError(f"Step {step_config['name']} needs params.{param} "
+                                         f"for step function {step_config['step_function']}")
 
-                self.steps.append({
+                steps.append({
                     'name': step_config['name'],
                     'output_key': step_config.get('output_key'),
                     'step_function': step_config['step_function'],
-                    'prompt_templates': urls
+                    'prompt_templates': urls,
+                    'depends_on': depends_on,
+                    # Extra keyword arguments for the step function
+                    'params': params
                 })
 
+            # initial_context values are copied into each run's context; null entries supply nothing
+            initial_context = {key: value for key, value in (config.get('initial_context') or {}).items()
+                               if value is not None}
+            # Extra names the row's chain_input is available under, e.g. text_to_analyze
+            input_as = config.get('input_as') or []
+            if isinstance(input_as, str):
+                input_as = [input_as]
+
+            return {
+                'name': config.get('name', 'unnamed_chain'),
+                'description': config.get('description', ''),
+                'initial_context': initial_context,
+                'input_as': list(input_as),
+                'inputs': sorted(set(initial_context) | set(input_as) | {'chain_input'}),
+                'steps': steps
+            }
+
         except Exception as e:
             raise ValueError(f"Error loading chain configuration: {str(e)}")
 
+    def load_chain(self, doc_url: str):
+        """Load chain configuration from a Google Doc URL or a local YAML file."""
+        with TRACER.span('chain.load', chain_url=doc_url):
+            chain = self.chain_cache.get(doc_url)
+            # Fetch every template up front, in one batch where possible, so steps never wait on
+            # a Docs round-trip and unreachable templates fail before anything runs
+            self.prompt_manager.sources.prefetch(
+                [url for step in chain['steps'] for url in step['prompt_templates']]
+            )
+            self.name = chain['name']
+            self.description = chain['description']
+            # Step dicts are shared with the cache and must not be mutated per row
+            self.steps = list(chain['steps'])
+            self.inputs = set(chain['inputs'])
+            self.input_as = list(chain['input_as'])
+            for key, value in chain['initial_context'].items():
+                # Copied, since the parsed chain is shared; values set before loading win
+                if key not in self.context:
+                    self.add_to_context(key, copy.deepcopy(value))
+            self.dependencies = self.resolve_dependencies()
+            self.steps = self.topological_order()
+            missing = self.unresolved_inputs()
+            if missing:
+                raise ValueError(
+                    f"Chain {self.name}: template variables with no producing step: "
+                    + '; '.join(f"{name} reads {', '.join(sorted(variables))}" for name, variables in missing.items())
+                    + ". Give them a value in initial_context, make chain_input available under their name "
+                    "with input_as, or give the step an explicit depends_on.")
+
+    def resolve_dependencies(self) -> Dict[str, set]:
+        """
+        Work out which steps each step waits for. An explicit `depends_on` list wins; otherwise a step
+        depends on earlier steps that produce the context variables its templates reference, and on
+        earlier steps that read or write its own outputs (see step_outputs). Steps without templates depend on all
+        earlier steps, since their inputs cannot be inferred. Steps without an output key may write the
+        context as a side effect, so they are barriers: they wait for all earlier steps and all later
+        steps wait for them.
+        """
+        reads = {}
+        for step in self.steps:
+            variables = set()
+            for template_url in step.get('prompt_templates', []):
+                variables |= self.prompt_manager.get_template_variables(template_url)
+            if step.get('params', {}).get('input_key'):
+                variables.add(step['params']['input_key'])
+            reads[step['name']] = variables
+        self.step_inputs = reads
+
+        dependencies = {}
+        for i, step in enumerate(self.steps):
+            if step.get('depends_on') is not None:
+                dependencies[step['name']] = set(step['depends_on'])
+                continue
+
+            earlier = self.steps[:i]
+            output_key = step.get('output_key')
+            if not step.get('prompt_templates') or not output_key:
+                dependencies[step['name']] = {other['name'] for other in earlier}
+                continue
+
+            outputs = self.step_outputs(step)
+            dependencies[step['name']] = {
+                other['name'] for other in earlier
+                if not other.get('output_key')
+                or self.step_outputs(other) & (reads[step['name']] | outputs)
+                or outputs & reads[other['name']]
+            }
+        return dependencies
+
+    def step_outputs(self, step: Dict[str, Any]) -> set:
+        """Context keys a step writes: its output key and any keys its step function declares, e.g. errors_key."""
+        outputs = {step['output_key']} if step.get('output_key') else set()
+        writes = self.STEP_WRITTEN_KEYS.get(step['step_function'])
+        if writes is not None:
+            outputs |= set(writes(step.get('params', {})))
+        return outputs
+
+    def topological_order(self) -> List[Dict[str, Any]]:
+        """Order steps so that every step follows its dependencies, keeping chain order where possible."""
+        ordered = []
+        done = set()
+        remaining = list(self.steps)
+        while remaining:
+            ready = [step for step in remaining if self.dependencies[step['name']] <= done]
+            if not ready:
+                cycle = ', '.join(step['name'] for step in remaining)
+                raise ValueError(f"Dependency cycle between steps: {cycle}")
+            ordered.append(ready[0])
+            done.add(ready[0]['name'])
+            remaining.remove(ready[0])
+        return ordered
+
+    def stream_callbacks(self) -> tuple:
+        """Return (on_text, stop_when) bound to the current step, for passing to process_prompt."""
+        step_name = CURRENT_STEP.get()
+        on_text = stop_when = None
+        if self.on_text is not None:
+            on_text = lambda delta: self.on_text(step_name, delta)
+        if self.stop_when is not None:
+            stop_when = lambda text: self.stop_when(step_name, text)
+        return on_text, stop_when
+
     def get_context(self) -> Dict[str, Any]:
-        return self.context
+        # A snapshot, since parallel steps may add keys while another step renders its templates
+        with self.context_lock:
+            return dict(self.context)
 
     def add_to_context(self, key: str, value: Any):
-        self.context[key] = value
+        with self.context_lock:
+            self.context[key] = value
+        writes = STEP_WRITES.get()
+        if writes is not None:
+            writes[key] = value
 
-    def execute(self) -> Dict[str, Any]:
+    def set_input(self, chain_input: Any):
+        """Set the row's chain_input, and the names the chain's input_as lists."""
+        for key in ['chain_input'] + self.input_as:
+            self.add_to_context(key, chain_input)
+
+    def step_fingerprint(self, step: Dict[str, Any]) -> Optional[str]:
+        """
+        Hash everything a step consumes: its rendered messages, the model and parameters, and the
+        fingerprints of the steps it depends on. Returns None if the inputs cannot be rendered.
+        """
+        context = self.get_context()
+        produced = set().union(*(self.step_outputs(other) for other in self.steps))
+        payload = {
+            'step_function': step['step_function'],
+            'params': step.get('params', {}),
+            'model': getattr(self.llm_provider, 'model', None),
+            'max_tokens': getattr(self.llm_provider, 'max_tokens', None),
+            'temperature': getattr(self.llm_provider, 'temperature', None),
+            'dependencies': {name: self.fingerprints.get(name)
+                             for name in sorted(self.dependencies.get(step['name'], set()))}
+        }
+        try:
+            if step.get('prompt_templates'):
+                payload['messages'] = self.prompt_manager.compose_prompt(step['prompt_templates'], context)
+            else:
+                # Without templates the step may read any context value not produced by another step
+                payload['inputs'] = {key: value for key, value in context.items() if key not in produced}
+            input_key = step.get('params', {}).get('input_key')
+            if input_key:
+                payload['input'] = context.get(input_key)
+            encoded = json.dumps(payload, sort_keys=True, default=str)
+        except Exception:
+            return None
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def reuse_previous_result(self, step: Dict[str, Any]) -> tuple:
+        """Return (True, value) if an earlier run's output for this step has the same fingerprint."""
+        fingerprint = self.step_fingerprint(step)
+        self.fingerprints[step['name']] = fingerprint
+        previous = self.previous_steps.get(step['name'])
+        # Entries without recorded context writes cannot be replayed faithfully, so the step is re-run
+        if fingerprint is None or previous is None or previous.get('fingerprint') != fingerprint \
+                or 'writes' not in previous:
+            return False, None
+        if DEBUG:
+            print(f"Reusing unchanged step: {step['name']}")
+        for key, value in previous['writes'].items():
+            self.add_to_context(key, value)
+        self.apply_step_result(step, previous['value'], previous['writes'])
+        return True, previous['value']
+
+    def run_step(self, step: Dict[str, Any]) -> Any:
+        """Run a single step, unless its earlier output can be reused, and store its result."""
+        reused, result = self.reuse_previous_result(step)
+        if reused:
+            return result
+        return self.execute_step(step)
+
+    def execute_step(self, step: Dict[str, Any]) -> Any:
+        """Call the step function and store its result under the step's output key."""
+        func = self.STEP_FUNCTIONS[step['step_function']]
+        if DEBUG:
+            print(f"Executing step: {step['name']}")
+            print(f"Output key: {step['output_key']}")
+            print(f"Step function: {step['step_function']}")
+            print(f"Prompt templates: {step['prompt_templates']}")
+        CURRENT_CHAIN.set(self.name)
+        CURRENT_STEP.set(step['name'])
+        writes = {}
+        token = STEP_WRITES.set(writes)
+        start = time.monotonic()
+        try:
+            with TRACER.span('step', chain=self.name, step=step['name'], step_function=step['step_function']) as span, \
+                    TRACER.profiled(f"{self.name}_{step['name']}_{span.span_id if span else ''}"):
+                result = func(
+                    chain=self,
+                    prompt_templates=step.get('prompt_templates', []),
+                    debug=self.debug,
+                    **step.get('params', {})
+                )
+        except Exception as e:
+            METRICS.record_step(step['name'], time.monotonic() - start, error=str(e))
+            raise
+        finally:
+            STEP_WRITES.reset(token)
+        METRICS.record_step(step['name'], time.monotonic() - start)
+        self.apply_step_result(step, result, writes)
+        return result
+
+    def apply_step_result(self, step: Dict[str, Any], result: Any, writes: Dict[str, Any] = None):
+        """Store a step's result and remember its other context writes for on_step_complete to record."""
+        self.step_writes[step['name']] = {key: value for key, value in (writes or {}).items()
+                                          if key != step.get('output_key')}
+        if step.get('output_key'):
+            self.add_to_context(step['output_key'], result)
+        if self.on_step_complete is not None:
+            self.on_step_complete(step, result)
+
+    def restore_step(self, step_name: str, output_key: str, value: Any, writes: Dict[str, Any] = None):
+        """Mark a step as already done, putting its recorded output and other context writes back into the context."""
+        for key, written in (writes or {}).items():
+            self.add_to_context(key, written)
+        if output_key:
+            self.add_to_context(output_key, value)
+        self.completed_steps.add(step_name)
+
+    def is_batchable(self, step: Dict[str, Any]) -> bool:
+        """True if the step is a single LLM call that can be submitted as part of a Message Batch."""
+        return step['step_function'] in self.BATCHABLE_STEP_FUNCTIONS
+
+    def build_step_request(self, step: Dict[str, Any]) -> Dict[str, Any]:
+        """Render a batchable step's prompts into messages.create arguments."""
+        composed_prompts = self.prompt_manager.compose_prompt(step.get('prompt_templates', []), self.get_context())
+        messages_and_system = self.llm_provider.convert_to_messages(composed_prompts)
+        return self.llm_provider.build_request_args(messages_and_system)
+
+    def unresolved_inputs(self) -> Dict[str, set]:
+        """
+        {step_name: variables} for template variables that no step produces and that are neither chain
+        inputs nor already in the context. Steps with an explicit depends_on are trusted and not checked.
+        """
+        produced = set().union(*(self.step_outputs(step) for step in self.steps))
+        known = produced | self.inputs | set(self.context)
+        missing = {}
         for step in self.steps:
-            func = self.STEP_FUNCTIONS[step['step_function']]
-            if DEBUG:
-                print(f"Executing step: {step['name']}")
-                print(f"Output key: {step['output_key']}")
-                print(f"Step function: {step['step_function']}")
-                print(f"Prompt templates: {step['prompt_templates']}")
-            result = func(
-                chain=self,
-                prompt_templates=step.get('prompt_templates', []),
-                debug=self.debug
-            )
-            if step.get('output_key'):
-                self.add_to_context(step['output_key'], result)
+            injects = self.STEP_INJECTED_VARIABLES.get(step['step_function'])
+            unknown = self.step_inputs.get(step['name'], set()) - known
+            if injects is not None:
+                unknown -= set(injects(step.get('params', {})))
+            if step.get('depends_on') is None and unknown:
+                missing[step['name']] = unknown
+        return missing
+
+    def ready_steps(self, done: set, started: set) -> List[Dict[str, Any]]:
+        return [step for step in self.steps
+                if step['name'] not in started and self.dependencies.get(step['name'], set()) <= done]
+
+    def execute(self) -> Dict[str, Any]:
+        """Execute the chain, running steps whose dependencies are satisfied in parallel."""
+        if self.max_parallel_steps <= 1:
+            for step in self.steps:
+                if step['name'] not in self.completed_steps:
+                    self.run_step(step)
+            return self.context
+
+        completed = self.completed_steps & {step['name'] for step in self.steps}
+        done, started, running = set(completed), set(completed), {}
+        with ThreadPoolExecutor(max_workers=self.max_parallel_steps) as executor:
+            while len(done) < len(self.steps):
+                for step in self.ready_steps(done, started):
+                    started.add(step['name'])
+                    # Each step runs in a copy of the caller's context so its span nests under the row
+                    running[executor.submit(contextvars.copy_context().run, self.run_step, step)] = step['name']
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                    done.add(running.pop(future))
+        return self.context
+
+    async def run_step_async(self, step: Dict[str, Any]) -> Any:
+        """Run a single step on the event loop; steps without an async implementation run in a thread."""
+        reused, result = self.reuse_previous_result(step)
+        if reused:
+            return result
+        if DEBUG:
+            print(f"Executing step (async): {step['name']}")
+        CURRENT_CHAIN.set(self.name)
+        CURRENT_STEP.set(step['name'])
+        async_func = self.ASYNC_STEP_FUNCTIONS.get(step['step_function'])
+        if async_func is None:
+            return await asyncio.to_thread(self.execute_step, step)
+
+        writes = {}
+        token = STEP_WRITES.set(writes)
+        start = time.monotonic()
+        try:
+            # cProfile cannot attribute time to one task on a shared event loop, so async steps are only traced
+            with TRACER.span('step', chain=self.name, step=step['name'], step_function=step['step_function']):
+                result = await async_func(
+                    chain=self,
+                    prompt_templates=step.get('prompt_templates', []),
+                    debug=self.debug,
+                    **step.get('params', {})
+                )
+        except Exception as e:
+            METRICS.record_step(step['name'], time.monotonic() - start, error=str(e))
+            raise
+        finally:
+            STEP_WRITES.reset(token)
+        METRICS.record_step(step['name'], time.monotonic() - start)
+        self.apply_step_result(step, result, writes)
+        return result
+
+    async def execute_async(self) -> Dict[str, Any]:
+        """Execute the chain on the event loop, running independent steps concurrently."""
+        if self.async_llm_provider is None:
+            self.async_llm_provider = AsyncAnthropicProvider.from_provider(self.llm_provider)
+
+        completed = self.completed_steps & {step['name'] for step in self.steps}
+        done, started, running = set(completed), set(completed), {}
+        while len(done) < len(self.steps):
+            for step in self.ready_steps(done, started):
+                started.add(step['name'])
+                running[asyncio.create_task(self.run_step_async(step))] = step['name']
+            finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                if task.exception() is not None:
+                    for pending in running:
+                        pending.cancel()
+                    raise task.exception()
+                done.add(running.pop(task))
         return self.context
 
 @ChainManager.register_step_function("process_with_llm")
@@ -97,7 +534,20 @@ def process_with_llm(
 ) -> str:
     context = chain.get_context()
     composed_prompts = chain.prompt_manager.compose_prompt(prompt_templates, context)
-    return chain.llm_provider.process_prompt(composed_prompts)
+    on_text, stop_when = chain.stream_callbacks()
+    return chain.llm_provider.process_prompt(composed_prompts, on_text=on_text, stop_when=stop_when)
+
+@ChainManager.register_async_step_function("process_with_llm")
+async def process_with_llm_async(
+    chain: Any,
+    prompt_templates: List[str] = None,
+    debug: bool = False
+) -> str:
+    context = chain.get_context()
+    composed_prompts = chain.prompt_manager.compose_prompt(prompt_templates, context)
+    on_text, stop_when = chain.stream_callbacks()
+    return await chain.async_llm_provider.process_prompt(composed_prompts, on_text=on_text,
+                                                         stop_when=stop_when)
 
 # if __name__ == "__main__":
 #     pass
@@ -110,7 +560,7 @@ def process_with_llm(
 #         print(f"Description: {chain_manager.description}")
 #         print("\nExecuting chain...")
 
-#         chain_manager.add_to_context("chain_input", "Artificial intelligence has transformed numerous industries in recent years. From healthcare to finance, AI systems are automating processes, improving decision-making, and uncovering insights from vast amounts of data. While concerns about AI safety and ethics persist, the technology continues to advance rapidly. Organizations must carefully balance innovation with responsible development practices to ensure AI benefits society as a whole.")
+#         chain_manager.set_input("Artificial intelligence has transformed numerous industries in recent years. From healthcare to finance, AI systems are automating processes, improving decision-making, and uncovering insights from vast amounts of data. While concerns about AI safety and ethics persist, the technology continues to advance rapidly. Organizations must carefully balance innovation with responsible development practices to ensure AI benefits society as a whole.")
 #         chain_manager.add_to_context("tone", "Academic")
 
 #         result = chain_manager.execute()
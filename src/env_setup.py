@@ -3,8 +3,10 @@
 
 # env_setup.py: Module to set up the environment for the ColabAgent.
 
+from typing import Dict, Any
 from google.colab import drive
-from googleapiclient.discovery import build
+
+GOOGLE_DOC_MIME_TYPE = 'application/vnd.google-apps.document'
 
 def setup_directory_structure():
     """Set up required directory structure for the ColabAgent."""
@@ -17,9 +19,12 @@ def setup_directory_structure():
 
     required_dirs = ['prompts', 'chains', 'steps']
     created_dirs = {}
+    # One listing instead of a query per directory
+    existing_dirs = {f['name']: f['id'] for f in gdrive.get_files_in_directory(colab_agent_dir)
+                     if f['mimeType'] == 'application/vnd.google-apps.folder'}
 
     for dir_name in required_dirs:
-        dir_id = gdrive.directory_exists(dir_name, parent_id=colab_agent_dir)
+        dir_id = existing_dirs.get(dir_name)
         if not dir_id:
             print(f"Creating {dir_name}/ directory...")
             dir_id = gdrive.create_directory(dir_name, parent_id=colab_agent_dir)
@@ -29,47 +34,20 @@ def setup_directory_structure():
 
     return created_dirs
 
-def copy_public_prompts(prompts_dir_id: str, public_folder_id: str = "1AYlnc58M0TnMuDTPr4x_bwaJIlSV5-3v"):
+def copy_public_prompts(prompts_dir_id: str, public_folder_id: str = "1AYlnc58M0TnMuDTPr4x_bwaJIlSV5-3v",
+                        update: bool = False, dry_run: bool = False) -> Dict[str, Any]:
     """Copy Google Docs from public folder to prompts directory if they don't already exist."""
     gdrive = GoogleDrive()
+    # Existing docs are kept unless update is set, since they may hold local edits
+    return gdrive.sync_directory(public_folder_id, prompts_dir_id, mime_types=[GOOGLE_DOC_MIME_TYPE],
+                                 update=update, dry_run=dry_run)
 
-    # Get all files from public folder
-    files = gdrive.get_files_in_directory(public_folder_id)
-
-    # Filter for Google Docs
-    docs = [f for f in files if f['mimeType'] == 'application/vnd.google-apps.document']
-
-    # Copy each doc to prompts directory if it doesn't exist
-    for doc in docs:
-        if not gdrive.file_exists(doc['name'], parent_id=prompts_dir_id):
-            copied_file = gdrive.service.files().copy(
-                fileId=doc['id'],
-                body={'name': doc['name'], 'parents': [prompts_dir_id]}
-            ).execute()
-            print(f"Copied {doc['name']} to prompts directory")
-        else:
-            print(f"Skipped {doc['name']} - already exists in prompts directory")
-
-def copy_public_chains(chains_dir_id: str, public_folder_id: str = "1xhbQNeqWngRoMeughdXwP_pvJkVbyg4c"):
+def copy_public_chains(chains_dir_id: str, public_folder_id: str = "1xhbQNeqWngRoMeughdXwP_pvJkVbyg4c",
+                       update: bool = False, dry_run: bool = False) -> Dict[str, Any]:
     """Copy Google Docs from public folder to chains directory if they don't already exist."""
     gdrive = GoogleDrive()
-
-    # Get all files from public folder
-    files = gdrive.get_files_in_directory(public_folder_id)
-
-    # Filter for Google Docs
-    docs = [f for f in files if f['mimeType'] == 'application/vnd.google-apps.document']
-
-    # Copy each doc to chains directory if it doesn't exist
-    for doc in docs:
-        if not gdrive.file_exists(doc['name'], parent_id=chains_dir_id):
-            copied_file = gdrive.service.files().copy(
-                fileId=doc['id'],
-                body={'name': doc['name'], 'parents': [chains_dir_id]}
-            ).execute()
-            print(f"Copied {doc['name']} to chains directory")
-        else:
-            print(f"Skipped {doc['name']} - already exists in chains directory")
+    return gdrive.sync_directory(public_folder_id, chains_dir_id, mime_types=[GOOGLE_DOC_MIME_TYPE],
+                                 update=update, dry_run=dry_run)
 
 def main():
     created_dirs = setup_directory_structure()
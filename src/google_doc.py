@@ -4,23 +4,32 @@
 # google_doc.py: Module to interact with the Google Docs API for reading and updating documents.
 
 import re
-from typing import Dict, Any
-from googleapiclient.discovery import build
-from google.colab import auth
+import os
+import json
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
 
 class GoogleDoc:
     """
     The GoogleDoc class provides methods to interact with Google Docs.
     It allows reading content from a Google Doc, updating content, and appending new text.
+    Reads go through a DocumentCache shared by all instances, DOC_CACHE unless another is given.
+    The Docs client comes from GOOGLE_SERVICES unless a service is injected.
     """
-    def __init__(self, url: str):
+    # Field mask for reads that only need the text, leaving out styles, lists and indices
+    TEXT_FIELDS = 'revisionId,body(content(paragraph(elements(textRun(content)))))'
+
+    def __init__(self, url: str, cache: 'DocumentCache' = None, service: Any = None):
         self.url = url
         self.document_id = self._extract_document_id(url)
-        self.service = self._init_service()
+        self.cache = cache if cache is not None else DOC_CACHE
+        self.service = service if service is not None else self._init_service()
 
     def _init_service(self):
-        auth.authenticate_user()
-        return build('docs', 'v1', credentials=None)
+        return GOOGLE_SERVICES.service('docs', 'v1')
 
     @staticmethod
     def _extract_document_id(url: str) -> str:
@@ -29,13 +38,35 @@ class GoogleDoc:
             raise ValueError("Could not find document ID in URL")
         return match.group(1)
 
-    def get_document(self) -> Dict[str, Any]:
-        """Retrieve the document's metadata and content."""
-        return self.service.documents().get(documentId=self.document_id).execute()
+    def get_document(self, fields: str = None) -> Dict[str, Any]:
+        """Retrieve the document's metadata and content, optionally limited to a field mask."""
+        with TRACER.span('http.docs.get', document_id=self.document_id, fields=fields or '*'):
+            if fields:
+                return self.service.documents().get(documentId=self.document_id, fields=fields).execute()
+            return self.service.documents().get(documentId=self.document_id).execute()
 
-    def read_content(self) -> str:
-        """Read the plain text content of the document."""
-        document = self.get_document()
+    def get_revision_id(self) -> str:
+        """Retrieve only the document's current revision ID."""
+        with TRACER.span('http.docs.get', document_id=self.document_id, fields='revisionId'):
+            document = self.service.documents().get(
+                documentId=self.document_id,
+                fields='revisionId'
+            ).execute()
+        return document.get('revisionId', '')
+
+    def get_version(self) -> str:
+        """Return the document's Drive version, revalidated through the document cache."""
+        return self.cache.version(self.document_id)
+
+    def read_content(self, use_cache: bool = True) -> str:
+        """Read the plain text content of the document, downloading it only if it changed."""
+        if use_cache:
+            return self.cache.read(self)
+        return self.download_content()
+
+    def download_content(self) -> str:
+        """Download the document's text, bypassing the cache."""
+        document = self.get_document(fields=self.TEXT_FIELDS)
         return self._extract_text(document)
 
     def _extract_text(self, document: Dict[str, Any]) -> str:
@@ -72,10 +103,12 @@ class GoogleDoc:
                 }
             }
         ]
-        return self.service.documents().batchUpdate(
+        result = self.service.documents().batchUpdate(
             documentId=self.document_id,
             body={'requests': requests}
         ).execute()
+        self.cache.invalidate(self.document_id)
+        return result
 
     def _get_end_index(self) -> int:
         """Get the end index for deleting content."""
@@ -90,10 +123,246 @@ class GoogleDoc:
                 'text': additional_text
             }
         }]
-        return self.service.documents().batchUpdate(
+        result = self.service.documents().batchUpdate(
             documentId=self.document_id,
             body={'requests': requests}
         ).execute()
+        self.cache.invalidate(self.document_id)
+        return result
+
+class DocumentCache:
+    """
+    The DocumentCache class holds the text of Google Docs together with the Drive version and
+    modifiedTime it was read at. A read first revalidates with a Drive metadata call and downloads
+    the document again only if its version changed; revalidate() checks many documents in one batched
+    request. A document validated within the last max_age seconds is served without any call.
+    prefetch() brings many documents up to date with one batched check and one batched download.
+    With persist_path set, entries are saved as JSON so a restarted kernel starts warm.
+    """
+    METADATA_FIELDS = 'id,version,modifiedTime'
+    # Drive accepts at most 100 calls per batch request
+    BATCH_SIZE = 100
+
+    def __init__(self, max_age: float = 30.0, persist_path: str = None, drive_service: Any = None):
+        self.max_age = max_age
+        # {document_id: {'version', 'modifiedTime', 'text'}}
+        self.entries = {}
+        # {document_id: (version, modifiedTime, time.monotonic() of the check)}
+        self.checked = {}
+        self.persist_path = None
+        self.drive_service = drive_service
+        # {document_id: threading.Event} for downloads in progress
+        self.inflight = {}
+        self.lock = threading.Lock()
+        if persist_path:
+            self.enable_persistence(persist_path)
+
+    def _drive(self):
+        if self.drive_service is not None:
+            return self.drive_service
+        return GOOGLE_SERVICES.service('drive', 'v3')
+
+    def enable_persistence(self, path: str):
+        """Save entries to path from now on, loading any entries already saved there."""
+        with self.lock:
+            self.persist_path = path
+            if not os.path.exists(path):
+                return
+            try:
+                with open(path) as f:
+                    saved = json.load(f)
+            except (OSError, ValueError) as e:
+                if DEBUG:
+                    print(f"Ignoring unreadable document cache {path}: {str(e)}")
+                return
+            # Loaded entries are unchecked, so their first use revalidates them
+            for document_id, entry in saved.get('documents', {}).items():
+                self.entries.setdefault(document_id, entry)
+        if DEBUG:
+            print(f"Loaded {len(self.entries)} cached documents from {path}")
+
+    def _save(self):
+        with self.lock:
+            if not self.persist_path:
+                return
+            data = {'documents': dict(self.entries)}
+            directory = os.path.dirname(self.persist_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.persist_path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.persist_path)
+
+    def _fresh(self, document_id: str) -> bool:
+        checked = self.checked.get(document_id)
+        return checked is not None and time.monotonic() - checked[2] < self.max_age
+
+    def fetch_metadata(self, document_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Return {document_id: {'version', 'modifiedTime'}}, using one batched request per BATCH_SIZE docs."""
+        if len(document_ids) == 1:
+            with TRACER.span('http.drive.files.get', document_id=document_ids[0], fields=self.METADATA_FIELDS):
+                try:
+                    return {document_ids[0]: self._drive().files().get(
+                        fileId=document_ids[0], fields=self.METADATA_FIELDS, supportsAllDrives=True
+                    ).execute()}
+                except Exception as e:
+                    raise ValueError(f"Failed to read Drive metadata for {document_ids[0]} ({str(e)})")
+
+        metadata, errors = {}, {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                metadata[request_id] = response
+
+        for start in range(0, len(document_ids), self.BATCH_SIZE):
+            chunk = document_ids[start:start + self.BATCH_SIZE]
+            batch = self._drive().new_batch_http_request(callback=callback)
+            for document_id in chunk:
+                batch.add(self._drive().files().get(
+                    fileId=document_id, fields=self.METADATA_FIELDS, supportsAllDrives=True
+                ), request_id=document_id)
+            with TRACER.span('http.drive.batch', documents=len(chunk)):
+                batch.execute()
+        if errors:
+            failed = ', '.join(f"{document_id} ({str(error)})" for document_id, error in errors.items())
+            raise ValueError(f"Failed to read Drive metadata for {failed}")
+        return metadata
+
+    def revalidate(self, document_ids: List[str], force: bool = False):
+        """Check the Drive versions of documents not validated within max_age, in one batched request."""
+        with self.lock:
+            stale = [document_id for document_id in dict.fromkeys(document_ids)
+                     if force or not self._fresh(document_id)]
+        if not stale:
+            return
+        metadata = self.fetch_metadata(stale)
+        now = time.monotonic()
+        with self.lock:
+            for document_id, response in metadata.items():
+                self.checked[document_id] = (response.get('version', ''), response.get('modifiedTime', ''), now)
+
+    def version(self, document_id: str) -> str:
+        """Return the document's current Drive version, checking it if it was not validated recently."""
+        self.revalidate([document_id])
+        with self.lock:
+            return self.checked.get(document_id, ('',))[0]
+
+    def _current(self, document_id: str) -> bool:
+        """True if the cached text matches the last checked version. Call with the lock held."""
+        entry = self.entries.get(document_id)
+        checked = self.checked.get(document_id)
+        return entry is not None and (checked is None or entry['version'] == checked[0])
+
+    def download(self, google_docs: List[GoogleDoc]):
+        """
+        Download the text of documents and cache it under their checked versions: one batched Docs
+        request per BATCH_SIZE documents, or concurrent requests if the service cannot batch.
+        Raises ValueError naming every document that could not be downloaded.
+        """
+        texts, errors = {}, {}
+        service = google_docs[0].service
+        if len(google_docs) == 1:
+            texts[google_docs[0].document_id] = google_docs[0].download_content()
+        elif hasattr(service, 'new_batch_http_request'):
+            by_id = {google_doc.document_id: google_doc for google_doc in google_docs}
+
+            def callback(request_id, response, exception):
+                if exception is not None:
+                    errors[request_id] = exception
+                else:
+                    texts[request_id] = by_id[request_id]._extract_text(response)
+
+            for start in range(0, len(google_docs), self.BATCH_SIZE):
+                chunk = google_docs[start:start + self.BATCH_SIZE]
+                batch = service.new_batch_http_request(callback=callback)
+                for google_doc in chunk:
+                    batch.add(service.documents().get(documentId=google_doc.document_id,
+                                                      fields=GoogleDoc.TEXT_FIELDS),
+                              request_id=google_doc.document_id)
+                with TRACER.span('http.docs.batch', documents=len(chunk)):
+                    batch.execute()
+        else:
+            with ThreadPoolExecutor(max_workers=min(8, len(google_docs))) as executor:
+                # Each download runs in a copy of the caller's context so its spans nest under the caller's
+                futures = {google_doc.document_id: executor.submit(contextvars.copy_context().run,
+                                                                   google_doc.download_content)
+                           for google_doc in google_docs}
+            for document_id, future in futures.items():
+                try:
+                    texts[document_id] = future.result()
+                except Exception as e:
+                    errors[document_id] = e
+        if errors:
+            failed = ', '.join(f"{document_id} ({str(error)})" for document_id, error in errors.items())
+            raise ValueError(f"Failed to download documents: {failed}")
+
+        with self.lock:
+            for document_id, text in texts.items():
+                version, modified_time = self.checked.get(document_id, ('', '', 0))[:2]
+                self.entries[document_id] = {'version': version, 'modifiedTime': modified_time, 'text': text}
+        self._save()
+
+    def prefetch(self, google_docs: List[GoogleDoc]) -> Dict[str, str]:
+        """
+        Bring documents up to date with one batched version check and one batched download of the
+        changed ones, and return {document_id: text}. A document another thread is already
+        downloading is waited for rather than downloaded twice.
+        """
+        by_id = {google_doc.document_id: google_doc for google_doc in google_docs}
+        self.revalidate(list(by_id))
+        with self.lock:
+            missing = [document_id for document_id in by_id if not self._current(document_id)]
+            waiting = [self.inflight[document_id] for document_id in missing if document_id in self.inflight]
+            owned = [document_id for document_id in missing if document_id not in self.inflight]
+            for document_id in owned:
+                self.inflight[document_id] = threading.Event()
+        try:
+            if owned:
+                if DEBUG:
+                    print(f"Downloading {len(owned)} documents: {', '.join(owned)}")
+                self.download([by_id[document_id] for document_id in owned])
+        finally:
+            with self.lock:
+                events = [self.inflight.pop(document_id) for document_id in owned]
+            for event in events:
+                event.set()
+        for event in waiting:
+            event.wait()
+
+        with self.lock:
+            failed = [document_id for document_id in by_id if not self._current(document_id)]
+            texts = {document_id: self.entries[document_id]['text'] for document_id in by_id
+                     if document_id not in failed}
+        if failed:
+            raise ValueError(f"Failed to download documents: {', '.join(failed)}")
+        return texts
+
+    def read(self, google_doc: GoogleDoc) -> str:
+        """Return the document's text, downloading it only if its Drive version changed."""
+        return self.prefetch([google_doc])[google_doc.document_id]
+
+    def expire(self):
+        """Make the next use of every document revalidate it, keeping the text for unchanged ones."""
+        with self.lock:
+            self.checked.clear()
+
+    def invalidate(self, document_id: str):
+        """Forget a document's text and version, e.g. after writing to it."""
+        with self.lock:
+            self.entries.pop(document_id, None)
+            self.checked.pop(document_id, None)
+        self._save()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.checked.clear()
+        self._save()
+
+DOC_CACHE = DocumentCache()
 
 # if __name__ == "__main__":
 
@@ -104,6 +373,10 @@ class GoogleDoc:
 #     print("\nContent of the Google Doc:")
 #     print(content)
 
+#     # A second read only checks the Drive version; persistence keeps the text across kernel restarts
+#     DOC_CACHE.enable_persistence("cache/documents.json")
+#     print(doc.read_content() == content, doc.get_version())
+
 #     doc.update_content("This is the new content of the document.")
 #     print("\nGoogle Doc content has been updated.")
 
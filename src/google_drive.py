@@ -4,18 +4,18 @@
 # google_drive.py: Module to interact with Google Drive.
 
 from typing import Dict, Any, Optional, List
-from googleapiclient.discovery import build
-from google.colab import auth
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
+from concurrent.futures import ThreadPoolExecutor
+import io
 
 class GoogleDrive:
-    def __init__(self):
-        self.service = self._init_service()
+    def __init__(self, service: Any = None):
+        # Shared client from GOOGLE_SERVICES unless one is injected, e.g. a local fake
+        self.service = service if service is not None else self._init_service()
 
     def _init_service(self):
-        """Initialize Google Drive service."""
-        auth.authenticate_user()
-        return build('drive', 'v3', credentials=None)
+        """Return the shared Google Drive service."""
+        return GOOGLE_SERVICES.service('drive', 'v3')
 
     def file_exists(self, file_name: str, parent_id: Optional[str] = None) -> bool:
         """
@@ -117,24 +117,173 @@ class GoogleDrive:
 
         return file.get('id')
 
-    def get_files_in_directory(self, dir_id: str) -> List[Dict[str, str]]:
+    def get_files_in_directory(self, dir_id: str, fields: str = 'id, name, mimeType') -> List[Dict[str, str]]:
         """
-        List all files in a directory.
+        List all files in a directory, following nextPageToken across pages.
 
         Args:
             dir_id: ID of the directory to list
+            fields: Field mask for each file
 
         Returns:
-            List[Dict[str, str]]: List of files with their IDs and names
+            List[Dict[str, str]]: List of files with the requested fields
         """
         query = f"'{dir_id}' in parents and trashed = false"
-        results = self.service.files().list(
-            q=query,
-            spaces='drive',
-            fields='files(id, name, mimeType)'
+        files = []
+        page_token = None
+        while True:
+            results = self.service.files().list(
+                q=query,
+                spaces='drive',
+                pageSize=1000,
+                pageToken=page_token,
+                fields=f'nextPageToken, files({fields})'
+            ).execute()
+            files.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
+
+    # Fields compared when syncing: binary files have a checksum, Google Docs only a modification time
+    SYNC_FIELDS = 'id, name, mimeType, md5Checksum, modifiedTime'
+    # Drive accepts at most 100 calls per batch request
+    BATCH_SIZE = 100
+
+    @staticmethod
+    def _needs_update(source: Dict[str, Any], destination: Dict[str, Any]) -> bool:
+        """True if source differs from destination by checksum or, without checksums, is newer."""
+        if source.get('md5Checksum') and destination.get('md5Checksum'):
+            return source['md5Checksum'] != destination['md5Checksum']
+        # RFC 3339 timestamps in UTC compare correctly as strings
+        return source.get('modifiedTime', '') > destination.get('modifiedTime', '')
+
+    def plan_sync(self, source_id: str, destination_id: str, mime_types: List[str] = None,
+                  update: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Diff two directories by file name, listing each once.
+
+        Args:
+            source_id: ID of the directory to copy from
+            destination_id: ID of the directory to copy into
+            mime_types: Only sync files of these MIME types, all files if None
+            update: Whether to overwrite destination files that differ from the source
+
+        Returns:
+            Dict[str, List]: 'copy', 'update' and 'skip' lists of {'source', 'destination'} pairs
+        """
+        sources = [f for f in self.get_files_in_directory(source_id, self.SYNC_FIELDS)
+                   if mime_types is None or f['mimeType'] in mime_types]
+        destinations = {}
+        for f in self.get_files_in_directory(destination_id, self.SYNC_FIELDS):
+            destinations.setdefault(f['name'], f)
+
+        plan = {'copy': [], 'update': [], 'skip': []}
+        seen = set()
+        for source in sources:
+            if source['name'] in seen:
+                print(f"Skipped {source['name']} - duplicate name in source directory")
+                continue
+            seen.add(source['name'])
+            destination = destinations.get(source['name'])
+            if destination is None:
+                action = 'copy'
+            elif update and self._needs_update(source, destination):
+                action = 'update'
+            else:
+                action = 'skip'
+            plan[action].append({'source': source, 'destination': destination})
+        return plan
+
+    def _copy_batch(self, files: List[Dict[str, Any]], destination_id: str, failed: Dict[str, str]):
+        """Copy up to BATCH_SIZE files into destination_id with one batch request."""
+        def callback(request_id, response, exception):
+            if exception is not None:
+                failed[files[int(request_id)]['name']] = str(exception)
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for index, file in enumerate(files):
+            batch.add(self.service.files().copy(
+                fileId=file['id'],
+                body={'name': file['name'], 'parents': [destination_id]},
+                fields='id'
+            ), request_id=str(index))
+        batch.execute()
+
+    def _update_file(self, source: Dict[str, Any], destination: Dict[str, Any]):
+        """Overwrite destination with source's content in place, so its ID and links stay valid."""
+        if source['mimeType'] == 'application/vnd.google-apps.document':
+            text = GoogleDoc(f"https://docs.google.com/document/d/{source['id']}").read_content(use_cache=False)
+            GoogleDoc(f"https://docs.google.com/document/d/{destination['id']}").update_content(text)
+            return
+        content = self.service.files().get_media(fileId=source['id']).execute()
+        self.service.files().update(
+            fileId=destination['id'],
+            media_body=MediaIoBaseUpload(io.BytesIO(content), mimetype=source['mimeType'])
         ).execute()
 
-        return results.get('files', [])
+    def sync_directory(self, source_id: str, destination_id: str, mime_types: List[str] = None,
+                       update: bool = True, dry_run: bool = False, max_workers: int = 8) -> Dict[str, Any]:
+        """
+        Make destination_id contain every file of source_id: missing files are copied in batch
+        requests and, with update, changed files are overwritten, all running concurrently.
+
+        Args:
+            source_id: ID of the directory to copy from
+            destination_id: ID of the directory to copy into
+            mime_types: Only sync files of these MIME types, all files if None
+            update: Whether to overwrite destination files that differ from the source
+            dry_run: Only report what would be copied and updated
+            max_workers: Number of concurrent batch requests and updates
+
+        Returns:
+            Dict[str, Any]: File names per action ('copy', 'update', 'skip') and 'failed' {name: error}
+        """
+        plan = self.plan_sync(source_id, destination_id, mime_types, update)
+        report = {action: [pair['source']['name'] for pair in pairs] for action, pairs in plan.items()}
+        report['failed'] = {}
+        if dry_run:
+            self.print_sync_report(report, dry_run=True)
+            return report
+
+        copies = [pair['source'] for pair in plan['copy']]
+        futures = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Requests are built on the worker thread so each batch goes over that thread's connection
+            for start in range(0, len(copies), self.BATCH_SIZE):
+                chunk = copies[start:start + self.BATCH_SIZE]
+                futures[tuple(f['name'] for f in chunk)] = executor.submit(
+                    self._copy_batch, chunk, destination_id, report['failed'])
+            for pair in plan['update']:
+                futures[(pair['source']['name'],)] = executor.submit(
+                    self._update_file, pair['source'], pair['destination'])
+        for names, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                for name in names:
+                    report['failed'][name] = str(e)
+        for action in ('copy', 'update'):
+            report[action] = [name for name in report[action] if name not in report['failed']]
+
+        self.print_sync_report(report)
+        if report['failed']:
+            raise ValueError(f"Failed to sync {len(report['failed'])} files: {', '.join(report['failed'])}")
+        return report
+
+    @staticmethod
+    def print_sync_report(report: Dict[str, Any], dry_run: bool = False):
+        """Print one line per file and a summary; a dry run reports what would be done."""
+        for action, done in (('copy', 'Copied'), ('update', 'Updated'), ('skip', 'Skipped')):
+            for name in report[action]:
+                print(f"Would {action} {name}" if dry_run else f"{done} {name}")
+        for name, error in report['failed'].items():
+            print(f"Failed {name}: {error}")
+        if dry_run:
+            print(f"Dry run: {len(report['copy'])} to copy, {len(report['update'])} to update, "
+                  f"{len(report['skip'])} unchanged")
+        else:
+            print(f"{len(report['copy'])} copied, {len(report['update'])} updated, "
+                  f"{len(report['skip'])} unchanged, {len(report['failed'])} failed")
 
 # if __name__ == "__main__":
 #     drive = GoogleDrive()
@@ -152,4 +301,7 @@ class GoogleDrive:
 #     files = drive.get_files_in_directory(colab_folder_id)
 #     print("\nFiles in ColabAgent folder:")
 #     for file in files:
-#         print(f"- {file['name']} ({file['id']})")
\ No newline at end of file
+#         print(f"- {file['name']} ({file['id']})")
+
+#     # Preview copying a shared folder into ColabAgent
+#     drive.sync_directory("1AYlnc58M0TnMuDTPr4x_bwaJIlSV5-3v", colab_folder_id, dry_run=True)
\ No newline at end of file
@@ -0,0 +1,94 @@
+%%capture
+# @title Google Services
+
+# google_services.py: Module to share authenticated Google API clients across the notebook.
+
+from typing import Dict, Any, Optional
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+from google.colab import auth
+import google.auth
+import google.auth.exceptions
+import google_auth_httplib2
+import httplib2
+import threading
+
+class GoogleServices:
+    """
+    The GoogleServices class is a process-wide registry of Google API clients. It authenticates once
+    and builds each service once from the discovery documents bundled with googleapiclient. Requests
+    are sent over a per-thread Http, so threads never share a connection and each thread reuses its own.
+    Services registered with register() are returned as-is, e.g. to point the wrappers at local fakes.
+    """
+
+    def __init__(self, credentials: Any = None, timeout: float = 120):
+        self.credentials = credentials
+        self.timeout = timeout
+        self.authenticated = credentials is not None
+        self.services = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def authenticate(self):
+        """Authenticate the Colab user once and keep the resulting default credentials."""
+        with self.lock:
+            if self.authenticated:
+                return
+            auth.authenticate_user()
+            try:
+                self.credentials, _ = google.auth.default()
+            except google.auth.exceptions.DefaultCredentialsError as e:
+                # Without credentials requests are sent unauthenticated, which only local servers accept
+                if DEBUG:
+                    print(f"No default Google credentials: {str(e)}")
+            self.authenticated = True
+
+    def http(self) -> httplib2.Http:
+        """Return this thread's Http, authorized with the shared credentials."""
+        http = getattr(self.local, 'http', None)
+        if http is None:
+            http = httplib2.Http(timeout=self.timeout)
+            if self.credentials is not None:
+                http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=http)
+            self.local.http = http
+        return http
+
+    def _request_builder(self, http: httplib2.Http, *args, **kwargs) -> HttpRequest:
+        # Requests are built on whichever thread calls the service, so they take that thread's Http
+        return HttpRequest(self.http(), *args, **kwargs)
+
+    def service(self, name: str, version: str) -> Any:
+        """Return the shared client for a Google API, building it on first use."""
+        key = (name, version)
+        service = self.services.get(key)
+        if service is not None:
+            return service
+        self.authenticate()
+        with self.lock:
+            if key not in self.services:
+                self.services[key] = build(name, version, credentials=self.credentials,
+                                           requestBuilder=self._request_builder,
+                                           static_discovery=True, cache_discovery=False)
+            return self.services[key]
+
+    def register(self, name: str, version: str, service: Any):
+        """Use service for a Google API instead of building one."""
+        with self.lock:
+            self.services[(name, version)] = service
+
+    def reset(self):
+        """Forget built services, credentials and per-thread connections."""
+        with self.lock:
+            self.services.clear()
+            self.authenticated = False
+            self.credentials = None
+            self.local = threading.local()
+
+GOOGLE_SERVICES = GoogleServices()
+
+# if __name__ == "__main__":
+#     docs = GOOGLE_SERVICES.service('docs', 'v1')
+#     # Built once: later wrappers reuse the same client
+#     print(docs is GOOGLE_SERVICES.service('docs', 'v1'))
+#     # Point the wrappers at a local stand-in
+#     GOOGLE_SERVICES.register('sheets', 'v4', FakeSheetsService())
@@ -5,10 +5,9 @@
 
 import pandas as pd
 import re
+import time
 from urllib.parse import parse_qs, urlparse
-from typing import Dict, Any
-from googleapiclient.discovery import build
-from google.colab import auth
+from typing import Dict, Any, List, Iterator
 
 class GoogleSheet:
     """
@@ -16,15 +15,17 @@ class GoogleSheet:
     It allows reading sheet data into a pandas DataFrame, updating sheet values, and retrieving metadata.
     """
     
-    def __init__(self, url: str):
+    def __init__(self, url: str, service: Any = None):
         self.url = url
         self.spreadsheet_id, self.gid = self._extract_spreadsheet_info(url)
-        self.service = self._init_service()
+        # Shared client from GOOGLE_SERVICES unless one is injected, e.g. a local fake
+        self.service = service if service is not None else self._init_service()
+        # Rows in the tab's grid, from the same metadata; None if the API did not report it
+        self.grid_rows = None
         self.sheet_name = self._get_sheet_name()
 
     def _init_service(self):
-        auth.authenticate_user()
-        return build('sheets', 'v4', credentials=None)
+        return GOOGLE_SERVICES.service('sheets', 'v4')
 
     @staticmethod
     def _extract_spreadsheet_info(url: str):
@@ -40,21 +41,24 @@ class GoogleSheet:
         return spreadsheet_id, gid
 
     def _get_sheet_name(self) -> str:
-        sheet_metadata = self.service.spreadsheets().get(
-            spreadsheetId=self.spreadsheet_id
-        ).execute()
+        with TRACER.span('http.sheets.get'):
+            sheet_metadata = self.service.spreadsheets().get(
+                spreadsheetId=self.spreadsheet_id
+            ).execute()
 
         for sheet in sheet_metadata.get('sheets', ''):
             if sheet['properties']['sheetId'] == int(self.gid):
+                self.grid_rows = sheet['properties'].get('gridProperties', {}).get('rowCount')
                 return sheet['properties']['title']
         return 'Sheet1'
 
     def read_to_dataframe(self) -> pd.DataFrame:
         """Read sheet contents into a pandas DataFrame."""
-        result = self.service.spreadsheets().values().get(
-            spreadsheetId=self.spreadsheet_id,
-            range=self.sheet_name
-        ).execute()
+        with TRACER.span('http.sheets.values.get', range=self.sheet_name):
+            result = self.service.spreadsheets().values().get(
+                spreadsheetId=self.spreadsheet_id,
+                range=self.sheet_name
+            ).execute()
 
         values = result.get('values', [])
         if not values:
@@ -64,34 +68,136 @@ class GoogleSheet:
         data = values[1:]
         return pd.DataFrame(data, columns=headers)
 
+    def iter_rows(self, chunk_size: int = 1000, as_dict: bool = False) -> Iterator[Any]:
+        """
+        Read the sheet chunk_size rows at a time, yielding each data row as a tuple padded to the
+        header width, or as a {header: value} dict. The header is read before returning, so an empty
+        sheet fails immediately; later chunks are only requested as the iterator is consumed.
+        Blank rows are yielded as empty rows, like the rows around them.
+        """
+        headers = self.get_values(f"{self.sheet_name}!1:1")
+        if not headers:
+            raise ValueError('No data found in spreadsheet')
+        headers = headers[0]
+
+        def rows():
+            start = 2
+            blank = 0
+            while True:
+                values = self.get_values(f"{self.sheet_name}!{start}:{start + chunk_size - 1}")
+                # The API drops trailing empty rows, so a short or empty chunk may still be followed by data
+                # within the grid; an empty chunk that reaches the end of the grid means the sheet has ended
+                if not values and (self.grid_rows is None or start + chunk_size - 1 >= self.grid_rows):
+                    return
+                if values:
+                    empty = ('',) * len(headers)
+                    for _ in range(blank):
+                        yield dict(zip(headers, empty)) if as_dict else empty
+                    blank = 0
+                for row in values:
+                    row = tuple(row) + ('',) * (len(headers) - len(row))
+                    yield dict(zip(headers, row)) if as_dict else row
+                # Blank rows at the end of the chunk are only yielded if more data follows them
+                blank += chunk_size - len(values)
+                start += chunk_size
+        return rows()
+
     def get_metadata(self) -> Dict[str, Any]:
         """Get sheet metadata."""
-        return self.service.spreadsheets().get(
-            spreadsheetId=self.spreadsheet_id
-        ).execute()
+        with TRACER.span('http.sheets.get'):
+            return self.service.spreadsheets().get(
+                spreadsheetId=self.spreadsheet_id
+            ).execute()
 
     def update_values(self, range_name: str, values: list):
         """Update values in specified range."""
         body = {'values': values}
-        self.service.spreadsheets().values().update(
-            spreadsheetId=self.spreadsheet_id,
-            range=range_name,
-            valueInputOption='RAW',
-            body=body
-        ).execute()
+        with TRACER.span('http.sheets.values.update', range=range_name, rows=len(values)):
+            self.service.spreadsheets().values().update(
+                spreadsheetId=self.spreadsheet_id,
+                range=range_name,
+                valueInputOption='RAW',
+                body=body
+            ).execute()
 
     def get_values(self, range_name: str) -> List[List[Any]]:
         """Get values from the specified range."""
-        result = self.service.spreadsheets().values().get(
-            spreadsheetId=self.spreadsheet_id,
-            range=range_name
-        ).execute()
+        with TRACER.span('http.sheets.values.get', range=range_name):
+            result = self.service.spreadsheets().values().get(
+                spreadsheetId=self.spreadsheet_id,
+                range=range_name
+            ).execute()
         return result.get('values', [])
 
+    def batch_update_values(self, data: List[Dict[str, Any]]):
+        """Update several ranges in one request. Each entry is {'range': ..., 'values': ...}."""
+        body = {'valueInputOption': 'RAW', 'data': data}
+        with TRACER.span('http.sheets.values.batchUpdate', ranges=len(data)):
+            self.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=self.spreadsheet_id,
+                body=body
+            ).execute()
+
+    def clear_values(self, range_name: str):
+        """Clear values in the specified range."""
+        with TRACER.span('http.sheets.values.clear', range=range_name):
+            self.service.spreadsheets().values().clear(
+                spreadsheetId=self.spreadsheet_id,
+                range=range_name,
+                body={}
+            ).execute()
+
+class BufferedSheetWriter:
+    """
+    The BufferedSheetWriter class buffers rows destined for a sheet tab and writes them in batches.
+    The write cursor is tracked locally, so no reads are needed to find the next free row.
+    """
+
+    def __init__(self, sheet: GoogleSheet, tab_name: str = 'output', start_row: int = 1,
+                 batch_size: int = 50, flush_interval: float = 10.0):
+        self.sheet = sheet
+        self.tab_name = tab_name
+        self.next_row = start_row
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def write_row(self, values: List[Any]):
+        """Buffer a row, flushing when the batch size or time window is reached."""
+        self.buffer.append([str(x) for x in values])
+        if (len(self.buffer) >= self.batch_size or
+                time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows starting at the current cursor."""
+        if self.buffer:
+            self.sheet.batch_update_values([{
+                'range': f"{self.tab_name}!A{self.next_row}",
+                'values': self.buffer
+            }])
+            self.next_row += len(self.buffer)
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 # if __name__ == "__main__":
 #     # Test GoogleSheet functionality
 #     sheet_url = "https://docs.google.com/spreadsheets/d/1Tarn_9Hou5HVY8nxY7ox84mIvjUFUl9sQKNY4GpU_7g/edit?gid=61014510#gid=61014510"
 #     sheet = GoogleSheet(sheet_url)
 #     df = sheet.read_to_dataframe()
 #     print("First few rows of the Google Sheet:")
-#     print(df.head())
\ No newline at end of file
+#     print(df.head())
+
+#     # Large sheets: read 500 rows per request without building a DataFrame
+#     for row in sheet.iter_rows(chunk_size=500, as_dict=True):
+#         print(row)
\ No newline at end of file
@@ -4,9 +4,17 @@
 # llm_api.py: Module providing an abstract base class for LLM providers and an implementation for Anthropic's API.
 
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Callable, AsyncIterator
+from collections import OrderedDict
 import anthropic
+import httpx
+import threading
+import asyncio
+import hashlib
+import sqlite3
+import random
 import json
+import time
 import os
 
 class LLMProvider(ABC):
@@ -30,21 +38,388 @@ class LLMProvider(ABC):
     def parse_response(self, response: Any) -> str:
         pass
 
-    def process_prompt(self, prompt_dicts: List[Dict[str, Any]]) -> str:
+    def stream(self, messages_and_system: tuple, on_text: Callable[[str], None] = None,
+               stop_when: Callable[[str], bool] = None) -> str:
+        """Providers without streaming support deliver the whole response as a single delta."""
+        text = self.parse_response(self.generate(messages_and_system))
+        if on_text is not None:
+            on_text(text)
+        return text
+
+    def process_prompt(self, prompt_dicts: List[Dict[str, Any]], on_text: Callable[[str], None] = None,
+                       stop_when: Callable[[str], bool] = None) -> str:
         messages_and_system = self.convert_to_messages(prompt_dicts)
+        if on_text is not None or stop_when is not None:
+            return self.stream(messages_and_system, on_text, stop_when)
         response = self.generate(messages_and_system)
         return self.parse_response(response)
 
+def content_text(content: Any) -> str:
+    """Return the text of a message content given as a string or a list of text blocks."""
+    if isinstance(content, str):
+        return content
+    return ''.join(block.get('text', '') for block in content)
+
+def canonical_request(request_args: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reduce request arguments to what determines the response, ignoring prompt-cache breakpoints
+    and whether text was sent as a plain string or as content blocks.
+    """
+    system = request_args.get('system', '')
+    if not isinstance(system, str):
+        system = ' '.join(block.get('text', '') for block in system)
+    return {
+        'model': request_args.get('model'),
+        'max_tokens': request_args.get('max_tokens'),
+        'temperature': request_args.get('temperature'),
+        'system': system,
+        'messages': [[msg['role'], content_text(msg['content'])] for msg in request_args.get('messages', [])]
+    }
+
+class ResponseCache:
+    """
+    The ResponseCache class stores LLM responses on disk in SQLite, keyed by a hash of the request.
+    Entries are evicted by age and by total count/size. One instance can be shared across threads.
+    """
+
+    def __init__(self, path: str = "llm_cache.sqlite", max_entries: int = 10000,
+                 max_bytes: int = 512 * 1024 * 1024, max_age: float = 7 * 24 * 3600,
+                 bypass: bool = False):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # When set, lookups are skipped but fresh responses are still stored
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.puts_since_evict = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT, size INTEGER, created REAL, accessed REAL)"
+            )
+        self.evict()
+
+    @staticmethod
+    def make_key(request_args: Dict[str, Any]) -> str:
+        """Hash the request arguments (model, system, messages, max_tokens, temperature)."""
+        payload = json.dumps(canonical_request(request_args), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response JSON for key, or None on a miss."""
+        if self.bypass:
+            return None
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response), now, now)
+            )
+            self.puts_since_evict += 1
+            run_eviction = self.puts_since_evict >= 100
+        if run_eviction:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used entries over the count/size limits."""
+        with self.lock:
+            self.puts_since_evict = 0
+            self.conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+            count, total_size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            if count <= self.max_entries and total_size <= self.max_bytes:
+                return
+            rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+            stale_keys = []
+            for key, size in rows:
+                if count <= self.max_entries and total_size <= self.max_bytes:
+                    break
+                stale_keys.append((key,))
+                count -= 1
+                total_size -= size
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            count, total_size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': count, 'bytes': total_size}
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+
+class TokenBucket:
+    """A token bucket refilled continuously at rate_per_minute, holding at most one minute of budget."""
+
+    def __init__(self, rate_per_minute: float, now: float = None):
+        self.rate_per_minute = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic() if now is None else now
+
+    def set_rate(self, rate_per_minute: float):
+        self.rate_per_minute = rate_per_minute
+        self.tokens = min(self.tokens, rate_per_minute)
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take amount from the bucket and return how long the caller must wait before using it."""
+        rate_per_second = self.rate_per_minute / 60.0
+        self.tokens = min(self.rate_per_minute, self.tokens + (now - self.updated) * rate_per_second)
+        self.updated = now
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / rate_per_second
+
+class RateLimitScheduler:
+    """
+    The RateLimitScheduler class paces LLM calls against requests-per-minute and tokens-per-minute budgets.
+    It caps concurrent requests, retries throttled calls with jittered exponential backoff, and adapts its
+    limits from the rate-limit headers and retry-after values returned by the API.
+    One instance is meant to be shared by every provider in the process. The clock and sleep functions
+    can be replaced, e.g. by a simulated clock in tests; the asyncio variants always sleep on the event loop.
+    """
+
+    RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+    def __init__(self, requests_per_minute: float = 50, tokens_per_minute: float = 40000,
+                 max_concurrency: int = 64, max_retries: int = 6, base_delay: float = 1.0,
+                 max_delay: float = 60.0, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.request_bucket = TokenBucket(requests_per_minute, clock())
+        self.token_bucket = TokenBucket(tokens_per_minute, clock())
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.paused_until = 0.0
+        self.successes = 0
+        self.stats = {
+            'calls': 0, 'retries': 0, 'throttled': 0, 'max_queue_depth': 0,
+            'total_wait': 0.0, 'max_wait': 0.0
+        }
+
+    @staticmethod
+    def estimate_tokens(request_args: Dict[str, Any]) -> int:
+        """Rough input token estimate (about four characters per token)."""
+        text = json.dumps(request_args.get('messages', [])) + json.dumps(request_args.get('system', ''))
+        return len(text) // 4 + 1
+
+    def _try_acquire(self, tokens: int) -> Optional[float]:
+        """Take a concurrency slot and budget if possible; return the pacing delay, or None to keep waiting."""
+        now = self.clock()
+        if now < self.paused_until or self.in_flight >= self.concurrency_limit:
+            return None
+        self.in_flight += 1
+        return max(self.request_bucket.reserve(1, now), self.token_bucket.reserve(tokens, now))
+
+    def _enqueue(self):
+        with self.condition:
+            self.queue_depth += 1
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.queue_depth)
+
+    def _dequeue(self, wait: float):
+        with self.condition:
+            self.queue_depth -= 1
+            self.stats['calls'] += 1
+            self.stats['total_wait'] += wait
+            self.stats['max_wait'] = max(self.stats['max_wait'], wait)
+
+    def acquire(self, tokens: int) -> float:
+        """Block until a call may start. Returns the time spent waiting."""
+        start = self.clock()
+        self._enqueue()
+        with self.condition:
+            delay = self._try_acquire(tokens)
+            while delay is None:
+                self.condition.wait(timeout=0.1)
+                delay = self._try_acquire(tokens)
+        self.sleep(delay)
+        wait = self.clock() - start
+        self._dequeue(wait)
+        return wait
+
+    async def acquire_async(self, tokens: int) -> float:
+        """Wait on the event loop until a call may start. Returns the time spent waiting."""
+        start = self.clock()
+        self._enqueue()
+        while True:
+            with self.condition:
+                delay = self._try_acquire(tokens)
+            if delay is not None:
+                break
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(delay)
+        wait = self.clock() - start
+        self._dequeue(wait)
+        return wait
+
+    def release(self, success: bool = True):
+        """Free a concurrency slot; sustained success slowly raises the concurrency limit again."""
+        with self.condition:
+            self.in_flight -= 1
+            if success:
+                self.successes += 1
+                if self.successes >= self.concurrency_limit and self.concurrency_limit < self.max_concurrency:
+                    self.concurrency_limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+    def update_from_headers(self, headers: Any):
+        """Adopt the account's real limits from anthropic-ratelimit-* response headers."""
+        if not headers:
+            return
+        with self.condition:
+            request_limit = headers.get('anthropic-ratelimit-requests-limit')
+            if request_limit:
+                self.request_bucket.set_rate(float(request_limit))
+            token_limit = (headers.get('anthropic-ratelimit-input-tokens-limit') or
+                           headers.get('anthropic-ratelimit-tokens-limit'))
+            if token_limit:
+                self.token_bucket.set_rate(float(token_limit))
+
+    def retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Return how long to sleep before retrying a failed call, or None if it should not be retried."""
+        status_code = getattr(error, 'status_code', None)
+        retryable = (status_code in self.RETRYABLE_STATUS_CODES or
+                     isinstance(error, anthropic.APIConnectionError))
+        if not retryable or attempt >= self.max_retries:
+            return None
+
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+
+        with self.condition:
+            self.stats['retries'] += 1
+            if status_code in (429, 529):
+                # Back off multiplicatively and hold every caller until the server's window reopens
+                self.stats['throttled'] += 1
+                self.concurrency_limit = max(1, self.concurrency_limit // 2)
+                self.successes = 0
+                self.paused_until = max(self.paused_until, self.clock() + delay)
+        if DEBUG:
+            print(f"Retrying LLM call in {delay:.1f}s after error: {str(error)}")
+        return delay
+
+    def call(self, func: Callable[[], Any], tokens: int) -> Any:
+        """Run func under the rate limits, retrying retryable failures."""
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                result = func()
+            except Exception as e:
+                self.release(success=False)
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                self.sleep(delay)
+                attempt += 1
+                continue
+            self.release(success=True)
+            return result
+
+    async def call_async(self, func: Callable[[], Any], tokens: int) -> Any:
+        """Await func() under the rate limits, retrying retryable failures."""
+        attempt = 0
+        while True:
+            await self.acquire_async(tokens)
+            try:
+                result = await func()
+            except Exception as e:
+                self.release(success=False)
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.release(success=True)
+            return result
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.condition:
+            metrics = dict(self.stats)
+            metrics.update({
+                'queue_depth': self.queue_depth,
+                'in_flight': self.in_flight,
+                'concurrency_limit': self.concurrency_limit,
+                'requests_per_minute': self.request_bucket.rate_per_minute,
+                'tokens_per_minute': self.token_bucket.rate_per_minute,
+                'avg_wait': metrics['total_wait'] / metrics['calls'] if metrics['calls'] else 0.0
+            })
+        return metrics
+
+LLM_SCHEDULER = RateLimitScheduler()
+
 class AnthropicProvider(LLMProvider):
     """
     The AnthropicProvider class implements the LLMProvider interface for Anthropic's API.
     It handles prompt transformation and communication with the Anthropic language model.
     """
 
-    def __init__(self, model: str = "claude-3-5-sonnet-20240620"):
+    # Anthropic prompt caching allows at most four cache_control breakpoints per request
+    MAX_CACHE_BREAKPOINTS = 4
+
+    def __init__(self, model: str = "claude-3-5-sonnet-20240620", max_tokens: int = 4096,
+                 temperature: float = 0.0, cache: ResponseCache = None,
+                 scheduler: RateLimitScheduler = LLM_SCHEDULER, base_url: str = None,
+                 auto_cache: bool = True, min_cache_tokens: int = 1024):
         super().__init__()
-        self.client = anthropic.Anthropic()
+        # Retries are handled by the scheduler when one is configured
+        self.client = anthropic.Anthropic(base_url=base_url, max_retries=0 if scheduler else 2)
+        self.base_url = base_url
         self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.cache = cache
+        self.scheduler = scheduler
+        self.init_prompt_caching(auto_cache, min_cache_tokens)
+
+    def init_prompt_caching(self, auto_cache: bool, min_cache_tokens: int):
+        self.auto_cache = auto_cache
+        self.min_cache_tokens = min_cache_tokens
+        # Hashes of block prefixes sent so far, used to find prefixes that repeat across rows
+        self.seen_prefixes = OrderedDict()
+        self.prefix_lock = threading.Lock()
+        self.usage = {
+            'input_tokens': 0, 'output_tokens': 0,
+            'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0
+        }
 
     def extract_system_message(self, messages: List[Dict[str, Any]]) -> tuple:
         """Separate system messages from other messages."""
@@ -52,34 +427,105 @@ class AnthropicProvider(LLMProvider):
         other_messages = []
 
         for message in messages:
-            if message['role'] == 'system':
-                system_messages.append(message['content'])
+            if message.get('role') == 'system':
+                system_messages.append(message)
             else:
                 other_messages.append(message)
 
-        system_message = ' '.join(system_messages)
-        return system_message, other_messages
+        return system_messages, other_messages
+
+    @staticmethod
+    def _text_block(message: Dict[str, Any]) -> Dict[str, Any]:
+        block = {"type": "text", "text": message["content"]}
+        if message.get("cache"):
+            block["cache_control"] = {"type": "ephemeral"}
+        return block
+
+    def place_cache_breakpoint(self, blocks: List[tuple]):
+        """
+        Mark the longest prefix of blocks that was already sent in an earlier request.
+        blocks is a list of (role, text block) pairs in request order: system blocks first.
+        """
+        prefix_hashes = []
+        prefix_hash = hashlib.sha256(self.model.encode('utf-8'))
+        for role, block in blocks:
+            prefix_hash.update(json.dumps([role, block['text']]).encode('utf-8'))
+            prefix_hashes.append(prefix_hash.hexdigest())
+
+        with self.prefix_lock:
+            stable = -1
+            for i in range(len(prefix_hashes) - 1, -1, -1):
+                if prefix_hashes[i] in self.seen_prefixes:
+                    stable = i
+                    break
+            for h in prefix_hashes:
+                self.seen_prefixes[h] = True
+                self.seen_prefixes.move_to_end(h)
+            while len(self.seen_prefixes) > 10000:
+                self.seen_prefixes.popitem(last=False)
+
+        if stable < 0:
+            return
+        marked = [i for i, (_, block) in enumerate(blocks) if 'cache_control' in block]
+        if len(marked) >= self.MAX_CACHE_BREAKPOINTS or (marked and marked[-1] >= stable):
+            return
+        prefix_chars = sum(len(block['text']) for _, block in blocks[:stable + 1])
+        if prefix_chars // 4 < self.min_cache_tokens:
+            return
+        blocks[stable][1]["cache_control"] = {"type": "ephemeral"}
 
     def convert_to_messages(self, prompt_dicts: List[Dict[str, Any]]) -> tuple:
-        """Convert prompt dictionaries to message format."""
-        system_message, other_messages = self.extract_system_message(prompt_dicts)
+        """
+        Convert prompt dictionaries to message format.
+        Messages with `cache: true` in the prompt template get a cache_control breakpoint, and with
+        auto_cache a breakpoint is also placed on the longest prefix repeated from earlier requests.
+        """
+        system_messages, other_messages = self.extract_system_message(prompt_dicts)
+        system_blocks = [self._text_block(msg) for msg in system_messages]
+        message_blocks = [(msg.get("role", "user"), self._text_block(msg)) for msg in other_messages]
+
+        blocks = [('system', block) for block in system_blocks] + message_blocks
+        marked = [block for _, block in blocks if 'cache_control' in block]
+        # Keep the breakpoints on the longest prefixes if a template marks too many
+        for block in marked[:-self.MAX_CACHE_BREAKPOINTS]:
+            del block['cache_control']
+        if self.auto_cache:
+            self.place_cache_breakpoint(blocks)
+
+        # Without breakpoints, send plain strings exactly as before
+        if any('cache_control' in block for block in system_blocks):
+            system_message = system_blocks
+        else:
+            system_message = ' '.join(block['text'] for block in system_blocks)
         converted_messages = [
             {
-                "role": msg.get("role", "user"),
-                "content": msg["content"]
+                "role": role,
+                "content": [block] if 'cache_control' in block else block['text']
             }
-            for msg in other_messages
+            for role, block in message_blocks
         ]
         return converted_messages, system_message
 
-    def generate(self, messages_and_system: tuple) -> Any:
-        """Generate a response from the LLM based on the messages."""
+    def record_usage(self, response: Any):
+        """Accumulate token usage, including prompt-cache reads and writes."""
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        with self.prefix_lock:
+            for key in self.usage:
+                self.usage[key] += getattr(usage, key, None) or 0
+        if DEBUG:
+            print(f"Cache write tokens: {getattr(usage, 'cache_creation_input_tokens', None) or 0}, "
+                  f"cache read tokens: {getattr(usage, 'cache_read_input_tokens', None) or 0}")
+
+    def build_request_args(self, messages_and_system: tuple) -> Dict[str, Any]:
+        """Build the messages.create arguments for the converted messages."""
         converted_messages, system_message = messages_and_system
         request_args = {
             "model": self.model,
             "messages": converted_messages,
-            "max_tokens": 4096,
-            "temperature": 0.0
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature
         }
 
         if system_message:
@@ -87,16 +533,338 @@ class AnthropicProvider(LLMProvider):
         if DEBUG:
             print("Message Chain:")
             print(json.dumps(converted_messages, indent=2))
-        response = self.client.messages.create(**request_args)
+        return request_args
+
+    def get_cached_response(self, request_args: Dict[str, Any]) -> Any:
+        """Return the cached response for request_args, or None."""
+        if self.cache is None:
+            return None
+        cached = self.cache.get(self.cache.make_key(request_args))
+        if cached is None:
+            return None
+        if DEBUG:
+            print("Response (cached):")
+            print(cached)
+        return anthropic.types.Message.model_validate_json(cached)
+
+    def store_response(self, request_args: Dict[str, Any], response: Any):
         if DEBUG:
             print("Response:")
             print(response)
+        self.record_usage(response)
+        if self.cache is not None:
+            self.cache.put(self.cache.make_key(request_args), response.model_dump_json())
+
+    @staticmethod
+    def record_metrics(response: Any, start: float, started: float = None, cached: bool = False):
+        """
+        Record a finished call in METRICS. start is when the call was requested and started when the
+        successful attempt began, so the difference is time spent queued, backing off and retrying.
+        """
+        METRICS.record_llm_call(
+            wall_time=time.monotonic() - start,
+            queue_wait=(started or start) - start,
+            # Cached responses did not use any tokens
+            usage=None if cached or response is None else getattr(response, 'usage', None),
+            stop_reason=getattr(response, 'stop_reason', None) if response is not None else 'stopped_early',
+            cached=cached
+        )
+
+    def generate(self, messages_and_system: tuple) -> Any:
+        """Generate a response from the LLM based on the messages."""
+        request_args = self.build_request_args(messages_and_system)
+        start = time.monotonic()
+        response = self.get_cached_response(request_args)
+        if response is not None:
+            self.record_metrics(response, start, cached=True)
+            return response
+
+        timing = {}
+        if self.scheduler is None:
+            with TRACER.span('http.anthropic.messages', model=request_args['model']):
+                response = self.client.messages.create(**request_args)
+        else:
+            response = self.scheduler.call(
+                lambda: self._create_with_headers(request_args, timing),
+                self.scheduler.estimate_tokens(request_args)
+            )
+        self.store_response(request_args, response)
+        self.record_metrics(response, start, timing.get('started'))
         return response
 
+    def _create_with_headers(self, request_args: Dict[str, Any], timing: Dict[str, float] = None) -> Any:
+        if timing is not None:
+            timing['started'] = time.monotonic()
+        with TRACER.span('http.anthropic.messages', model=request_args['model']):
+            raw_response = self.client.messages.with_raw_response.create(**request_args)
+        self.scheduler.update_from_headers(raw_response.headers)
+        return raw_response.parse()
+
+    def stream(self, messages_and_system: tuple, on_text: Callable[[str], None] = None,
+               stop_when: Callable[[str], bool] = None) -> str:
+        """
+        Stream a response, passing each text delta to on_text.
+        Generation is cancelled as soon as stop_when returns True for the text so far.
+        """
+        request_args = self.build_request_args(messages_and_system)
+        start = time.monotonic()
+        response = self.get_cached_response(request_args)
+        if response is not None:
+            self.record_metrics(response, start, cached=True)
+            text = self.parse_response(response)
+            if on_text is not None:
+                on_text(text)
+            return text
+
+        if self.scheduler is None:
+            return self._stream(request_args, on_text, stop_when, start)
+        return self.scheduler.call(
+            lambda: self._stream(request_args, on_text, stop_when, start),
+            self.scheduler.estimate_tokens(request_args)
+        )
+
+    def _stream(self, request_args: Dict[str, Any], on_text: Callable[[str], None],
+                stop_when: Callable[[str], bool], start: float) -> str:
+        started = time.monotonic()
+        text = ''
+        try:
+            with TRACER.span('http.anthropic.messages.stream', model=request_args['model']), \
+                    self.client.messages.stream(**request_args) as stream:
+                for delta in stream.text_stream:
+                    text += delta
+                    if on_text is not None:
+                        on_text(delta)
+                    if stop_when is not None and stop_when(text):
+                        if DEBUG:
+                            print("Stream stopped early")
+                        # Leaving the context manager closes the connection; partial output is not cached
+                        self.record_metrics(None, start, started)
+                        return text
+                response = stream.get_final_message()
+        except Exception as e:
+            if text:
+                # Deltas were already delivered, so the call must not be retried from scratch
+                raise RuntimeError(f"Stream interrupted after partial output: {str(e)}") from e
+            raise
+        self.store_response(request_args, response)
+        self.record_metrics(response, start, started)
+        return text
+
     def parse_response(self, response: Any) -> str:
         """Extract text from the LLM response."""
         return response.content[0].text
 
+    def submit_batch(self, requests: Dict[str, Dict[str, Any]]) -> str:
+        """Submit messages.create arguments keyed by custom_id as one Message Batch and return its ID."""
+        batch = self.client.messages.batches.create(requests=[
+            {'custom_id': custom_id, 'params': request_args}
+            for custom_id, request_args in requests.items()
+        ])
+        if DEBUG:
+            print(f"Submitted batch {batch.id} with {len(requests)} requests")
+        return batch.id
+
+    def wait_for_batch(self, batch_id: str, poll_interval: float = 30.0) -> Any:
+        """Poll a Message Batch until processing has ended."""
+        while True:
+            batch = self.client.messages.batches.retrieve(batch_id)
+            if batch.processing_status == 'ended':
+                return batch
+            if DEBUG:
+                print(f"Batch {batch_id}: {batch.request_counts}")
+            time.sleep(poll_interval)
+
+    def batch_results(self, batch_id: str) -> Dict[str, tuple]:
+        """Map each custom_id to (text, None) on success or (None, error message) otherwise."""
+        results = {}
+        for entry in self.client.messages.batches.results(batch_id):
+            if entry.result.type == 'succeeded':
+                self.record_usage(entry.result.message)
+                results[entry.custom_id] = (self.parse_response(entry.result.message), None)
+            elif entry.result.type == 'errored':
+                results[entry.custom_id] = (None, str(entry.result.error))
+            else:
+                results[entry.custom_id] = (None, f"Batch request {entry.result.type}")
+        return results
+
+class AsyncAnthropicProvider(AnthropicProvider):
+    """
+    The AsyncAnthropicProvider class is the asyncio counterpart of AnthropicProvider.
+    Instances share one AsyncAnthropic client per base URL and event loop, so requests reuse a pooled set
+    of connections without carrying them over to a later asyncio.run.
+    """
+
+    # {(base_url, event loop): AsyncAnthropic}
+    shared_clients = {}
+    shared_clients_lock = threading.Lock()
+
+    def __init__(self, model: str = "claude-3-5-sonnet-20240620", max_tokens: int = 4096,
+                 temperature: float = 0.0, cache: ResponseCache = None, client: Any = None,
+                 scheduler: RateLimitScheduler = LLM_SCHEDULER, base_url: str = None,
+                 auto_cache: bool = True, min_cache_tokens: int = 1024):
+        LLMProvider.__init__(self)
+        # Without an injected client, the shared one is looked up on each call for the running loop
+        self.injected_client = client
+        self.base_url = base_url
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.cache = cache
+        self.scheduler = scheduler
+        self.init_prompt_caching(auto_cache, min_cache_tokens)
+
+    @classmethod
+    def from_provider(cls, provider: LLMProvider, client: Any = None) -> 'AsyncAnthropicProvider':
+        """An async provider with the same model, sampling, cache, scheduler and endpoint as provider."""
+        # getattr defaults keep this working for providers that are not AnthropicProviders, e.g. fakes
+        return cls(
+            model=getattr(provider, 'model', "claude-3-5-sonnet-20240620"),
+            max_tokens=getattr(provider, 'max_tokens', 4096),
+            temperature=getattr(provider, 'temperature', 0.0),
+            cache=getattr(provider, 'cache', None),
+            client=client,
+            scheduler=getattr(provider, 'scheduler', LLM_SCHEDULER),
+            base_url=getattr(provider, 'base_url', None),
+            auto_cache=getattr(provider, 'auto_cache', True),
+            min_cache_tokens=getattr(provider, 'min_cache_tokens', 1024)
+        )
+
+    @property
+    def client(self) -> Any:
+        if self.injected_client is not None:
+            return self.injected_client
+        return self.get_shared_client(self.base_url)
+
+    @classmethod
+    def get_shared_client(cls, base_url: str = None, max_connections: int = 500,
+                          max_keepalive_connections: int = 100) -> Any:
+        """Return the client for base_url on the running event loop, creating it on first use."""
+        loop = asyncio.get_running_loop()
+        with cls.shared_clients_lock:
+            # Connections of a finished loop cannot be reused or closed, so its clients are dropped
+            for key in [key for key in cls.shared_clients if key[1].is_closed()]:
+                del cls.shared_clients[key]
+            client = cls.shared_clients.get((base_url, loop))
+            if client is None:
+                http_client = anthropic.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=max_connections,
+                        max_keepalive_connections=max_keepalive_connections,
+                        keepalive_expiry=30.0
+                    ),
+                    timeout=httpx.Timeout(600.0, connect=10.0)
+                )
+                # Retries are left to the scheduler
+                client = anthropic.AsyncAnthropic(base_url=base_url, http_client=http_client, max_retries=0)
+                cls.shared_clients[(base_url, loop)] = client
+            return client
+
+    @classmethod
+    async def close_shared_clients(cls):
+        """Close the clients created on the running event loop, e.g. at the end of a run."""
+        loop = asyncio.get_running_loop()
+        with cls.shared_clients_lock:
+            keys = [key for key in cls.shared_clients if key[1] is loop]
+            clients = [cls.shared_clients.pop(key) for key in keys]
+        for client in clients:
+            await client.close()
+
+    async def generate(self, messages_and_system: tuple) -> Any:
+        """Generate a response from the LLM without blocking the event loop."""
+        request_args = self.build_request_args(messages_and_system)
+        start = time.monotonic()
+        response = self.get_cached_response(request_args)
+        if response is not None:
+            self.record_metrics(response, start, cached=True)
+            return response
+
+        timing = {}
+        if self.scheduler is None:
+            with TRACER.span('http.anthropic.messages', model=request_args['model']):
+                response = await self.client.messages.create(**request_args)
+        else:
+            response = await self.scheduler.call_async(
+                lambda: self._create_with_headers(request_args, timing),
+                self.scheduler.estimate_tokens(request_args)
+            )
+        self.store_response(request_args, response)
+        self.record_metrics(response, start, timing.get('started'))
+        return response
+
+    async def _create_with_headers(self, request_args: Dict[str, Any], timing: Dict[str, float] = None) -> Any:
+        if timing is not None:
+            timing['started'] = time.monotonic()
+        with TRACER.span('http.anthropic.messages', model=request_args['model']):
+            raw_response = await self.client.messages.with_raw_response.create(**request_args)
+        self.scheduler.update_from_headers(raw_response.headers)
+        return raw_response.parse()
+
+    async def stream_text(self, prompt_dicts: List[Dict[str, Any]],
+                          stop_when: Callable[[str], bool] = None) -> AsyncIterator[str]:
+        """Yield text deltas as they arrive, cancelling once stop_when returns True for the text so far."""
+        request_args = self.build_request_args(self.convert_to_messages(prompt_dicts))
+        start = time.monotonic()
+        response = self.get_cached_response(request_args)
+        if response is not None:
+            self.record_metrics(response, start, cached=True)
+            yield self.parse_response(response)
+            return
+
+        tokens = self.scheduler.estimate_tokens(request_args) if self.scheduler else 0
+        attempt = 0
+        text = ''
+        while True:
+            if self.scheduler is not None:
+                await self.scheduler.acquire_async(tokens)
+            started = time.monotonic()
+            # Not made current: the consumer's own work runs between yields
+            span = TRACER.start_span('http.anthropic.messages.stream', model=request_args['model'])
+            error = None
+            try:
+                async with self.client.messages.stream(**request_args) as stream:
+                    async for delta in stream.text_stream:
+                        text += delta
+                        yield delta
+                        if stop_when is not None and stop_when(text):
+                            if DEBUG:
+                                print("Stream stopped early")
+                            self.record_metrics(None, start, started)
+                            break
+                    else:
+                        response = await stream.get_final_message()
+                        self.store_response(request_args, response)
+                        self.record_metrics(response, start, started)
+            except Exception as e:
+                error = e
+            finally:
+                # Also runs if the consumer abandons the iterator
+                TRACER.end_span(span, error)
+                if self.scheduler is not None:
+                    self.scheduler.release(success=error is None)
+            if error is None:
+                return
+
+            # Only retry if nothing has been yielded yet
+            delay = self.scheduler.retry_delay(error, attempt) if self.scheduler and not text else None
+            if delay is None:
+                raise error
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def process_prompt(self, prompt_dicts: List[Dict[str, Any]], on_text: Callable[[str], None] = None,
+                             stop_when: Callable[[str], bool] = None) -> str:
+        if on_text is None and stop_when is None:
+            messages_and_system = self.convert_to_messages(prompt_dicts)
+            response = await self.generate(messages_and_system)
+            return self.parse_response(response)
+
+        text = ''
+        async for delta in self.stream_text(prompt_dicts, stop_when):
+            text += delta
+            if on_text is not None:
+                on_text(delta)
+        return text
+
 # if __name__ == "__main__":
 #     provider = AnthropicProvider()
 #     prompt_dicts = [
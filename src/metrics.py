@@ -0,0 +1,271 @@
+%%capture
+# @title Metrics
+
+# metrics.py: Module to record latency and token usage of LLM calls and chain steps, and export them.
+
+from typing import Dict, Any, List, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import contextvars
+import threading
+import json
+import time
+import os
+
+# Name of the chain and step being executed, visible to step functions, stream callbacks and metrics
+CURRENT_CHAIN = contextvars.ContextVar('current_chain', default=None)
+CURRENT_STEP = contextvars.ContextVar('current_step', default=None)
+
+class MetricsRecorder:
+    """
+    The MetricsRecorder class collects one record per LLM call and per chain step.
+    Records are aggregated into per-run, per-chain and per-step percentiles and exported as JSON
+    or as Prometheus text exposition, written to a file or served on localhost.
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+    TOKEN_TYPES = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')
+
+    def __init__(self, max_records: int = 100000):
+        self.max_records = max_records
+        self.lock = threading.Lock()
+        self.server = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.llm_calls = []
+            self.steps = []
+            self.started = time.time()
+
+    def _append(self, records: List[Dict[str, Any]], record: Dict[str, Any]):
+        with self.lock:
+            records.append(record)
+            # Keep memory bounded on very long runs; the oldest records are dropped first
+            if len(records) > self.max_records:
+                del records[:len(records) - self.max_records]
+
+    def record_llm_call(self, wall_time: float, queue_wait: float = 0.0, usage: Any = None,
+                        stop_reason: str = None, cached: bool = False):
+        """Record one LLM call; chain and step are taken from the caller's context."""
+        record = {
+            'chain': CURRENT_CHAIN.get(),
+            'step': CURRENT_STEP.get(),
+            'wall_time': wall_time,
+            'queue_wait': queue_wait,
+            'stop_reason': stop_reason,
+            'cached': cached
+        }
+        for key in self.TOKEN_TYPES:
+            record[key] = (getattr(usage, key, None) or 0) if usage is not None else 0
+        self._append(self.llm_calls, record)
+
+    def record_step(self, step_name: str, wall_time: float, error: str = None):
+        self._append(self.steps, {
+            'chain': CURRENT_CHAIN.get(),
+            'step': step_name,
+            'wall_time': wall_time,
+            'error': error
+        })
+
+    @staticmethod
+    def percentile(values: List[float], q: float) -> float:
+        """Linearly interpolated percentile of values, q in [0, 1]."""
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        position = (len(ordered) - 1) * q
+        lower = int(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+    @classmethod
+    def distribution(cls, values: List[float]) -> Dict[str, float]:
+        summary = {'count': len(values), 'sum': sum(values), 'max': max(values) if values else 0.0}
+        for q in cls.QUANTILES:
+            summary[f"p{int(q * 100)}"] = cls.percentile(values, q)
+        return summary
+
+    def _summarize_calls(self, calls: List[Dict[str, Any]]) -> Dict[str, Any]:
+        stop_reasons = {}
+        for call in calls:
+            reason = call['stop_reason'] or 'unknown'
+            stop_reasons[reason] = stop_reasons.get(reason, 0) + 1
+        summary = {
+            'calls': len(calls),
+            'cached_calls': sum(1 for call in calls if call['cached']),
+            'wall_time': self.distribution([call['wall_time'] for call in calls]),
+            'queue_wait': self.distribution([call['queue_wait'] for call in calls]),
+            'stop_reasons': stop_reasons
+        }
+        for key in self.TOKEN_TYPES:
+            summary[key] = sum(call[key] for call in calls)
+        return summary
+
+    def summary(self) -> Dict[str, Any]:
+        """Aggregate the records for the whole run, for each chain, and for each step of each chain."""
+        with self.lock:
+            calls = list(self.llm_calls)
+            steps = list(self.steps)
+
+        chain_names = sorted({record['chain'] or 'none' for record in calls + steps})
+        chains = {}
+        for chain in chain_names:
+            chain_calls = [call for call in calls if (call['chain'] or 'none') == chain]
+            chain_steps = [step for step in steps if (step['chain'] or 'none') == chain]
+            step_names = sorted({record['step'] or 'none' for record in chain_calls + chain_steps})
+            chains[chain] = {
+                'llm': self._summarize_calls(chain_calls),
+                'steps': {
+                    name: {
+                        'wall_time': self.distribution([step['wall_time'] for step in chain_steps
+                                                        if step['step'] == name]),
+                        'errors': sum(1 for step in chain_steps if step['step'] == name and step['error']),
+                        'llm': self._summarize_calls([call for call in chain_calls
+                                                      if (call['step'] or 'none') == name])
+                    }
+                    for name in step_names
+                }
+            }
+        return {
+            'started': self.started,
+            'elapsed': time.time() - self.started,
+            'run': {
+                'llm': self._summarize_calls(calls),
+                'step_wall_time': self.distribution([step['wall_time'] for step in steps])
+            },
+            'chains': chains
+        }
+
+    def to_json(self, path: str = None) -> str:
+        text = json.dumps(self.summary(), indent=2)
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    @staticmethod
+    def _labels(**labels: str) -> str:
+        escaped = []
+        for key, value in labels.items():
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{key}="{value}"')
+        return '{' + ','.join(escaped) + '}'
+
+    def _prometheus_summary(self, lines: List[str], name: str, help_text: str,
+                            series: List[tuple]):
+        """Append one summary metric; series is a list of (labels dict, distribution)."""
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} summary")
+        for labels, distribution in series:
+            for q in self.QUANTILES:
+                value = distribution[f"p{int(q * 100)}"]
+                lines.append(f"{name}{self._labels(**labels, quantile=q)} {value}")
+            lines.append(f"{name}_sum{self._labels(**labels)} {distribution['sum']}")
+            lines.append(f"{name}_count{self._labels(**labels)} {distribution['count']}")
+
+    def to_prometheus(self) -> str:
+        """Render the current summary in the Prometheus text exposition format."""
+        summary = self.summary()
+        chains = summary['chains']
+        lines = []
+        self._prometheus_summary(
+            lines, 'colab_agent_llm_call_seconds', 'Wall time of LLM calls, including queue wait.',
+            [({'chain': chain}, data['llm']['wall_time']) for chain, data in chains.items()])
+        self._prometheus_summary(
+            lines, 'colab_agent_llm_queue_wait_seconds', 'Time LLM calls waited for the rate limiter.',
+            [({'chain': chain}, data['llm']['queue_wait']) for chain, data in chains.items()])
+        self._prometheus_summary(
+            lines, 'colab_agent_step_seconds', 'Wall time of chain steps.',
+            [({'chain': chain, 'step': step}, step_data['wall_time'])
+             for chain, data in chains.items() for step, step_data in data['steps'].items()
+             if step_data['wall_time']['count']])
+
+        lines.append("# HELP colab_agent_llm_tokens_total Tokens used by LLM calls.")
+        lines.append("# TYPE colab_agent_llm_tokens_total counter")
+        for chain, data in chains.items():
+            for key in self.TOKEN_TYPES:
+                lines.append(f"colab_agent_llm_tokens_total{self._labels(chain=chain, type=key)} {data['llm'][key]}")
+
+        lines.append("# HELP colab_agent_llm_calls_total LLM calls by stop reason.")
+        lines.append("# TYPE colab_agent_llm_calls_total counter")
+        for chain, data in chains.items():
+            for reason, count in data['llm']['stop_reasons'].items():
+                lines.append(f"colab_agent_llm_calls_total{self._labels(chain=chain, stop_reason=reason)} {count}")
+
+        lines.append("# HELP colab_agent_step_errors_total Chain steps that raised an error.")
+        lines.append("# TYPE colab_agent_step_errors_total counter")
+        for chain, data in chains.items():
+            for step, step_data in data['steps'].items():
+                lines.append(f"colab_agent_step_errors_total{self._labels(chain=chain, step=step)} {step_data['errors']}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus())
+
+    def serve(self, port: int = 9464, host: str = "127.0.0.1"):
+        """Serve /metrics (Prometheus) and /metrics.json on localhost from a background thread."""
+        if self.server is not None:
+            return self.server
+        recorder = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/metrics.json'):
+                    body, content_type = recorder.to_json(), 'application/json'
+                elif self.path.startswith('/metrics'):
+                    body, content_type = recorder.to_prometheus(), 'text/plain; version=0.0.4'
+                else:
+                    self.send_error(404)
+                    return
+                encoded = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{host}:{self.server.server_port}/metrics")
+        return self.server
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def print_summary(self):
+        """Print a table of step and LLM call latency and token usage for each chain."""
+        summary = self.summary()
+        header = (f"{'chain / step':<40} {'count':>6} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} "
+                  f"{'wait p95':>8} {'in tok':>9} {'out tok':>9} {'cache rd':>9}")
+        print(header)
+        print('-' * len(header))
+        for chain, data in summary['chains'].items():
+            rows = [(chain, data['llm']['wall_time'], data['llm'])]
+            rows += [(f"  {step}", step_data['wall_time'], step_data['llm'])
+                     for step, step_data in data['steps'].items()]
+            for label, wall_time, llm in rows:
+                print(f"{label[:40]:<40} {wall_time['count']:>6} {wall_time['p50']:>8.2f} "
+                      f"{wall_time['p95']:>8.2f} {wall_time['p99']:>8.2f} {llm['queue_wait']['p95']:>8.2f} "
+                      f"{llm['input_tokens']:>9} {llm['output_tokens']:>9} {llm['cache_read_input_tokens']:>9}")
+        run = summary['run']['llm']
+        print('-' * len(header))
+        print(f"{run['calls']} LLM calls ({run['cached_calls']} from the response cache) in "
+              f"{summary['elapsed']:.1f}s: p50 {run['wall_time']['p50']:.2f}s, p95 {run['wall_time']['p95']:.2f}s, "
+              f"p99 {run['wall_time']['p99']:.2f}s; stop reasons {run['stop_reasons']}")
+
+METRICS = MetricsRecorder()
+
+# if __name__ == "__main__":
+#     METRICS.record_llm_call(1.2, 0.1, stop_reason="end_turn")
+#     METRICS.record_step("initial_analysis", 1.5)
+#     METRICS.print_summary()
+#     print(METRICS.to_prometheus())
@@ -0,0 +1,245 @@
+%%capture
+# @title Output Sinks
+
+# output_sinks.py: Module to write finished workbench rows to the output sheet, JSONL or Parquet files.
+
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List
+import datetime
+import json
+import time
+import os
+
+class OutputSink(ABC):
+    """
+    The OutputSink class is the abstract base class for destinations of finished workbench rows.
+    Each row is a record with index, chain_url, chain_input, chain_output, error, the chain's final
+    context (None when unavailable, e.g. for resumed rows) and finished_at.
+    """
+
+    def open(self):
+        """Prepare the destination at the start of a run."""
+        pass
+
+    @abstractmethod
+    def write_row(self, record: Dict[str, Any]):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def to_text(value: Any) -> str:
+        """Strings as they are, anything else as JSON."""
+        if value is None or isinstance(value, str):
+            return value
+        return json.dumps(value, default=str)
+
+class BufferedFileSink(OutputSink):
+    """
+    The BufferedFileSink class buffers records in memory and writes them out when flush_rows records
+    are waiting or flush_interval seconds have passed since the last write.
+    """
+
+    def __init__(self, path: str, flush_rows: int, flush_interval: float):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def write_row(self, record: Dict[str, Any]):
+        self.buffer.append(record)
+        if (len(self.buffer) >= self.flush_rows or
+                time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.write_records(self.buffer)
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+    @abstractmethod
+    def write_records(self, records: List[Dict[str, Any]]):
+        pass
+
+class JSONLSink(BufferedFileSink):
+    """
+    The JSONLSink class appends one JSON object per row to a local file, with the full context.
+    The file is truncated when a run opens it unless append is set.
+    """
+
+    def __init__(self, path: str, append: bool = False, flush_rows: int = 100, flush_interval: float = 5.0):
+        super().__init__(path, flush_rows, flush_interval)
+        self.append = append
+        self.file = None
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'a' if self.append else 'w', encoding='utf-8')
+
+    def write_records(self, records: List[Dict[str, Any]]):
+        self.file.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class ParquetSink(BufferedFileSink):
+    """
+    The ParquetSink class writes rows to a Parquet file, one row group per row_group_size rows or
+    flush_interval seconds. Outputs and context that are not strings are stored as JSON text.
+    It needs the optional pyarrow package and raises ImportError without it.
+    """
+
+    def __init__(self, path: str, row_group_size: int = 1000, flush_interval: float = 60.0):
+        super().__init__(path, row_group_size, flush_interval)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("ParquetSink requires pyarrow: pip install pyarrow") from e
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.schema = pyarrow.schema([
+            ('index', pyarrow.int64()),
+            ('chain_url', pyarrow.string()),
+            ('chain_input', pyarrow.string()),
+            ('chain_output', pyarrow.string()),
+            ('error', pyarrow.string()),
+            ('context', pyarrow.string()),
+            ('finished_at', pyarrow.string())
+        ])
+        self.writer = None
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.writer = self.pq.ParquetWriter(self.path, self.schema)
+
+    def write_records(self, records: List[Dict[str, Any]]):
+        columns = {
+            'index': [record['index'] for record in records],
+            'chain_url': [record['chain_url'] for record in records],
+            'chain_input': [self.to_text(record['chain_input']) for record in records],
+            'chain_output': [self.to_text(record['chain_output']) for record in records],
+            'error': [record['error'] for record in records],
+            'context': [self.to_text(record['context']) for record in records],
+            'finished_at': [record['finished_at'] for record in records]
+        }
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        super().close()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+class SheetSink(OutputSink):
+    """
+    The SheetSink class writes chain_url, chain_input and chain_output to a sheet tab in batches.
+    Cells longer than the Sheets limit of 50,000 characters are truncated with a marker; the full
+    values belong in a file sink.
+    """
+    MAX_CELL_CHARS = 50000
+    TRUNCATED = '... [truncated]'
+
+    def __init__(self, sheet: GoogleSheet, tab_name: str = 'output', batch_size: int = 50,
+                 flush_interval: float = 10.0):
+        self.sheet = sheet
+        self.tab_name = tab_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.writer = None
+
+    def open(self):
+        # Clear results from previous runs; rows are then written from A1 down in batches
+        self.sheet.clear_values(f"{self.tab_name}!A:C")
+        self.writer = BufferedSheetWriter(self.sheet, self.tab_name, batch_size=self.batch_size,
+                                          flush_interval=self.flush_interval)
+        self.writer.write_row(['chain_url', 'chain_input', 'chain_output'])
+
+    def cell(self, value: Any) -> str:
+        text = str(value)
+        if len(text) > self.MAX_CELL_CHARS:
+            return text[:self.MAX_CELL_CHARS - len(self.TRUNCATED)] + self.TRUNCATED
+        return text
+
+    def write_row(self, record: Dict[str, Any]):
+        self.writer.write_row([self.cell(record['chain_url']), self.cell(record['chain_input']),
+                               self.cell(record['chain_output'])])
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+class SinkGroup(OutputSink):
+    """The SinkGroup class sends every row to several sinks, e.g. a local file and the output sheet."""
+
+    def __init__(self, sinks: List[OutputSink]):
+        self.sinks = list(sinks)
+
+    def open(self):
+        for sink in self.sinks:
+            sink.open()
+
+    def write_row(self, record: Dict[str, Any]):
+        for sink in self.sinks:
+            sink.write_row(record)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        errors = []
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+def make_record(index: Any, chain_url: str, chain_input: Any, chain_output: Any,
+                context: Dict[str, Any] = None, error: str = None) -> Dict[str, Any]:
+    """Build the record a sink receives for one finished row; index is the 0-based input row as an int."""
+    return {
+        # Batch runs keep row indexes as strings in their JSON state
+        'index': int(index),
+        'chain_url': chain_url,
+        'chain_input': chain_input,
+        'chain_output': chain_output,
+        'error': error,
+        'context': context,
+        'finished_at': datetime.datetime.now(datetime.timezone.utc).isoformat()
+    }
+
+def sink_for_path(path: str) -> OutputSink:
+    """Return a JSONLSink or ParquetSink depending on the file extension."""
+    if path.endswith('.parquet'):
+        return ParquetSink(path)
+    if path.endswith(('.jsonl', '.json')):
+        return JSONLSink(path)
+    raise ValueError(f"Unsupported output file type: {path} (use .jsonl or .parquet)")
+
+# if __name__ == "__main__":
+#     with SinkGroup([JSONLSink("runs/output.jsonl"), ParquetSink("runs/output.parquet")]) as sink:
+#         sink.write_row(make_record(0, "example_chain.yaml", "hello", "world", context={"chain_input": "hello"}))
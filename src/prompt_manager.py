@@ -1,51 +1,142 @@
 %%capture
 # @title Prompt Manager
 
-# prompt_manager.py: Module to manage loading and composing prompt templates from Google Docs.
+# prompt_manager.py: Module to manage loading and composing prompt templates from Google Docs or local files.
 
 from typing import List, Dict, Any
-from jinja2 import Environment, BaseLoader
+from collections import OrderedDict
+from jinja2 import Environment, TemplateError, meta
+import threading
+import hashlib
+import copy
 import yaml
 import json
 
 class PromptManager:
     """
-    The PromptManager class handles loading and rendering prompt templates from Google Docs.
-    It uses Jinja2 templates to render prompts with provided context variables.
+    The PromptManager class handles loading and rendering prompt templates from Google Docs or local files.
+    It uses Jinja2 templates to render prompts with provided context variables; {% include %} resolves
+    names through the same template sources and edited local files are reloaded by modification time.
+    Compiled templates and rendered message lists are kept in bounded LRU caches.
     """
 
-    def __init__(self):
-        self.env = Environment(loader=BaseLoader())
-        self.prompt_cache = {}
+    def __init__(self, template_cache_size: int = 64, render_cache_size: int = 256,
+                 sources: TemplateSources = None):
+        self.sources = sources if sources is not None else TemplateSources.default()
+        self.env = Environment(loader=self.sources.jinja_loader(), auto_reload=True)
+        self.template_cache_size = template_cache_size
+        self.render_cache_size = render_cache_size
+        self.template_cache = OrderedDict()
+        self.render_cache = OrderedDict()
+        self.lock = threading.Lock()
 
     def load_prompt_from_doc(self, doc_url: str) -> str:
-        if doc_url in self.prompt_cache:
-            return self.prompt_cache[doc_url]
-        gdoc = GoogleDoc(doc_url)
-        content = gdoc.read_content()
-        self.prompt_cache[doc_url] = content
-        return content
+        """Return the text of a prompt template; doc_url may also be a local file name or path."""
+        return self.sources.read(doc_url)
 
-    def compose_prompt(self, prompt_urls: List[str], template_vars: Dict[str, Any]) -> List[Dict[str, Any]]:
-        composed_prompts = []
+    @staticmethod
+    def _cache_get(cache: OrderedDict, key: Any) -> Any:
+        if key not in cache:
+            return None
+        cache.move_to_end(key)
+        return cache[key]
 
-        for doc_url in prompt_urls:
-            content = self.load_prompt_from_doc(doc_url)
+    @staticmethod
+    def _cache_put(cache: OrderedDict, key: Any, value: Any, max_size: int):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+    def get_template(self, content: str, _seen: frozenset = frozenset()) -> tuple:
+        """
+        Return (template_key, compiled template, referenced variable names) for template text.
+        The key and variables cover included templates too; the key is None when an include
+        name is computed at render time, since the render then cannot be cached.
+        """
+        content_key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        with self.lock:
+            cached = self._cache_get(self.template_cache, content_key)
+        if cached is None:
+            ast = self.env.parse(content)
             template = self.env.from_string(content)
-            prompt_text = template.render(**template_vars)
+            variables = frozenset(meta.find_undeclared_variables(ast))
+            includes = tuple(meta.find_referenced_templates(ast))
+            cached = (template, variables, includes)
+            with self.lock:
+                self._cache_put(self.template_cache, content_key, cached, self.template_cache_size)
+        template, variables, includes = cached
+        if not includes:
+            return content_key, template, variables
+
+        # Included templates can change independently of this one, so fold their keys in
+        seen = _seen | {content_key}
+        key_parts = [content_key]
+        all_variables = set(variables)
+        for name in includes:
+            if name is None:
+                return None, template, frozenset(all_variables)
+            include_content = self.sources.read(name)
+            if hashlib.sha256(include_content.encode('utf-8')).hexdigest() in seen:
+                raise ValueError(f"Template include cycle through {name}")
+            include_key, _, include_variables = self.get_template(include_content, seen)
+            if include_key is None:
+                return None, template, frozenset(all_variables | include_variables)
+            key_parts.append(include_key)
+            all_variables |= include_variables
+        template_key = hashlib.sha256('|'.join(key_parts).encode('utf-8')).hexdigest()
+        return template_key, template, frozenset(all_variables)
+
+    def get_template_variables(self, doc_url: str) -> frozenset:
+        """Return the names of the context variables a prompt doc references."""
+        try:
+            return self.get_template(self.load_prompt_from_doc(doc_url))[2]
+        except TemplateError as e:
+            raise ValueError(f"Invalid prompt template {doc_url}: {str(e)}")
+
+    @staticmethod
+    def _render_key(template_key: str, variables: frozenset, template_vars: Dict[str, Any]) -> str:
+        """Key a render by template identity and the values of only the variables it references."""
+        referenced = {name: template_vars[name] for name in sorted(variables) if name in template_vars}
+        payload = json.dumps(referenced, sort_keys=True, default=repr)
+        return template_key + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def render_prompt(self, doc_url: str, template_vars: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Render one prompt doc and parse it into a list of message dictionaries."""
+        content = self.load_prompt_from_doc(doc_url)
+        template_key, template, variables = self.get_template(content)
+        render_key = None
+        if template_key is not None:
+            render_key = self._render_key(template_key, variables, template_vars)
+            with self.lock:
+                cached = self._cache_get(self.render_cache, render_key)
+            if cached is not None:
+                return copy.deepcopy(cached)
 
-            try:
-                parsed_content = yaml.safe_load(prompt_text.strip())
+        prompt_text = template.render(**template_vars)
 
-                if isinstance(parsed_content, dict):
-                    parsed_content = [parsed_content]
-                elif not isinstance(parsed_content, list):
-                    raise ValueError(f"Prompt doc {doc_url} must contain a dictionary or list of dictionaries")
+        try:
+            parsed_content = yaml.safe_load(prompt_text.strip())
 
-                composed_prompts.extend(parsed_content)
+            if isinstance(parsed_content, dict):
+                parsed_content = [parsed_content]
+            elif not isinstance(parsed_content, list):
+                raise ValueError(f"Prompt doc {doc_url} must contain a dictionary or list of dictionaries")
 
-            except yaml.YAMLError as e:
-                raise ValueError(f"Failed to parse prompt as YAML in {doc_url}: {str(e)}")
+        except yaml.YAMLError as e:
+            raise ValueError(f"Failed to parse prompt as YAML in {doc_url}: {str(e)}")
+
+        if render_key is not None:
+            with self.lock:
+                self._cache_put(self.render_cache, render_key, parsed_content, self.render_cache_size)
+        return copy.deepcopy(parsed_content)
+
+    def compose_prompt(self, prompt_urls: List[str], template_vars: Dict[str, Any]) -> List[Dict[str, Any]]:
+        composed_prompts = []
+
+        with TRACER.span('render', templates=len(prompt_urls)):
+            for doc_url in prompt_urls:
+                composed_prompts.extend(self.render_prompt(doc_url, template_vars))
 
         return composed_prompts
 
@@ -58,5 +149,9 @@ class PromptManager:
 #         prompts = prompt_manager.compose_prompt([doc_url], template_vars)
 #         print(json.dumps(prompts, indent=2))
 
+#         # Local templates, including ones that {% include %} others
+#         prompts = prompt_manager.compose_prompt(["example_combination.txt"], {"color": "blue"})
+#         print(json.dumps(prompts, indent=2))
+
 #     except Exception as e:
 #         print(f"Error occurred: {str(e)}")
\ No newline at end of file
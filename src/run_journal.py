@@ -0,0 +1,86 @@
+%%capture
+# @title Run Journal
+
+# run_journal.py: Module to record workbench progress on local disk so interrupted runs can resume.
+
+from typing import Dict, Any, List
+import threading
+import hashlib
+import json
+import time
+import os
+
+class RunJournal:
+    """
+    The RunJournal class appends workbench progress to a JSONL file on local disk.
+    Each line records a finished step or a finished row, keyed by run id, row index and step name.
+    Later lines win, so replaying the file gives the latest state of every row.
+    """
+
+    def __init__(self, run_id: str, journal_dir: str = "runs"):
+        self.run_id = run_id
+        self.path = os.path.join(journal_dir, f"{run_id}.jsonl")
+        self.lock = threading.Lock()
+        os.makedirs(journal_dir, exist_ok=True)
+
+    def _append(self, entry: Dict[str, Any]):
+        entry.update({'run_id': self.run_id, 'time': time.time()})
+        line = json.dumps(entry, default=str)
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+                f.flush()
+
+    @staticmethod
+    def row_digest(chain_url: str, chain_input: Any) -> str:
+        """Hash a row's chain and input, so journaled steps are only reused for the same row contents."""
+        encoded = json.dumps([chain_url, chain_input], sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def record_step(self, row_index: Any, step_name: str, output_key: str, value: Any,
+                    fingerprint: str = None, writes: Dict[str, Any] = None, row_digest: str = None):
+        # writes holds context keys the step set besides its output key, so resuming can restore them
+        self._append({'type': 'step', 'row': str(row_index), 'step': step_name,
+                      'output_key': output_key, 'value': value, 'fingerprint': fingerprint,
+                      'writes': writes or {}, 'row_digest': row_digest})
+
+    def record_row(self, row_index: Any, chain_url: str, chain_input: Any, chain_output: Any,
+                   error: str = None):
+        self._append({'type': 'row', 'row': str(row_index), 'chain_url': chain_url,
+                      'chain_input': chain_input, 'chain_output': chain_output, 'error': error})
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Replay the journal into {row: {'steps': {step_name: entry}, 'row': entry or None}}."""
+        rows = {}
+        if not os.path.exists(self.path):
+            return rows
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash; everything before it is intact
+                    continue
+                row = rows.setdefault(entry['row'], {'steps': {}, 'row': None})
+                if entry['type'] == 'step':
+                    row['steps'][entry['step']] = entry
+                else:
+                    row['row'] = entry
+        return rows
+
+    def finished_rows(self) -> List[Dict[str, Any]]:
+        """Finished row entries in row order."""
+        rows = [state['row'] for state in self.load().values() if state['row'] is not None]
+        return sorted(rows, key=lambda entry: int(entry['row']) if entry['row'].isdigit() else entry['row'])
+
+    def reset(self):
+        """Start a fresh journal for this run id."""
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+# if __name__ == "__main__":
+#     journal = RunJournal("example_run")
+#     journal.record_step(0, "initial_analysis", "analysis", "Some analysis")
+#     journal.record_row(0, "https://docs.google.com/document/d/abc/edit", "Some input", "Some output")
+#     print(json.dumps(journal.load(), indent=2))
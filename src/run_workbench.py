@@ -2,6 +2,15 @@
 # @markdown Please enter your Workbench Google Sheet URL and click the **Run Workbench** button:
 
 workbench_sheet_url = ""  # @param {type:"string"}
+max_workers = 4  # @param {type:"integer"}
+use_response_cache = False  # @param {type:"boolean"}
+resume = False  # @param {type:"boolean"}
+incremental = False  # @param {type:"boolean"}
+metrics_port = 0  # @param {type:"integer"}
+trace = False  # @param {type:"boolean"}
+profile_steps = False  # @param {type:"boolean"}
+persist_doc_cache = False  # @param {type:"boolean"}
+output_file = ""  # @param {type:"string"}
 
 # Import the necessary library
 import ipywidgets as widgets
@@ -9,8 +18,20 @@ import ipywidgets as widgets
 
 # Define the function to run when the button is clicked
 def run_workbench(button):
-    workbench = Workbench(workbench_sheet_url)
-    workbench.execute_all_chains()
+    if persist_doc_cache:
+        # Prompt and chain docs survive kernel restarts and are re-downloaded only when edited
+        DOC_CACHE.enable_persistence("cache/documents.json")
+    if metrics_port:
+        # Serves /metrics (Prometheus) and /metrics.json on localhost while the runtime is up
+        METRICS.serve(metrics_port)
+    response_cache = ResponseCache() if use_response_cache else None
+    workbench = Workbench(workbench_sheet_url, max_workers=max_workers,
+                          response_cache=response_cache,
+                          trace_dir="runs" if trace or profile_steps else None,
+                          profile=profile_steps,
+                          # e.g. runs/output.jsonl or runs/output.parquet: full outputs and contexts
+                          sinks=[sink_for_path(output_file)] if output_file else None)
+    workbench.execute_all_chains(resume=resume, incremental=incremental)
     print(f"Workbench Sheet URL set to: {workbench_sheet_url}")
     print("Workbench is now running...")
 
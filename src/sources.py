@@ -0,0 +1,206 @@
+%%capture
+# @title Template Sources
+
+# sources.py: Module to load prompt templates and chain definitions from Google Docs or local directories.
+
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Callable
+from jinja2 import BaseLoader, FileSystemLoader, TemplateNotFound
+import threading
+import os
+
+# Local directories searched for templates and chains referenced by file name, in order
+LOCAL_TEMPLATE_DIRS = [
+    "prompts",
+    "chains",
+    "/content/drive/MyDrive/ColabAgent/prompts",
+    "/content/drive/MyDrive/ColabAgent/chains"
+]
+
+class TemplateSource(ABC):
+    """
+    The TemplateSource class is the abstract base class for places prompt templates and chain
+    definitions are read from. A reference is a Google Docs URL or a local file name or path.
+    """
+
+    @abstractmethod
+    def handles(self, ref: str) -> bool:
+        """True if this source is responsible for ref."""
+        pass
+
+    @abstractmethod
+    def fetch(self, ref: str) -> str:
+        """Return the current text of ref."""
+        pass
+
+    @abstractmethod
+    def revision(self, ref: str) -> str:
+        """Return a cheap identifier that changes whenever ref's text changes."""
+        pass
+
+    def read(self, ref: str) -> str:
+        """Return the text of ref, possibly from a cache."""
+        return self.fetch(ref)
+
+    def revalidate(self, refs: List[str]):
+        """Check many refs for changes at once, where the source can batch the check."""
+        pass
+
+    def prefetch(self, refs: List[str]):
+        """Load many refs ahead of use, raising ValueError for any that cannot be read."""
+        for ref in refs:
+            self.read(ref)
+
+    def get_source(self, environment: Any, ref: str) -> tuple:
+        """Jinja loader protocol: (source, filename, uptodate) for {% include %} and {% import %}."""
+        text = self.read(ref)
+        revision = self.revision(ref)
+        return text, None, lambda: self.revision(ref) == revision
+
+class GoogleDocSource(TemplateSource):
+    """
+    The GoogleDocSource class reads templates and chains from Google Docs URLs through the shared
+    document cache, so a doc is downloaded again only when its Drive version changes.
+    """
+
+    def __init__(self, cache: DocumentCache = None):
+        self.cache = cache
+
+    def handles(self, ref: str) -> bool:
+        return ref.startswith(('https://', 'http://'))
+
+    def fetch(self, ref: str) -> str:
+        return GoogleDoc(ref, cache=self.cache).read_content()
+
+    def revision(self, ref: str) -> str:
+        return self._cache().version(GoogleDoc._extract_document_id(ref))
+
+    def revalidate(self, refs: List[str]):
+        self._cache().revalidate([GoogleDoc._extract_document_id(ref) for ref in refs])
+
+    def prefetch(self, refs: List[str]):
+        self._cache().prefetch([GoogleDoc(ref, cache=self.cache) for ref in refs])
+
+    def _cache(self) -> DocumentCache:
+        return self.cache if self.cache is not None else DOC_CACHE
+
+class LocalDirectorySource(TemplateSource):
+    """
+    The LocalDirectorySource class reads templates and chains from files, found by absolute path or by
+    name relative to a list of search directories. Includes go through a Jinja FileSystemLoader, so an
+    Environment with auto_reload picks up edited files by modification time.
+    """
+
+    def __init__(self, search_path: List[str] = None):
+        self.search_path = list(search_path if search_path is not None else LOCAL_TEMPLATE_DIRS)
+        self.loader = FileSystemLoader(self.search_path, followlinks=True)
+        # {path: (mtime_ns, size, text)}
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def handles(self, ref: str) -> bool:
+        return not ref.startswith(('https://', 'http://'))
+
+    def path(self, ref: str) -> str:
+        """Resolve ref to an existing file, or raise ValueError."""
+        if ref.startswith('file://'):
+            ref = ref[len('file://'):]
+        if os.path.isabs(ref):
+            if os.path.isfile(ref):
+                return ref
+        else:
+            for directory in self.search_path:
+                candidate = os.path.join(directory, ref)
+                if os.path.isfile(candidate):
+                    return candidate
+        raise ValueError(f"Template or chain not found: {ref} (searched {', '.join(self.search_path)})")
+
+    def fetch(self, ref: str) -> str:
+        path = self.path(ref)
+        stat = os.stat(path)
+        with self.lock:
+            cached = self.cache.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        with self.lock:
+            self.cache[path] = (stat.st_mtime_ns, stat.st_size, text)
+        return text
+
+    def revision(self, ref: str) -> str:
+        stat = os.stat(self.path(ref))
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def get_source(self, environment: Any, ref: str) -> tuple:
+        if os.path.isabs(ref) or ref.startswith('file://'):
+            return super().get_source(environment, ref)
+        return self.loader.get_source(environment, ref)
+
+class TemplateSources:
+    """
+    The TemplateSources class picks the source responsible for each reference, so a chain can mix
+    Google Docs and local files. Its jinja_loader() resolves {% include %} through the same sources.
+    """
+
+    def __init__(self, sources: List[TemplateSource]):
+        self.sources = list(sources)
+
+    @classmethod
+    def default(cls, search_path: List[str] = None) -> 'TemplateSources':
+        return cls([GoogleDocSource(), LocalDirectorySource(search_path)])
+
+    def resolve(self, ref: str) -> TemplateSource:
+        if not isinstance(ref, str) or not ref:
+            raise ValueError(f"Invalid template reference: {ref!r}")
+        for source in self.sources:
+            if source.handles(ref):
+                return source
+        raise ValueError(f"No template source can load {ref}")
+
+    def read(self, ref: str) -> str:
+        return self.resolve(ref).read(ref)
+
+    def fetch(self, ref: str) -> str:
+        return self.resolve(ref).fetch(ref)
+
+    def revision(self, ref: str) -> str:
+        return self.resolve(ref).revision(ref)
+
+    def _group(self, refs: List[str]) -> List[tuple]:
+        """[(source, refs)] for the distinct refs, keeping their order."""
+        grouped = {}
+        for ref in dict.fromkeys(refs):
+            source = self.resolve(ref)
+            grouped.setdefault(id(source), (source, []))[1].append(ref)
+        return list(grouped.values())
+
+    def revalidate(self, refs: List[str]):
+        """Revalidate refs grouped by source, e.g. one batched Drive call for all Docs in a chain."""
+        for source, source_refs in self._group(refs):
+            source.revalidate(source_refs)
+
+    def prefetch(self, refs: List[str]):
+        """Load refs grouped by source, e.g. one batched Docs download for all changed docs in a chain."""
+        for source, source_refs in self._group(refs):
+            source.prefetch(source_refs)
+
+    def jinja_loader(self) -> BaseLoader:
+        return SourceLoader(self)
+
+class SourceLoader(BaseLoader):
+    """The SourceLoader class is a Jinja loader that delegates each template name to TemplateSources."""
+
+    def __init__(self, sources: TemplateSources):
+        self.sources = sources
+
+    def get_source(self, environment: Any, template: str) -> tuple:
+        try:
+            return self.sources.resolve(template).get_source(environment, template)
+        except (ValueError, OSError) as e:
+            raise TemplateNotFound(template) from e
+
+# if __name__ == "__main__":
+#     sources = TemplateSources.default(["prompts", "chains"])
+#     print(sources.read("example_combination.txt"))
+#     print(sources.revision("example_chain.yaml"))
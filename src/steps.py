@@ -3,6 +3,11 @@
 
 # steps.py: Module to define step functions for chains.
 
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import asyncio
+import json
+
 @ChainManager.register_step_function("process_with_llm")
 def process_with_llm(
     chain: Any,
@@ -12,4 +17,111 @@ def process_with_llm(
     """Process prompts through LLM and update context"""
     context = chain.get_context()
     composed_prompts = chain.prompt_manager.compose_prompt(prompt_templates, context)
-    return chain.llm_provider.process_prompt(composed_prompts)
\ No newline at end of file
+    on_text, stop_when = chain.stream_callbacks()
+    return chain.llm_provider.process_prompt(composed_prompts, on_text=on_text, stop_when=stop_when)
+
+def _get_items(chain: Any, input_key: str) -> list:
+    """Read a list-valued context key. Strings are parsed as a JSON list, else split into lines."""
+    items = chain.get_context().get(input_key)
+    if items is None:
+        raise ValueError(f"Context key {input_key} is not set")
+    if isinstance(items, str):
+        try:
+            parsed = json.loads(items)
+        except ValueError:
+            parsed = None
+        items = parsed if isinstance(parsed, list) else [line for line in items.splitlines() if line.strip()]
+    return list(items)
+
+def _collect_results(chain: Any, outcomes: list, errors_key: str = None) -> list:
+    """Turn (result, error) pairs into ordered results, recording failed items instead of raising."""
+    results, errors = [], {}
+    for index, (result, error) in enumerate(outcomes):
+        if error is not None:
+            errors[index] = str(error)
+            result = f"ERROR: {str(error)}"
+        results.append(result)
+    if DEBUG and errors:
+        print(f"{len(errors)} of {len(outcomes)} items failed: {errors}")
+    if errors_key:
+        chain.add_to_context(errors_key, errors)
+    return results
+
+@ChainManager.register_step_function("map_with_llm",
+                                     injects=lambda params: {params.get('item_key', 'item'), 'item_index'},
+                                     writes=lambda params: {params['errors_key']} if params.get('errors_key') else set(),
+                                     required_params=('input_key',))
+def map_with_llm(
+    chain: Any,
+    prompt_templates: List[str] = None,
+    debug: bool = False,
+    input_key: str = None,
+    item_key: str = "item",
+    max_concurrency: int = 4,
+    errors_key: str = None
+) -> List[str]:
+    """Render the prompts once per item of a list in the context and process the items concurrently"""
+    items = _get_items(chain, input_key)
+    context = chain.get_context()
+
+    def process_item(index: int, item: Any) -> tuple:
+        try:
+            item_context = dict(context, **{item_key: item, 'item_index': index})
+            composed_prompts = chain.prompt_manager.compose_prompt(prompt_templates, item_context)
+            return chain.llm_provider.process_prompt(composed_prompts), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        # Worker threads do not inherit context variables, so each item runs in a copy of the step's
+        # context: metrics keep the chain and step, and LLM spans nest under the step span
+        futures = [executor.submit(contextvars.copy_context().run, process_item, index, item)
+                   for index, item in enumerate(items)]
+        outcomes = [future.result() for future in futures]
+    return _collect_results(chain, outcomes, errors_key)
+
+@ChainManager.register_async_step_function("map_with_llm")
+async def map_with_llm_async(
+    chain: Any,
+    prompt_templates: List[str] = None,
+    debug: bool = False,
+    input_key: str = None,
+    item_key: str = "item",
+    max_concurrency: int = 4,
+    errors_key: str = None
+) -> List[str]:
+    """Async version of map_with_llm"""
+    items = _get_items(chain, input_key)
+    context = chain.get_context()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def process_item(index: int, item: Any) -> tuple:
+        async with semaphore:
+            try:
+                item_context = dict(context, **{item_key: item, 'item_index': index})
+                composed_prompts = chain.prompt_manager.compose_prompt(prompt_templates, item_context)
+                return await chain.async_llm_provider.process_prompt(composed_prompts), None
+            except Exception as e:
+                return None, e
+
+    outcomes = await asyncio.gather(*[process_item(i, item) for i, item in enumerate(items)])
+    return _collect_results(chain, outcomes, errors_key)
+
+@ChainManager.register_step_function("reduce", injects=lambda params: {params.get('items_key', 'items')},
+                                     required_params=('input_key',))
+def reduce_items(
+    chain: Any,
+    prompt_templates: List[str] = None,
+    debug: bool = False,
+    input_key: str = None,
+    items_key: str = "items",
+    separator: str = "\n\n"
+) -> str:
+    """Combine a list in the context: through the LLM if prompts are given, else by joining the items"""
+    items = [item for item in _get_items(chain, input_key) if item is not None]
+    if not prompt_templates:
+        return separator.join(str(item) for item in items)
+
+    context = dict(chain.get_context(), **{items_key: items})
+    composed_prompts = chain.prompt_manager.compose_prompt(prompt_templates, context)
+    return chain.llm_provider.process_prompt(composed_prompts)
@@ -0,0 +1,260 @@
+%%capture
+# @title Tracing
+
+# tracing.py: Module to record hierarchical timing spans and export them for offline analysis.
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Iterator
+import contextvars
+import threading
+import asyncio
+import cProfile
+import random
+import json
+import time
+import os
+
+class Span:
+    """
+    The Span class records one timed operation.
+    Spans started inside another span become its children and share its trace ID.
+    """
+
+    def __init__(self, name: str, parent: 'Span' = None, attributes: Dict[str, Any] = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes or {})
+        self.track = self._current_track()
+        self.start_ns = time.time_ns()
+        self._start_perf = time.perf_counter_ns()
+        self.end_ns = None
+        self.error = None
+
+    @staticmethod
+    def _current_track() -> str:
+        """The thread, or asyncio task, the span runs on; exporters draw one lane per track."""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            return f"task {task.get_name()}"
+        return threading.current_thread().name
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def finish(self, error: Exception = None):
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._start_perf)
+        if error is not None:
+            self.error = f"{type(error).__name__}: {str(error)}"
+
+class SpanExporter(ABC):
+    """
+    The SpanExporter class is the abstract base class for writing finished spans to a file.
+    """
+
+    @abstractmethod
+    def export(self, spans: List[Span]):
+        pass
+
+class ChromeTraceExporter(SpanExporter):
+    """
+    The ChromeTraceExporter class writes spans in the Chrome trace-event JSON format,
+    which can be opened in chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        tracks = {}
+        events = []
+        pid = os.getpid()
+        for span in spans:
+            tid = tracks.setdefault(span.track, len(tracks) + 1)
+            args = dict(span.attributes)
+            if span.error:
+                args['error'] = span.error
+            events.append({
+                'name': span.name,
+                'cat': span.name.split('.')[0],
+                'ph': 'X',
+                'ts': span.start_ns / 1000,
+                'dur': (span.end_ns - span.start_ns) / 1000,
+                'pid': pid,
+                'tid': tid,
+                'args': args
+            })
+        for track, tid in tracks.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': track}})
+        _write_json(self.path, {'traceEvents': events, 'displayTimeUnit': 'ms'})
+
+class OTLPFileExporter(SpanExporter):
+    """
+    The OTLPFileExporter class writes spans as an OTLP/JSON ExportTraceServiceRequest,
+    the format accepted by OpenTelemetry collectors' file receivers and OTLP/HTTP endpoints.
+    """
+
+    def __init__(self, path: str, service_name: str = "colab-agent"):
+        self.path = path
+        self.service_name = service_name
+
+    @staticmethod
+    def _attribute(key: str, value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {'key': key, 'value': {'boolValue': value}}
+        if isinstance(value, int):
+            return {'key': key, 'value': {'intValue': str(value)}}
+        if isinstance(value, float):
+            return {'key': key, 'value': {'doubleValue': value}}
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+    def export(self, spans: List[Span]):
+        otlp_spans = []
+        for span in spans:
+            otlp_span = {
+                'traceId': span.trace_id,
+                'spanId': span.span_id,
+                'name': span.name,
+                'kind': 1,
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns),
+                'attributes': [self._attribute(key, value) for key, value in span.attributes.items()]
+                              + [self._attribute('thread.name', span.track)],
+                'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+            }
+            if span.parent_id:
+                otlp_span['parentSpanId'] = span.parent_id
+            otlp_spans.append(otlp_span)
+        _write_json(self.path, {'resourceSpans': [{
+            'resource': {'attributes': [self._attribute('service.name', self.service_name)]},
+            'scopeSpans': [{'scope': {'name': 'colab_agent.tracing'}, 'spans': otlp_spans}]
+        }]})
+
+def _write_json(path: str, data: Dict[str, Any]):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, default=str)
+    os.replace(path + '.tmp', path)
+
+# The innermost open span in the current thread or task
+CURRENT_SPAN = contextvars.ContextVar('current_span', default=None)
+
+class Tracer:
+    """
+    The Tracer class creates spans and hands finished spans to its exporters.
+    Tracing is off until enable() is called, so instrumented code costs almost nothing by default.
+    With a profile_dir, profiled() blocks additionally run under cProfile and dump .prof files.
+    """
+
+    def __init__(self, max_spans: int = 200000):
+        self.max_spans = max_spans
+        self.enabled = False
+        self.exporters = []
+        self.profile_dir = None
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def enable(self, exporters: List[SpanExporter], profile_dir: str = None):
+        with self.lock:
+            self.enabled = True
+            self.exporters = list(exporters)
+            self.profile_dir = profile_dir
+            self.spans = []
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def disable(self):
+        with self.lock:
+            self.enabled = False
+            self.exporters = []
+            self.profile_dir = None
+
+    def start_span(self, name: str, **attributes: Any) -> Optional[Span]:
+        """
+        Start a child of the current span without making it current, for work that outlives one
+        block, such as a stream consumed by an async generator. Returns None when tracing is off.
+        """
+        if not self.enabled:
+            return None
+        return Span(name, CURRENT_SPAN.get(), attributes)
+
+    def end_span(self, span: Optional[Span], error: Exception = None):
+        if span is None:
+            return
+        span.finish(error)
+        with self.lock:
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+        """Time the enclosed block as a child of the current span; yields None when tracing is off."""
+        span = self.start_span(name, **attributes)
+        if span is None:
+            yield None
+            return
+        token = CURRENT_SPAN.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            CURRENT_SPAN.reset(token)
+            self.end_span(span, error)
+
+    @contextmanager
+    def root_span(self, name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+        """Start a new trace, ignoring any span that is already open."""
+        token = CURRENT_SPAN.set(None)
+        try:
+            with self.span(name, **attributes) as span:
+                yield span
+        finally:
+            CURRENT_SPAN.reset(token)
+
+    @contextmanager
+    def profiled(self, label: str) -> Iterator[None]:
+        """Run the enclosed block under cProfile when profiling is on, dumping <profile_dir>/<label>.prof."""
+        if not self.enabled or not self.profile_dir:
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one profiler can be active at a time; concurrent steps run unprofiled
+            if DEBUG:
+                print(f"Skipping profile for {label}: another profiler is active")
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            safe_label = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in label)
+            profiler.dump_stats(os.path.join(self.profile_dir, f"{safe_label}.prof"))
+
+    def flush(self):
+        """Export the spans recorded since the last flush."""
+        with self.lock:
+            spans, self.spans = self.spans, []
+            exporters = list(self.exporters)
+        for exporter in exporters:
+            exporter.export(spans)
+        return spans
+
+TRACER = Tracer()
+
+# if __name__ == "__main__":
+#     TRACER.enable([ChromeTraceExporter("runs/example_trace.json"), OTLPFileExporter("runs/example_otlp.json")])
+#     with TRACER.root_span("row", row_index=0):
+#         with TRACER.span("step", step="initial_analysis"):
+#             time.sleep(0.1)
+#     TRACER.flush()
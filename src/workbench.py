@@ -3,66 +3,441 @@
 
 # workbench.py: Module to execute multiple chains using a Google
 
-from typing import Dict, Any, List
-import pandas as pd
+from typing import Dict, Any, List, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import threading
+import asyncio
+import queue
+import json
+import os
 
 DEBUG = True
 
 class Workbench:
     """Manages execution of multiple chains using a Google Sheet template"""
 
-    def __init__(self, sheet_url: str):
+    def __init__(self, sheet_url: str, max_workers: int = 1, output_tab: str = 'output',
+                 output_batch_size: int = 50, output_flush_interval: float = 10.0,
+                 response_cache: ResponseCache = None, stream_dir: str = None,
+                 stop_when: Callable[[str, str], bool] = None, run_id: str = None,
+                 journal_dir: str = "runs", metrics_dir: str = None, trace_dir: str = None,
+                 profile: bool = False, input_chunk_size: int = 1000, sinks: List[OutputSink] = None,
+                 write_sheet: bool = True):
         self.sheet = GoogleSheet(sheet_url)
-        self.chain_manager = ChainManager()
+        self.max_workers = max_workers
+        # Input rows are read this many at a time while earlier rows execute
+        self.input_chunk_size = input_chunk_size
+        self.output_tab = output_tab
+        self.output_batch_size = output_batch_size
+        self.output_flush_interval = output_flush_interval
+        # Finished rows go to these sinks (e.g. JSONLSink, ParquetSink) and, with write_sheet, the output tab
+        self.sinks = list(sinks or [])
+        self.write_sheet = write_sheet
+        self.errors = {}
+        # Shared across rows so compiled templates and renders are reused for the whole run
+        self.prompt_manager = PromptManager()
+        self.llm_provider = AnthropicProvider(cache=response_cache)
+        self.async_llm_provider = None
+        # When set, partial step output is streamed to <stream_dir>/row_<index>_<step>.txt
+        self.stream_dir = stream_dir
+        self.stop_when = stop_when
+        if stream_dir:
+            os.makedirs(stream_dir, exist_ok=True)
+        # Step and row results are journaled locally; the default run id is the spreadsheet ID
+        self.journal = RunJournal(run_id or self.sheet.spreadsheet_id, journal_dir)
+        self.resume_state = {}
+        self.incremental = False
+        # Run metrics are exported as <run_id>_metrics.json and .prom next to the journal by default
+        self.metrics_dir = metrics_dir or journal_dir
+        # When set, spans are written to <trace_dir>/<run_id>_trace.json (Chrome trace events) and
+        # <run_id>_otlp.json (OTLP/JSON); profile also dumps a cProfile .prof file per step
+        self.trace_dir = trace_dir
+        self.profile = profile
 
-    def execute_all_chains(self):
-        """Execute all chains specified in the input tab"""
-        # Read input tab
-        input_df = self.sheet.read_to_dataframe()
-        print(input_df)
+    def _stream_to_file(self, index: int) -> Callable[[str, str], None]:
+        """Return an on_text callback appending a row's deltas to one file per step"""
+        def on_text(step_name: str, delta: str):
+            path = os.path.join(self.stream_dir, f"row_{index}_{step_name}.txt")
+            with open(path, 'a') as f:
+                f.write(delta)
+        return on_text
 
-        # Write headers to output tab
-        headers = ['chain_url', 'chain_input', 'chain_output']
-        self.sheet.update_values('output!A1:C1', [headers])
+    def _create_chain_manager(self, index: int = None, chain_url: str = None, chain_input: Any = None) -> ChainManager:
+        chain_manager = ChainManager(prompt_manager=self.prompt_manager,
+                                     llm_provider=self.llm_provider,
+                                     async_llm_provider=self.async_llm_provider)
+        chain_manager.stop_when = self.stop_when
+        if index is None:
+            return chain_manager
 
-        # Process each chain
-        for _, row in input_df.iterrows():
-            chain_url = row['chain_url']
-            chain_input = row['chain_input']
+        if self.stream_dir:
+            chain_manager.on_text = self._stream_to_file(index)
+        row_digest = RunJournal.row_digest(chain_url, chain_input)
+        chain_manager.on_step_complete = lambda step, result: self.journal.record_step(
+            index, step['name'], step.get('output_key'), result,
+            chain_manager.fingerprints.get(step['name']), chain_manager.step_writes.get(step['name']), row_digest)
 
+        previous_steps = self.resume_state.get(str(index), {}).get('steps', {})
+        if self.incremental:
+            # Steps are re-run only if their fingerprint changed since the journaled run
+            chain_manager.previous_steps = previous_steps
+        else:
+            # Restart a partially finished row from its last journaled step. Steps journaled for other
+            # row contents, or without recorded context writes, cannot be restored faithfully and re-run
+            for entry in previous_steps.values():
+                if 'writes' in entry and entry.get('row_digest') == row_digest:
+                    chain_manager.restore_step(entry['step'], entry['output_key'], entry['value'], entry['writes'])
+        return chain_manager
+
+    def _resumed_output(self, index: int, chain_url: str, chain_input: Any) -> tuple:
+        """Return (True, chain_output) if the same row already finished successfully in the resumed run"""
+        row = self.resume_state.get(str(index), {}).get('row')
+        if self.incremental or row is None or row['error'] is not None:
+            return False, None
+        if row['chain_url'] != chain_url or row['chain_input'] != chain_input:
+            if DEBUG:
+                print(f"Row {index} changed since the resumed run; re-running it")
+            return False, None
+        return True, row['chain_output']
+
+    def _start_run(self, resume: bool, incremental: bool = False):
+        """Load the journal when resuming or re-running incrementally, otherwise start a new one"""
+        self.errors = {}
+        self.incremental = incremental
+        METRICS.reset()
+        # Check every prompt and chain doc for edits once at the start of each run
+        DOC_CACHE.expire()
+        if self.trace_dir:
+            prefix = os.path.join(self.trace_dir, self.journal.run_id)
+            TRACER.enable([ChromeTraceExporter(prefix + '_trace.json'), OTLPFileExporter(prefix + '_otlp.json')],
+                          profile_dir=prefix + '_profiles' if self.profile else None)
+        if incremental:
+            # Keep appending to the same journal; later entries supersede earlier ones
+            self.resume_state = self.journal.load()
+            print(f"Incremental run {self.journal.run_id}: reusing unchanged steps")
+        elif resume:
+            self.resume_state = self.journal.load()
+            print(f"Resuming run {self.journal.run_id}: "
+                  f"{sum(1 for row in self.resume_state.values() if row['row'] and not row['row']['error'])} rows already done")
+        else:
+            self.resume_state = {}
+            self.journal.reset()
+
+    def _finish_run(self, row_count: int):
+        """Report failed rows, print the metrics summary and export the run's metrics"""
+        if self.errors:
+            print(f"{len(self.errors)} of {row_count} rows failed: {sorted(self.errors)}")
+        METRICS.print_summary()
+        prefix = os.path.join(self.metrics_dir, f"{self.journal.run_id}_metrics")
+        METRICS.to_json(prefix + '.json')
+        METRICS.write_prometheus(prefix + '.prom')
+        if self.trace_dir:
+            spans = TRACER.flush()
+            TRACER.disable()
+            print(f"Wrote {len(spans)} spans to {self.trace_dir}")
+
+    def _finish_row(self, sink: OutputSink, index: int, chain_url: str, chain_input: Any,
+                    chain_output: Any, context: Dict[str, Any] = None):
+        with TRACER.span('output.write', row_index=index):
+            self.journal.record_row(index, chain_url, chain_input, chain_output, self.errors.get(index))
+            sink.write_row(make_record(index, chain_url, chain_input, chain_output, context,
+                                       self.errors.get(index)))
+
+    def execute_chain(self, chain_url: str, chain_input: Any, index: int = None) -> Dict[str, Any]:
+        """Execute a single chain in its own ChainManager context"""
+        chain_manager = self._create_chain_manager(index, chain_url, chain_input)
+        chain_manager.load_chain(chain_url)
+        chain_manager.set_input(chain_input)
+        return chain_manager.execute()
+
+    async def execute_chain_async(self, chain_url: str, chain_input: Any, index: int = None) -> Dict[str, Any]:
+        """Execute a single chain on the event loop in its own ChainManager context"""
+        chain_manager = self._create_chain_manager(index, chain_url, chain_input)
+        # Chain loading uses the blocking Google Docs client
+        await asyncio.to_thread(chain_manager.load_chain, chain_url)
+        chain_manager.set_input(chain_input)
+        return await chain_manager.execute_async()
+
+    def _row_output(self, index: int, result: Dict[str, Any] = None, error: Exception = None) -> Any:
+        """Return the output cell for a finished row, recording failures instead of raising"""
+        if error is not None:
+            self.errors[index] = str(error)
+            if DEBUG:
+                print(f"Row {index} failed: {str(error)}")
+            return f"ERROR: {str(error)}"
+
+        chain_output = result.get('chain_output')
+        if DEBUG:
+            print(f"Output: {chain_output}")
+        return chain_output
+
+    def _execute_row(self, index: int, chain_url: str, chain_input: Any) -> tuple:
+        """Execute one input row, returning (chain_output, final context or None)"""
+        done, chain_output = self._resumed_output(index, chain_url, chain_input)
+        if done:
+            return chain_output, None
+        if DEBUG:
+            print(f"Executing chain: {chain_url}")
+            print(f"Input: {chain_input}")
+
+        with TRACER.root_span('row', row_index=index, chain_url=chain_url) as span:
+            try:
+                result = self.execute_chain(chain_url, chain_input, index)
+            except Exception as e:
+                if span is not None:
+                    span.set_attribute('error', str(e))
+                return self._row_output(index, error=e), None
+            return self._row_output(index, result), result
+
+    async def _execute_row_async(self, semaphore: asyncio.Semaphore, index: int,
+                                 chain_url: str, chain_input: Any) -> tuple:
+        """Execute one input row once a concurrency slot is free, returning (chain_output, context)"""
+        done, chain_output = self._resumed_output(index, chain_url, chain_input)
+        if done:
+            return chain_output, None
+        async with semaphore:
             if DEBUG:
                 print(f"Executing chain: {chain_url}")
                 print(f"Input: {chain_input}")
 
-            # Create and execute chain
-            self.chain_manager = ChainManager()
-            self.chain_manager.load_chain(chain_url)
-            self.chain_manager.add_to_context("chain_input", chain_input)
+            with TRACER.root_span('row', row_index=index, chain_url=chain_url) as span:
+                try:
+                    result = await self.execute_chain_async(chain_url, chain_input, index)
+                except Exception as e:
+                    if span is not None:
+                        span.set_attribute('error', str(e))
+                    return self._row_output(index, error=e), None
+                return self._row_output(index, result), result
 
-            result = self.chain_manager.execute()
-            chain_output = result.get('chain_output')
+    def _read_rows(self) -> Iterator[tuple]:
+        """Read the input tab in chunks as (index, chain_url, chain_input) tuples"""
+        rows = self.sheet.iter_rows(chunk_size=self.input_chunk_size, as_dict=True)
+        return ((index, row['chain_url'], row['chain_input']) for index, row in enumerate(rows))
 
-            if DEBUG:
-                print(f"Output: {chain_output}")
+    def _prefetch_rows(self, rows: Iterator[tuple]) -> Iterator[tuple]:
+        """
+        Read rows on a background thread into a queue of at most one chunk, so the next chunk
+        downloads while earlier rows execute. Reader errors are raised to the consumer.
+        """
+        buffer = queue.Queue(maxsize=self.input_chunk_size)
+        done = object()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for row in rows:
+                    while not stop.is_set():
+                        try:
+                            buffer.put(row, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+                buffer.put(done)
+            except Exception as e:
+                buffer.put(e)
+
+        threading.Thread(target=produce, daemon=True, name='sheet-reader').start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Lets the reader exit if the consumer stops early
+            stop.set()
 
-            # Append results to output tab
-            output_data = {
-                'chain_url': [chain_url],
-                'chain_input': [chain_input],
-                'chain_output': [chain_output]
+    def _open_sinks(self) -> SinkGroup:
+        """Return the run's output sinks, including the output tab unless write_sheet is off"""
+        sinks = list(self.sinks)
+        if self.write_sheet:
+            sinks.append(SheetSink(self.sheet, self.output_tab, batch_size=self.output_batch_size,
+                                   flush_interval=self.output_flush_interval))
+        return SinkGroup(sinks)
+
+    def execute_all_chains(self, resume: bool = False, incremental: bool = False):
+        """
+        Execute all chains specified in the input tab.
+        resume skips rows finished by the last run; incremental re-runs every row but only
+        re-executes steps whose input fingerprint changed, plus their dependents.
+        """
+        rows = self._read_rows()
+        self._start_run(resume, incremental)
+        row_count = 0
+
+        with self._open_sinks() as sink:
+            # Each row runs in its own ChainManager. Rows are submitted as they are read and written
+            # in input order, with at most 2 * max_workers in flight so memory stays bounded
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                pending = deque()
+                for row in self._prefetch_rows(rows):
+                    pending.append((row, executor.submit(self._execute_row, *row)))
+                    while pending and (len(pending) > 2 * self.max_workers or pending[0][1].done()):
+                        (index, chain_url, chain_input), future = pending.popleft()
+                        self._finish_row(sink, index, chain_url, chain_input, *future.result())
+                        row_count += 1
+                while pending:
+                    (index, chain_url, chain_input), future = pending.popleft()
+                    self._finish_row(sink, index, chain_url, chain_input, *future.result())
+                    row_count += 1
+
+        self._finish_run(row_count)
+
+    async def execute_all_chains_async(self, max_concurrency: int = 100, resume: bool = False,
+                                       incremental: bool = False):
+        """Execute all chains on the event loop with up to max_concurrency rows in flight"""
+        rows = self._prefetch_rows(self._read_rows())
+        self._start_run(resume, incremental)
+        if self.async_llm_provider is None:
+            self.async_llm_provider = AsyncAnthropicProvider.from_provider(self.llm_provider)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        row_count = 0
+
+        try:
+            row_count = await self._execute_rows_async(rows, semaphore, max_concurrency)
+        finally:
+            # The pooled connections belong to this event loop and are not reused by a later run
+            await AsyncAnthropicProvider.close_shared_clients()
+        self._finish_run(row_count)
+
+    async def _execute_rows_async(self, rows: Iterator[tuple], semaphore: asyncio.Semaphore,
+                                  max_concurrency: int) -> int:
+        """Run rows as tasks and write them in input order; returns the number of rows written"""
+        row_count = 0
+        with self._open_sinks() as sink:
+            pending = deque()
+            while True:
+                # Waiting for the reader must not block the event loop
+                row = await asyncio.to_thread(next, rows, None)
+                if row is None:
+                    break
+                pending.append((row, asyncio.create_task(self._execute_row_async(semaphore, *row))))
+                # Write in input order, keeping at most 2 * max_concurrency rows in flight
+                while pending and (len(pending) > 2 * max_concurrency or pending[0][1].done()):
+                    (index, chain_url, chain_input), task = pending.popleft()
+                    self._finish_row(sink, index, chain_url, chain_input, *(await task))
+                    row_count += 1
+            while pending:
+                (index, chain_url, chain_input), task = pending.popleft()
+                self._finish_row(sink, index, chain_url, chain_input, *(await task))
+                row_count += 1
+        return row_count
+
+    def rebuild_output(self):
+        """Rewrite the output tab and sinks from the run journal without executing anything"""
+        with self._open_sinks() as sink:
+            for row in self.journal.finished_rows():
+                sink.write_row(make_record(row['row'], row['chain_url'], row['chain_input'],
+                                           row['chain_output'], error=row['error']))
+
+    def execute_all_chains_batch(self, state_path: str = None, poll_interval: float = 60.0):
+        """
+        Execute all chains through the Message Batches API, one batch per step across all rows.
+        Progress is saved to state_path after every transition, so an interrupted run resumes
+        polling the outstanding batch instead of resubmitting it.
+        """
+        state_path = state_path or f"batch_{self.sheet.spreadsheet_id}.json"
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+            print(f"Resuming batch run from {state_path}")
+        else:
+            state = {
+                'batch_id': None,
+                'batch_rows': [],
+                'rows': [
+                    {'index': str(index), 'chain_url': chain_url, 'chain_input': chain_input,
+                     'context': {'chain_input': chain_input}, 'step': 0, 'error': None}
+                    for index, chain_url, chain_input in self._read_rows()
+                ]
             }
-            output_df = pd.DataFrame(output_data)
 
-            # Determine the next available row in the output tab
-            current_output = self.sheet.get_values('output!A:C')
-            next_row = len(current_output) + 1
+        def save_state():
+            with open(state_path + '.tmp', 'w') as f:
+                json.dump(state, f, default=str)
+            os.replace(state_path + '.tmp', state_path)
 
-            # Update the output tab
-            range_name = 'output!A:C'  # Assumes A:C columns in output tab
-            current_values = [[str(x) for x in row] for _, row in output_df.iterrows()]
-            self.sheet.update_values(range_name, current_values)
+        # Rebuild each row's ChainManager around its persisted context
+        chains = {}
+        for row in state['rows']:
+            chain_manager = self._create_chain_manager()
+            try:
+                chain_manager.load_chain(row['chain_url'])
+            except Exception as e:
+                row['error'] = str(e)
+            # The persisted context is shared with the state, so the chain's initial context is merged into it
+            for key, value in chain_manager.context.items():
+                row['context'].setdefault(key, value)
+            chain_manager.context = row['context']
+            chain_manager.set_input(row['chain_input'])
+            chains[row['index']] = chain_manager
+
+        def pending_rows():
+            return [row for row in state['rows']
+                    if row['error'] is None and row['step'] < len(chains[row['index']].steps)]
+
+        while state['batch_id'] is not None or pending_rows():
+            if state['batch_id'] is None:
+                requests = {}
+                for row in pending_rows():
+                    chain_manager = chains[row['index']]
+                    step = chain_manager.steps[row['step']]
+                    try:
+                        if chain_manager.is_batchable(step):
+                            requests[f"row-{row['index']}"] = chain_manager.build_step_request(step)
+                        else:
+                            # Local steps run inline and the row moves on
+                            chain_manager.run_step(step)
+                            row['step'] += 1
+                    except Exception as e:
+                        row['error'] = str(e)
+
+                if requests:
+                    state['batch_id'] = self.llm_provider.submit_batch(requests)
+                    state['batch_rows'] = [custom_id[len('row-'):] for custom_id in requests]
+                save_state()
+                continue
+
+            self.llm_provider.wait_for_batch(state['batch_id'], poll_interval)
+            results = self.llm_provider.batch_results(state['batch_id'])
+            rows_by_index = {row['index']: row for row in state['rows']}
+            for index in state['batch_rows']:
+                row = rows_by_index[index]
+                chain_manager = chains[index]
+                text, error = results.get(f"row-{index}", (None, "Missing batch result"))
+                if error is not None:
+                    row['error'] = error
+                    continue
+                chain_manager.apply_step_result(chain_manager.steps[row['step']], text)
+                row['step'] += 1
+            state['batch_id'] = None
+            state['batch_rows'] = []
+            save_state()
+
+        self.errors = {}
+        with self._open_sinks() as sink:
+            for row in state['rows']:
+                if row['error'] is not None:
+                    chain_output = self._row_output(row['index'], error=Exception(row['error']))
+                else:
+                    chain_output = self._row_output(row['index'], row['context'])
+                sink.write_row(make_record(row['index'], row['chain_url'], row['chain_input'], chain_output,
+                                           row['context'], row['error']))
+
+        os.remove(state_path)
+        if self.errors:
+            print(f"{len(self.errors)} of {len(state['rows'])} rows failed: {sorted(self.errors)}")
 
 # if __name__ == "__main__":
 #     sheet_url = "https://docs.google.com/spreadsheets/d/1oGhppbHko50B-AR9qGtqtinwIvmQqY1M3iLOExaKm-Q/edit?gid=0#gid=0"
 #     workbench = Workbench(sheet_url)
+#     workbench.execute_all_chains()
+
+#     # Keep full outputs and contexts on local disk, with the sheet as a summary
+#     workbench = Workbench(sheet_url, sinks=[JSONLSink("runs/output.jsonl")])
 #     workbench.execute_all_chains()
\ No newline at end of file
@@ -0,0 +1,30 @@
+# conftest.py: Shared fixtures that load the notebook cells against the local mock API servers.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import load_test
+import notebook
+from mock_servers import MockAnthropicServer, MockGoogleServer
+
+@pytest.fixture
+def anthropic_server():
+    server = MockAnthropicServer(output_tokens=5).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def google_server():
+    server = MockGoogleServer().start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def ns(anthropic_server, google_server, monkeypatch):
+    """The notebook cells with every Google and Anthropic call going to the mock servers."""
+    monkeypatch.setenv('ANTHROPIC_BASE_URL', anthropic_server.url)
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test')
+    return notebook.load_cells(build=load_test.http_build(google_server.url), offline_llm=False)
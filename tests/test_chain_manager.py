@@ -0,0 +1,184 @@
+import os
+import time
+
+import pytest
+
+import notebook
+
+@pytest.fixture
+def offline_ns():
+    return notebook.load_cells()
+
+def write(path, text: str) -> str:
+    path.write_text(text)
+    return str(path)
+
+def prompt(tmp_path, name: str, variables: list) -> str:
+    content = ' '.join(f"{{{{ {variable} }}}}" for variable in variables)
+    return write(tmp_path / f"{name}.txt", f"- name: {name}\n  role: user\n  content: \"{content}\"\n")
+
+def chain(tmp_path, steps: str, initial_context: str = '') -> str:
+    return write(tmp_path / 'chain.yaml', f"name: test_chain\n{initial_context}steps:\n{steps}")
+
+@pytest.fixture
+def side_effect_steps(offline_ns):
+    ChainManager = offline_ns['ChainManager']
+    seen = {}
+
+    def write_rules(chain, prompt_templates=None, debug=False):
+        time.sleep(0.1)
+        chain.add_to_context('current_rules', 'R1')
+
+    def read_rules(chain, prompt_templates=None, debug=False):
+        seen['rules'] = chain.get_context().get('current_rules')
+        return 'done'
+
+    ChainManager.STEP_FUNCTIONS['write_rules'] = write_rules
+    ChainManager.STEP_FUNCTIONS['read_rules'] = read_rules
+    ChainManager.STEP_FUNCTIONS['noop'] = lambda **kwargs: 'noop'
+    yield seen
+    for name in ('write_rules', 'read_rules', 'noop'):
+        del ChainManager.STEP_FUNCTIONS[name]
+
+def test_undeclared_template_variable_fails_at_load(offline_ns, tmp_path, side_effect_steps):
+    writer = prompt(tmp_path, 'writer', ['chain_input'])
+    reader = prompt(tmp_path, 'reader', ['current_rules'])
+    chain_path = chain(tmp_path, f"""
+  - {{name: generate_rules, output_key: null, prompt_templates: ["{writer}"], step_function: write_rules}}
+  - {{name: solve, output_key: answer, prompt_templates: ["{reader}"], step_function: read_rules}}
+""")
+    with pytest.raises(ValueError, match='solve reads current_rules'):
+        offline_ns['ChainManager']().load_chain(chain_path)
+
+def test_null_initial_context_does_not_declare_an_input(offline_ns, tmp_path):
+    template = prompt(tmp_path, 'summarize', ['text_to_analyze'])
+    chain_path = chain(tmp_path, f"""
+  - {{name: summarize, output_key: summary, prompt_templates: ["{template}"], step_function: process_with_llm}}
+""", initial_context="initial_context:\n  text_to_analyze: null\n")
+    with pytest.raises(ValueError, match='summarize reads text_to_analyze'):
+        offline_ns['ChainManager']().load_chain(chain_path)
+
+def test_initial_context_and_input_as_fill_template_inputs(offline_ns, tmp_path):
+    template = prompt(tmp_path, 'summarize', ['tone', 'text_to_analyze', 'chain_input'])
+    chain_path = chain(tmp_path, f"""
+  - {{name: summarize, output_key: summary, prompt_templates: ["{template}"], step_function: process_with_llm}}
+""", initial_context="initial_context:\n  tone: Academic\ninput_as: text_to_analyze\n")
+    chain_manager = offline_ns['ChainManager']()
+    chain_manager.load_chain(chain_path)
+    chain_manager.set_input('Some text')
+
+    messages = chain_manager.prompt_manager.compose_prompt([template], chain_manager.get_context())
+    assert messages[0]['content'] == 'Academic Some text Some text'
+
+def test_explicit_depends_on_orders_side_effect_writer(offline_ns, tmp_path, side_effect_steps):
+    writer = prompt(tmp_path, 'writer', ['chain_input'])
+    reader = prompt(tmp_path, 'reader', ['current_rules'])
+    chain_path = chain(tmp_path, f"""
+  - {{name: generate_rules, output_key: null, prompt_templates: ["{writer}"], step_function: write_rules}}
+  - {{name: solve, output_key: answer, prompt_templates: ["{reader}"], step_function: read_rules,
+      depends_on: [generate_rules]}}
+""")
+    chain_manager = offline_ns['ChainManager'](max_parallel_steps=4)
+    chain_manager.load_chain(chain_path)
+    assert chain_manager.dependencies['solve'] == {'generate_rules'}
+    chain_manager.execute()
+    assert side_effect_steps['rules'] == 'R1'
+
+def test_steps_without_output_key_are_barriers(offline_ns, tmp_path, side_effect_steps):
+    writer = prompt(tmp_path, 'writer', ['chain_input'])
+    reader = prompt(tmp_path, 'reader', ['chain_input'])
+    chain_path = chain(tmp_path, f"""
+  - {{name: first, output_key: first_output, prompt_templates: ["{reader}"], step_function: noop}}
+  - {{name: generate_rules, output_key: null, prompt_templates: ["{writer}"], step_function: write_rules}}
+  - {{name: solve, output_key: answer, prompt_templates: ["{reader}"], step_function: read_rules}}
+""")
+    chain_manager = offline_ns['ChainManager'](max_parallel_steps=4)
+    chain_manager.load_chain(chain_path)
+    assert chain_manager.dependencies['generate_rules'] == {'first'}
+    assert chain_manager.dependencies['solve'] == {'generate_rules'}
+    chain_manager.add_to_context('chain_input', 'puzzle')
+    chain_manager.execute()
+    assert side_effect_steps['rules'] == 'R1'
+
+def test_repository_chains_load(offline_ns):
+    for text in notebook.chain_documents().values():
+        for step in notebook.yaml.safe_load(text)['steps']:
+            offline_ns['ChainManager'].STEP_FUNCTIONS.setdefault(step['step_function'], lambda **kwargs: None)
+    offline_ns['OFFLINE_DOCS'].store.update(notebook.prompt_documents())
+    offline_ns['OFFLINE_DOCS'].store.update(notebook.chain_documents())
+    for name in notebook.chain_documents():
+        chain_manager = offline_ns['ChainManager']()
+        chain_manager.load_chain(notebook.doc_url(name))
+        if name == 'arc_v1':
+            assert chain_manager.dependencies['solve_puzzle_with_rules'] == {'generate_rules'}
+
+@pytest.fixture
+def split_step(ns):
+    ChainManager = ns['ChainManager']
+    ChainManager.STEP_FUNCTIONS['split_lines'] = lambda chain, **kwargs: chain.get_context()['chain_input'].split('\n')
+    yield
+    del ChainManager.STEP_FUNCTIONS['split_lines']
+
+def map_reduce_chain(tmp_path) -> str:
+    each = prompt(tmp_path, 'each', ['item_index', 'item'])
+    combine = prompt(tmp_path, 'combine', ['items'])
+    return chain(tmp_path, f"""
+  - {{name: split, output_key: parts, step_function: split_lines}}
+  - {{name: summarize_each, output_key: summaries, prompt_templates: ["{each}"], step_function: map_with_llm,
+      params: {{input_key: parts}}}}
+  - {{name: combine, output_key: chain_output, prompt_templates: ["{combine}"], step_function: reduce,
+      params: {{input_key: summaries}}}}
+""")
+
+def test_map_reduce_chain_loads_and_runs(ns, anthropic_server, tmp_path, split_step):
+    chain_manager = ns['ChainManager'](max_parallel_steps=4)
+    # item, item_index and items are supplied by the map and reduce step functions
+    chain_manager.load_chain(map_reduce_chain(tmp_path))
+    assert chain_manager.dependencies == {'split': set(), 'summarize_each': {'split'}, 'combine': {'summarize_each'}}
+    chain_manager.add_to_context('chain_input', 'first\nsecond\nthird')
+    context = chain_manager.execute()
+    assert len(context['summaries']) == 3 and all(s.startswith('lorem') for s in context['summaries'])
+    assert context['chain_output'].startswith('lorem')
+    # One call per item and one for the reduce
+    assert anthropic_server.calls['anthropic.messages'] == 4
+
+def test_map_without_input_key_fails_at_load(offline_ns, tmp_path):
+    each = prompt(tmp_path, 'each', ['item'])
+    chain_path = chain(tmp_path, f"""
+  - {{name: summarize_each, output_key: summaries, prompt_templates: ["{each}"], step_function: map_with_llm}}
+""")
+    with pytest.raises(ValueError, match='summarize_each needs params.input_key'):
+        offline_ns['ChainManager']().load_chain(chain_path)
+
+def test_step_reading_errors_key_waits_for_map(ns, anthropic_server, tmp_path, split_step):
+    each = prompt(tmp_path, 'each', ['item'])
+    report = prompt(tmp_path, 'report', ['failures'])
+    chain_manager = ns['ChainManager'](max_parallel_steps=4)
+    chain_manager.load_chain(chain(tmp_path, f"""
+  - {{name: split, output_key: parts, step_function: split_lines}}
+  - {{name: summarize_each, output_key: summaries, prompt_templates: ["{each}"], step_function: map_with_llm,
+      params: {{input_key: parts, errors_key: failures}}}}
+  - {{name: report, output_key: chain_output, prompt_templates: ["{report}"], step_function: process_with_llm}}
+"""))
+    assert chain_manager.dependencies['report'] == {'summarize_each'}
+    chain_manager.add_to_context('chain_input', 'first\nsecond')
+    context = chain_manager.execute()
+    assert context['failures'] == {}
+    assert context['chain_output'].startswith('lorem')
+
+def test_map_item_spans_nest_under_the_step_span(ns, anthropic_server, tmp_path, split_step):
+    TRACER = ns['TRACER']
+    chain_manager = ns['ChainManager'](max_parallel_steps=1)
+    chain_manager.load_chain(map_reduce_chain(tmp_path))
+    chain_manager.add_to_context('chain_input', 'first\nsecond\nthird')
+    TRACER.enable([])
+    try:
+        chain_manager.execute()
+        spans = TRACER.flush()
+    finally:
+        TRACER.disable()
+
+    step_span = next(span for span in spans if span.attributes.get('step') == 'summarize_each')
+    item_spans = [span for span in spans if span.name == 'http.anthropic.messages'
+                  and span.parent_id == step_span.span_id]
+    assert len(item_spans) == 3
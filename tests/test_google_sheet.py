@@ -0,0 +1,32 @@
+import pytest
+
+import load_test
+
+SHEET_URL = f"https://docs.google.com/spreadsheets/d/{load_test.SPREADSHEET_ID}/edit#gid=0"
+
+def rows_with_blanks():
+    # With chunk_size 3, rows 3-4 are blank at the end of the first chunk and 6-10 span a whole chunk
+    return ([['chain_url', 'chain_input'], ['a', '1'], ['b', '2'], [], [], ['c', '5']]
+            + [[]] * 5 + [['d', '11']])
+
+@pytest.mark.parametrize('grid_rows', [12, 40])
+def test_iter_rows_reads_past_blank_rows_at_chunk_boundaries(ns, google_server, grid_rows):
+    google_server.set_tab(load_test.SPREADSHEET_ID, 'input', rows_with_blanks(), grid_rows=grid_rows)
+    sheet = ns['GoogleSheet'](SHEET_URL)
+    rows = list(sheet.iter_rows(chunk_size=3))
+    # Blank rows keep their place, so row positions still match the sheet
+    assert rows == [('a', '1'), ('b', '2'), ('', ''), ('', ''), ('c', '5')] + [('', '')] * 5 + [('d', '11')]
+
+def test_iter_rows_stops_at_end_of_grid(ns, google_server):
+    google_server.set_tab(load_test.SPREADSHEET_ID, 'input', [['chain_url', 'chain_input'], ['a', '1']],
+                          grid_rows=8)
+    sheet = ns['GoogleSheet'](SHEET_URL)
+    assert list(sheet.iter_rows(chunk_size=3, as_dict=True)) == [{'chain_url': 'a', 'chain_input': '1'}]
+    # Header, then rows 2-4, 5-7 and 8-10: nothing is read past the chunk holding the grid's last row
+    assert google_server.calls['sheets.values.get'] == 4
+
+def test_iter_rows_without_grid_size_stops_at_first_empty_chunk(ns, google_server):
+    google_server.set_tab(load_test.SPREADSHEET_ID, 'input', [['chain_url', 'chain_input'], ['a', '1'], [], ['c', '3']])
+    sheet = ns['GoogleSheet'](SHEET_URL)
+    sheet.grid_rows = None
+    assert list(sheet.iter_rows(chunk_size=2)) == [('a', '1'), ('', ''), ('c', '3')]
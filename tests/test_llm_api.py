@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+from mock_servers import FaultModel
+
+def test_async_client_is_per_event_loop(ns, anthropic_server):
+    AsyncAnthropicProvider = ns['AsyncAnthropicProvider']
+    provider = AsyncAnthropicProvider(base_url=anthropic_server.url, scheduler=None)
+    clients = []
+
+    async def generate():
+        response = await provider.generate(([{'role': 'user', 'content': 'hello'}], None))
+        clients.append(provider.client)
+        return provider.parse_response(response)
+
+    # A second asyncio.run must not reuse connections bound to the first, closed loop
+    assert asyncio.run(generate()).startswith('lorem')
+    assert asyncio.run(generate()).startswith('lorem')
+    assert clients[0] is not clients[1]
+    assert str(clients[1].base_url).startswith(anthropic_server.url)
+    assert anthropic_server.calls['anthropic.messages'] == 2
+
+def test_close_shared_clients(ns, anthropic_server):
+    AsyncAnthropicProvider = ns['AsyncAnthropicProvider']
+
+    async def run():
+        client = AsyncAnthropicProvider.get_shared_client(anthropic_server.url)
+        assert AsyncAnthropicProvider.get_shared_client(anthropic_server.url) is client
+        await AsyncAnthropicProvider.close_shared_clients()
+        return client
+
+    client = asyncio.run(run())
+    assert client.is_closed()
+    assert not any(key[0] == anthropic_server.url for key in AsyncAnthropicProvider.shared_clients)
+
+class FakeClock:
+    """A monotonic clock that only advances when the scheduler sleeps."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def rate_limit_error(ns, retry_after: str):
+    import httpx
+    response = httpx.Response(429, headers={'retry-after': retry_after},
+                              request=httpx.Request('POST', 'http://localhost/v1/messages'))
+    return ns['anthropic'].RateLimitError('rate limited', response=response, body=None)
+
+def test_scheduler_paces_requests_per_minute(ns):
+    clock = FakeClock()
+    scheduler = ns['RateLimitScheduler'](requests_per_minute=50, tokens_per_minute=10 ** 9,
+                                         clock=clock, sleep=clock.sleep)
+    # A full bucket allows a burst of one minute's budget, then one call every 60 / 50 seconds
+    for _ in range(53):
+        scheduler.call(lambda: None, tokens=1)
+    assert sum(clock.sleeps) == pytest.approx(3 * 60 / 50)
+    assert scheduler.metrics()['calls'] == 53
+
+def test_scheduler_paces_tokens_per_minute(ns):
+    clock = FakeClock()
+    scheduler = ns['RateLimitScheduler'](requests_per_minute=10 ** 6, tokens_per_minute=40000,
+                                         clock=clock, sleep=clock.sleep)
+    scheduler.call(lambda: None, tokens=30000)
+    assert clock.sleeps == [0.0]
+    # 20000 tokens short of budget at 40000 tokens per minute
+    scheduler.call(lambda: None, tokens=30000)
+    assert clock.sleeps[-1] == pytest.approx(30.0)
+
+def test_scheduler_honours_retry_after(ns):
+    clock = FakeClock()
+    scheduler = ns['RateLimitScheduler'](base_delay=0.01, max_concurrency=8, clock=clock, sleep=clock.sleep)
+    attempts = []
+
+    def call():
+        attempts.append(clock())
+        if len(attempts) == 1:
+            raise rate_limit_error(ns, '7')
+        return 'ok'
+
+    assert scheduler.call(call, tokens=1) == 'ok'
+    assert attempts[1] - attempts[0] >= 7
+    metrics = scheduler.metrics()
+    assert (metrics['retries'], metrics['throttled'], metrics['concurrency_limit']) == (1, 1, 4)
+    assert scheduler.paused_until == pytest.approx(attempts[0] + 7)
+
+def test_scheduler_gives_up_after_max_retries(ns):
+    clock = FakeClock()
+    scheduler = ns['RateLimitScheduler'](max_retries=2, base_delay=0.01, clock=clock, sleep=clock.sleep)
+
+    def call():
+        raise rate_limit_error(ns, '1')
+
+    with pytest.raises(ns['anthropic'].RateLimitError):
+        scheduler.call(call, tokens=1)
+    assert scheduler.metrics()['retries'] == 2
+    assert scheduler.in_flight == 0
+
+def test_scheduler_retries_mock_server_429s(ns, anthropic_server):
+    anthropic_server.faults = FaultModel(rate_limit_rate=0.5, retry_after=0.01, seed=1)
+    anthropic_server.requests_per_minute = 1234
+    scheduler = ns['RateLimitScheduler'](base_delay=0.001, max_retries=20)
+    provider = ns['AnthropicProvider'](base_url=anthropic_server.url, scheduler=scheduler)
+    for _ in range(6):
+        provider.generate(([{'role': 'user', 'content': 'hello'}], None))
+    injected = anthropic_server.injected['anthropic.messages 429']
+    assert injected > 0
+    assert scheduler.metrics()['throttled'] == injected
+    assert anthropic_server.calls['anthropic.messages'] == 6 + injected
+    # Limits advertised in the response headers are adopted
+    assert scheduler.metrics()['requests_per_minute'] == 1234
+
+def test_async_provider_from_sync_provider(ns, anthropic_server):
+    scheduler = ns['RateLimitScheduler']()
+    provider = ns['AnthropicProvider'](model='claude-test', max_tokens=123, temperature=0.7, scheduler=scheduler,
+                                       base_url=anthropic_server.url, auto_cache=False, min_cache_tokens=2048)
+    async_provider = ns['AsyncAnthropicProvider'].from_provider(provider)
+    assert (async_provider.model, async_provider.max_tokens, async_provider.temperature) == ('claude-test', 123, 0.7)
+    assert async_provider.scheduler is scheduler
+    assert async_provider.base_url == anthropic_server.url
+    assert (async_provider.auto_cache, async_provider.min_cache_tokens) == (False, 2048)
+
+    async def generate():
+        return await async_provider.generate(([{'role': 'user', 'content': 'hello'}], None))
+    assert asyncio.run(generate()).model == 'claude-test'
@@ -0,0 +1,17 @@
+import json
+
+import pytest
+
+import load_test
+
+@pytest.mark.parametrize('chain', ['example_chain', 'podcast_script_generation'])
+def test_load_test_with_drive_length_ids(chain, tmp_path, monkeypatch):
+    # Batched Docs and Drive calls carry the IDs in their Content-ID headers, which fold past ~25 characters
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test')
+    output = tmp_path / 'report.json'
+    load_test.main(['--rows', '4', '--workers', '2', '--chain', chain, '--drive-ids', '--llm-latency', '0',
+                    '--google-latency', '0', '--output-tokens', '5', '--output', str(output)])
+    report = json.loads(output.read_text())
+    assert report['failed_rows'] == 0, report['errors']
+    assert report['output_rows_written'] == 4
+    assert report['api_calls']['google.batch'] >= 1
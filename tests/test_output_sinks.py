@@ -0,0 +1,35 @@
+import json
+import sys
+
+import pytest
+
+import notebook
+
+@pytest.fixture
+def offline_ns():
+    return notebook.load_cells()
+
+def test_row_index_is_an_int_in_every_sink(offline_ns, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    jsonl, parquet = str(tmp_path / 'out.jsonl'), str(tmp_path / 'out.parquet')
+    with offline_ns['SinkGroup']([offline_ns['JSONLSink'](jsonl), offline_ns['ParquetSink'](parquet)]) as sink:
+        # Batch runs pass the index as a string, threaded runs as an int
+        sink.write_row(offline_ns['make_record']('0', 'chain.yaml', 'in', 'out', context={'chain_input': 'in'}))
+        sink.write_row(offline_ns['make_record'](1, 'chain.yaml', 'in', {'answer': 42}))
+
+    records = [json.loads(line) for line in open(jsonl)]
+    assert [record['index'] for record in records] == [0, 1]
+    assert records[1]['chain_output'] == {'answer': 42}
+    table = pq.read_table(parquet)
+    assert table.column('index').to_pylist() == [0, 1]
+    assert table.column('chain_output').to_pylist() == ['out', '{"answer": 42}']
+
+def test_parquet_sink_without_pyarrow_raises_import_error(offline_ns, tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    with pytest.raises(ImportError, match='pip install pyarrow'):
+        offline_ns['ParquetSink'](str(tmp_path / 'out.parquet'))
+
+def test_sheet_sink_truncates_long_cells(offline_ns):
+    SheetSink = offline_ns['SheetSink']
+    cell = SheetSink.__new__(SheetSink).cell('x' * 60000)
+    assert len(cell) == SheetSink.MAX_CELL_CHARS and cell.endswith(SheetSink.TRUNCATED)
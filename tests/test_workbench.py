@@ -0,0 +1,113 @@
+import json
+import os
+
+import pytest
+
+import load_test
+
+SHEET_URL = f"https://docs.google.com/spreadsheets/d/{load_test.SPREADSHEET_ID}/edit#gid=0"
+
+@pytest.fixture
+def workbench_sheet(google_server):
+    load_test.seed_workbench(google_server, ['example_chain'], rows=5, input_words=3)
+    return google_server
+
+def make_workbench(ns, tmp_path, **kwargs):
+    return ns['Workbench'](SHEET_URL, journal_dir=str(tmp_path / 'runs'), **kwargs)
+
+def test_execute_all_chains_batch(ns, anthropic_server, workbench_sheet, tmp_path):
+    state_path = str(tmp_path / 'batch.json')
+    make_workbench(ns, tmp_path).execute_all_chains_batch(state_path=state_path, poll_interval=0)
+
+    output = workbench_sheet.get_tab(load_test.SPREADSHEET_ID, 'output')
+    assert output[0] == ['chain_url', 'chain_input', 'chain_output']
+    assert [row[1] for row in output[1:]] == [f"Row {i}: sample sample sample" for i in range(5)]
+    assert all(row[2].startswith('lorem') for row in output[1:])
+    # One batch per step across all rows, and no per-row Messages calls
+    assert anthropic_server.calls['anthropic.batches.create'] == 2
+    assert anthropic_server.calls['anthropic.messages'] == 0
+    assert not os.path.exists(state_path)
+
+def test_execute_all_chains_batch_resumes_submitted_batch(ns, anthropic_server, workbench_sheet, tmp_path):
+    anthropic_server.batch_polls = 2
+    state_path = str(tmp_path / 'batch.json')
+    workbench = make_workbench(ns, tmp_path)
+
+    def interrupt(batch_id, poll_interval):
+        raise KeyboardInterrupt
+    workbench.llm_provider.wait_for_batch = interrupt
+    with pytest.raises(KeyboardInterrupt):
+        workbench.execute_all_chains_batch(state_path=state_path, poll_interval=0)
+
+    with open(state_path) as f:
+        state = json.load(f)
+    assert state['batch_id'] in anthropic_server.batches
+    assert len(state['batch_rows']) == 5
+
+    # A new run picks up the outstanding batch instead of submitting the first step again
+    make_workbench(ns, tmp_path).execute_all_chains_batch(state_path=state_path, poll_interval=0)
+    assert anthropic_server.calls['anthropic.batches.create'] == 2
+    assert anthropic_server.calls['anthropic.batches.retrieve'] >= 2 * anthropic_server.batch_polls
+    output = workbench_sheet.get_tab(load_test.SPREADSHEET_ID, 'output')
+    assert len(output) == 6 and all(row[2].startswith('lorem') for row in output[1:])
+
+@pytest.fixture
+def rules_chain(ns, tmp_path):
+    """A chain whose first step writes current_rules as a side effect and has no output key."""
+    ChainManager = ns['ChainManager']
+    calls = {'write_rules': 0}
+
+    def write_rules(chain, prompt_templates=None, debug=False):
+        calls['write_rules'] += 1
+        chain.add_to_context('current_rules', 'R1')
+
+    ChainManager.STEP_FUNCTIONS['write_rules'] = write_rules
+    ChainManager.STEP_FUNCTIONS['read_rules'] = lambda chain, **kwargs: chain.get_context().get('current_rules')
+    path = tmp_path / 'rules.yaml'
+    path.write_text("name: rules\nsteps:\n"
+                    "  - {name: generate_rules, output_key: null, step_function: write_rules}\n"
+                    "  - {name: solve, output_key: answer, step_function: read_rules}\n")
+    yield str(path), calls
+    del ChainManager.STEP_FUNCTIONS['write_rules']
+    del ChainManager.STEP_FUNCTIONS['read_rules']
+
+def run_row(workbench, chain_url, chain_input='Some input', **run_kwargs):
+    workbench._start_run(**run_kwargs)
+    chain_manager = workbench._create_chain_manager(0, chain_url, chain_input)
+    chain_manager.load_chain(chain_url)
+    chain_manager.set_input(chain_input)
+    return chain_manager
+
+def test_resume_restores_side_effect_writes(ns, workbench_sheet, tmp_path, rules_chain):
+    chain_url, calls = rules_chain
+    workbench = make_workbench(ns, tmp_path)
+    # The first run is interrupted after the side-effect step
+    chain_manager = run_row(workbench, chain_url, resume=False)
+    chain_manager.run_step(chain_manager.steps[0])
+
+    context = run_row(workbench, chain_url, resume=True).execute()
+    assert calls['write_rules'] == 1
+    assert context['answer'] == 'R1'
+
+def test_incremental_run_replays_side_effect_writes(ns, workbench_sheet, tmp_path, rules_chain):
+    chain_url, calls = rules_chain
+    workbench = make_workbench(ns, tmp_path)
+    run_row(workbench, chain_url, resume=False).execute()
+
+    context = run_row(workbench, chain_url, resume=False, incremental=True).execute()
+    assert calls['write_rules'] == 1
+    assert context['current_rules'] == 'R1' and context['answer'] == 'R1'
+
+def test_resume_reruns_rows_whose_input_changed(ns, workbench_sheet, tmp_path, rules_chain):
+    chain_url, calls = rules_chain
+    workbench = make_workbench(ns, tmp_path)
+    chain_manager = run_row(workbench, chain_url, resume=False)
+    chain_manager.run_step(chain_manager.steps[0])
+    workbench.journal.record_row(0, chain_url, 'Some input', 'R1')
+
+    workbench._start_run(resume=True)
+    assert workbench._resumed_output(0, chain_url, 'Some input') == (True, 'R1')
+    assert workbench._resumed_output(0, chain_url, 'Other input') == (False, None)
+    # Steps journaled for the old input are not restored either
+    run_row(workbench, chain_url, 'Other input', resume=True).execute()
+    assert calls['write_rules'] == 2